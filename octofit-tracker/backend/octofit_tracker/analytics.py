@@ -0,0 +1,432 @@
+"""
+Columnar in-memory activity store for analytics queries
+
+Activities are held as one compact array per column: the user (an index
+into the users seen), the activity type (an index into the types seen),
+the date in epoch seconds, duration, calories, distance (NaN when there
+is none) and whether the activity still exists, plus the _ids in
+ascending order. That is 39 bytes per activity, where a Django Activity
+instance takes well over a kilobyte. Group-by and top-N queries run over
+the columns as vectorized NumPy operations.
+
+The store is optional: activity_stats answers from it when the
+ANALYTICS_STORE setting is on and NumPy is installed, and otherwise has
+Mongo aggregate. It is loaded on first use, then refreshed incrementally
+with the activities whose _id is above the highest one loaded. Updates
+made in this process rewrite the activity's row in place, found by binary
+search on the _ids, and deletes mark it dead. Those made by other
+processes, and inserts whose _id sorts below the watermark (ObjectIds
+from different clients are only roughly ordered), are picked up when it
+is reloaded after ANALYTICS_MAX_AGE seconds. That reload runs in a
+background thread while the current copy keeps answering, and the
+in-process writes made meanwhile are replayed onto the new copy before
+it is swapped in. Dates are kept to the second.
+"""
+import calendar
+import logging
+import math
+import operator
+import threading
+import time
+from array import array
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.db import connections
+from .models import Activity
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+
+# Column -> array typecode
+COLUMNS = {
+    'user': 'I',
+    'type': 'H',
+    'date': 'I',
+    'duration': 'i',
+    'calories': 'i',
+    'distance': 'd',
+    'live': 'B',
+}
+
+TOTALS = ('activities', 'calories', 'duration', 'distance')
+
+COMPARISONS = {
+    '$gt': operator.gt,
+    '$gte': operator.ge,
+    '$lt': operator.lt,
+    '$lte': operator.le,
+}
+
+PROJECTION = {'user_id': 1, 'activity_type': 1, 'date': 1, 'duration': 1, 'calories': 1, 'distance': 1}
+
+ID_SIZE = 12
+
+SECONDS_PER_DAY = 86400
+
+logger = logging.getLogger('octofit_tracker.analytics')
+
+
+def epoch(value):
+    """
+    A datetime as whole epoch seconds; naive values are UTC, as Mongo
+    returns them
+    """
+    if value is None:
+        return 0
+    if value.tzinfo is not None:
+        value = value.astimezone(dt_timezone.utc)
+    return max(calendar.timegm(value.timetuple()), 0)
+
+
+def day_key(day):
+    return datetime.fromtimestamp(day * SECONDS_PER_DAY, dt_timezone.utc).strftime('%Y-%m-%d')
+
+
+def week_key(day):
+    year, week, _ = datetime.fromtimestamp(day * SECONDS_PER_DAY, dt_timezone.utc).isocalendar()
+    return f'{year}-W{week:02d}'
+
+
+def activity_document(activity):
+    """
+    The stored fields of an Activity instance, as the store reads them from Mongo
+    """
+    return {'_id': activity._id, **{field: getattr(activity, field) for field in PROJECTION}}
+
+
+def key_order(key):
+    # Mongo sorts null before any other value
+    return key is not None, key
+
+
+def group_key(group):
+    return key_order(group['_id'])
+
+
+class ActivityStore:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.clear()
+
+    def __len__(self):
+        return len(self.columns['user'])
+
+    def clear(self):
+        self.columns = {name: array(typecode) for name, typecode in COLUMNS.items()}
+        self.ids = bytearray()
+        self.users, self._user_codes = [], {}
+        self.types, self._type_codes = [], {}
+        self.watermark = None
+        self.loaded_at = self.refreshed_at = None
+        self._changes = None
+
+    @property
+    def nbytes(self):
+        """
+        Bytes held by the columns and _ids
+        """
+        return sum(column.itemsize * len(column) for column in self.columns.values()) + len(self.ids)
+
+    def bytes_per_activity(self):
+        return self.nbytes / len(self) if len(self) else 0.0
+
+    def invalidate(self):
+        """
+        Force a full reload from Mongo on next use
+        """
+        self.loaded_at = None
+
+    def mark_inserted(self):
+        """
+        Look for new activities on next use rather than after the refresh interval
+        """
+        self.refreshed_at = None
+
+    def saved(self, document):
+        """
+        Rewrite the row of an activity updated in this process; one that
+        isn't loaded yet is left for the next refresh
+        """
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append(('saved', document))
+            row = self._row(document['_id'])
+            if row is None:
+                self.mark_inserted()
+                return
+            for name, value in self._values(document).items():
+                self.columns[name][row] = value
+
+    def deleted(self, activity_id):
+        """
+        Drop an activity deleted in this process from the totals
+        """
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append(('deleted', activity_id))
+            row = self._row(activity_id)
+            if row is not None:
+                self.columns['live'][row] = 0
+
+    def load(self):
+        """
+        Replace the contents with every activity; returns how many were loaded
+        """
+        with self._lock:
+            self.clear()
+            loaded = self.refresh()
+            self.loaded_at = time.monotonic()
+            return loaded
+
+    def refresh(self):
+        """
+        Append the activities inserted since the last load or refresh;
+        returns how many were added
+        """
+        with self._lock:
+            query = {} if self.watermark is None else {'_id': {'$gt': self.watermark}}
+            added = 0
+            for document in Activity.objects.mongo_find(query, PROJECTION, sort=[('_id', 1)]):
+                self.append(document)
+                self.watermark = document['_id']
+                added += 1
+            self.refreshed_at = time.monotonic()
+            return added
+
+    def reload(self):
+        """
+        Load a fresh copy without holding the lock, so the current one
+        keeps answering, then swap it in with the writes made in this
+        process meanwhile applied; returns how many activities were loaded
+        """
+        with self._lock:
+            self._changes = []
+        fresh = ActivityStore()
+        try:
+            loaded = fresh.load()
+        except Exception:
+            with self._lock:
+                self._changes = None
+            raise
+        with self._lock:
+            changes, self._changes = self._changes, None
+            if self.loaded_at is None:
+                # Invalidated meanwhile: the copy may predate what called for it
+                return 0
+            fresh.refresh()
+            for method, argument in changes:
+                getattr(fresh, method)(argument)
+            self.columns, self.ids = fresh.columns, fresh.ids
+            self.users, self._user_codes = fresh.users, fresh._user_codes
+            self.types, self._type_codes = fresh.types, fresh._type_codes
+            self.watermark = fresh.watermark
+            self.loaded_at, self.refreshed_at = fresh.loaded_at, fresh.refreshed_at
+            return loaded
+
+    def append(self, document):
+        for name, value in self._values(document).items():
+            self.columns[name].append(value)
+        self.ids += document['_id'].binary
+
+    def _values(self, document):
+        distance = document.get('distance')
+        return {
+            'user': self._code(document.get('user_id'), self.users, self._user_codes),
+            'type': self._code(document.get('activity_type'), self.types, self._type_codes),
+            'date': epoch(document.get('date')),
+            'duration': document.get('duration') or 0,
+            'calories': document.get('calories') or 0,
+            'distance': math.nan if distance is None else distance,
+            'live': 1,
+        }
+
+    def _row(self, activity_id):
+        """
+        The row of an activity, or None; _ids are appended in ascending order
+        """
+        key, ids = activity_id.binary, self.ids
+        low, high = 0, len(ids) // ID_SIZE
+        while low < high:
+            middle = (low + high) // 2
+            if ids[middle * ID_SIZE:(middle + 1) * ID_SIZE] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low if ids[low * ID_SIZE:(low + 1) * ID_SIZE] == key else None
+
+    def group(self, group_by, match, top=None):
+        """
+        Totals per activity_type, day, week or user of the activities
+        matching an activity_match() filter, shaped like the Mongo $group
+        output and sorted by key, or by calories then key when only the
+        top groups are wanted. None when the filter has a condition the
+        store can't evaluate.
+        """
+        with self._lock:
+            summed = self._sums(group_by, match)
+            if summed is None:
+                return None
+            codes, sums = summed
+            if group_by == 'user':
+                decode = self.users.__getitem__
+            elif group_by == 'activity_type':
+                decode = self.types.__getitem__
+            else:
+                decode = day_key if group_by == 'day' else week_key
+
+        positions = range(len(codes))
+        # Weeks are folded from days below, so only keys that are unique
+        # per code can be cut to the top ones here. Ties on calories go to
+        # the lower key, as with Mongo's {calories: -1, _id: 1} sort.
+        if top is not None and group_by != 'week' and top < len(codes):
+            positions = numpy.lexsort((self._key_ranks(codes, decode, group_by), -sums['calories']))[:top]
+        groups = defaultdict(lambda: dict.fromkeys(TOTALS, 0))
+        for position in positions:
+            group = groups[decode(int(codes[position]))]
+            group['activities'] += int(sums['activities'][position])
+            group['calories'] += int(round(sums['calories'][position]))
+            group['duration'] += int(round(sums['duration'][position]))
+            group['distance'] += float(sums['distance'][position])
+
+        results = sorted(({'_id': key, **totals} for key, totals in groups.items()), key=group_key)
+        if top is not None:
+            results = sorted(results, key=lambda group: (-group['calories'], *group_key(group)))[:top]
+        return results
+
+    def _key_ranks(self, codes, decode, group_by):
+        """
+        The position of each code's key in key order; day codes already
+        sort like their keys, user and type codes are in order of arrival
+        """
+        if group_by == 'day':
+            return codes
+        keys = [decode(int(code)) for code in codes]
+        in_order = sorted(range(len(keys)), key=lambda position: key_order(keys[position]))
+        ranks = numpy.empty(len(keys), dtype=numpy.intp)
+        ranks[in_order] = numpy.arange(len(keys))
+        return ranks
+
+    def _sums(self, group_by, match):
+        """
+        The distinct group codes of the matching activities and the totals
+        per code, or None. Called with the lock held: the column views
+        must be gone before an append, an array can't grow while a view of
+        its buffer exists.
+        """
+        views = {name: numpy.frombuffer(column, dtype=column.typecode) for name, column in self.columns.items()}
+        mask = self._mask(views, match)
+        if mask is None:
+            return None
+        if group_by in ('user', 'activity_type'):
+            keys = views['user' if group_by == 'user' else 'type']
+        else:
+            keys = views['date'] // SECONDS_PER_DAY
+        codes, inverse = numpy.unique(keys[mask], return_inverse=True)
+        sums = {'activities': numpy.bincount(inverse, minlength=len(codes))}
+        for total in ('calories', 'duration', 'distance'):
+            weights = views[total][mask]
+            if total == 'distance':
+                weights = numpy.nan_to_num(weights)
+            sums[total] = numpy.bincount(inverse, weights=weights, minlength=len(codes))
+        return codes, sums
+
+    def _mask(self, views, match):
+        mask = views['live'].astype(bool)
+        for field, condition in match.items():
+            if field == 'user_id':
+                if isinstance(condition, dict):
+                    if list(condition) != ['$in']:
+                        return None
+                    user_ids = condition['$in']
+                else:
+                    user_ids = [condition]
+                codes = [self._user_codes[user_id] for user_id in user_ids if user_id in self._user_codes]
+                mask &= numpy.isin(views['user'], numpy.array(codes, dtype=views['user'].dtype))
+            elif field == 'activity_type':
+                if not isinstance(condition, str):
+                    return None
+                code = self._type_codes.get(condition)
+                mask &= False if code is None else views['type'] == code
+            elif field in ('date', 'duration', 'calories', 'distance') and isinstance(condition, dict):
+                for operation, value in condition.items():
+                    if operation not in COMPARISONS:
+                        return None
+                    if field == 'date':
+                        value = epoch(value)
+                    mask &= COMPARISONS[operation](views[field], value)
+            else:
+                return None
+        return mask
+
+    def _code(self, value, values, codes):
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(values)
+            values.append(value)
+        return code
+
+
+activity_store = ActivityStore()
+_load_lock = threading.Lock()
+
+
+def get_activity_store():
+    """
+    The shared store, loaded from Mongo when missing, reloaded in the
+    background when stale, and refreshed with new activities every
+    ANALYTICS_REFRESH_INTERVAL
+    """
+    max_age = getattr(settings, 'ANALYTICS_MAX_AGE', 300)
+    interval = getattr(settings, 'ANALYTICS_REFRESH_INTERVAL', 1.0)
+    if activity_store.loaded_at is None:
+        with _load_lock:
+            if activity_store.loaded_at is None:
+                activity_store.load()
+        return activity_store
+    if time.monotonic() - activity_store.loaded_at > max_age:
+        reload_in_background()
+    if activity_store.refreshed_at is None or time.monotonic() - activity_store.refreshed_at > interval:
+        activity_store.refresh()
+    return activity_store
+
+
+def reload_in_background():
+    """
+    Start reloading the shared store in a thread unless a load is already
+    under way; returns the thread, or None
+    """
+    if not _load_lock.acquire(blocking=False):
+        return None
+
+    def run():
+        try:
+            activity_store.reload()
+        except Exception:
+            logger.exception('Reloading the analytics store failed')
+        finally:
+            _load_lock.release()
+            connections.close_all()
+
+    thread = threading.Thread(target=run, name='octofit-analytics-reload', daemon=True)
+    thread.start()
+    return thread
+
+
+def store_enabled():
+    return numpy is not None and getattr(settings, 'ANALYTICS_STORE', False)
+
+
+def analytics_groups(group_by, match, top=None):
+    """
+    activity_stats groups from the store, or None when it is disabled or
+    can't answer the filter; teams are grouped per user for the caller to fold
+    """
+    if not store_enabled():
+        return None
+    if group_by == 'team':
+        return get_activity_store().group('user', match)
+    return get_activity_store().group(group_by, match, top)
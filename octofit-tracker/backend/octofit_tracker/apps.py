@@ -0,0 +1,13 @@
+from django.apps import AppConfig
+
+
+class OctofitTrackerConfig(AppConfig):
+    name = 'octofit_tracker'
+    verbose_name = 'OctoFit Tracker'
+    
+    def ready(self):
+        # Connect the model signal handlers that keep denormalized data in sync
+        from . import signals  # noqa: F401
+        # Before any Mongo client exists, so every client reports to it
+        from .metrics import install_query_listener
+        install_query_listener()
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
 
 application = get_asgi_application()
+
+# Run background jobs in this process (TASK_WORKERS threads)
+from octofit_tracker.tasks import start_workers  # noqa: E402
+
+start_workers()
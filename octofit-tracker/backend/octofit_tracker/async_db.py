@@ -0,0 +1,91 @@
+"""
+MongoDB access for the async views
+
+djongo pins pymongo 3.12, which rules out motor 3 (pymongo 4 only), and
+motor 2 no longer imports on current Python. The async views therefore
+run pymongo on a dedicated thread pool sized to the client's connection
+pool: the event loop never blocks on Mongo and keeps serving other
+requests while queries are in flight.
+"""
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from pymongo import MongoClient
+from .repository import object_ids, plain
+
+
+_lock = threading.Lock()
+_clients = {}
+_executor = None
+
+
+def get_client(alias=DEFAULT_DB_ALIAS):
+    """
+    A pooled client configured from the DATABASES entry djongo uses
+    """
+    with _lock:
+        if alias not in _clients:
+            _clients[alias] = MongoClient(
+                **connections[alias].settings_dict.get('CLIENT', {}),
+                maxPoolSize=getattr(settings, 'ASYNC_MONGO_MAX_POOL_SIZE', 100),
+                tz_aware=True
+            )
+        return _clients[alias]
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'ASYNC_MONGO_MAX_POOL_SIZE', 100),
+                thread_name_prefix='octofit-mongo'
+            )
+        return _executor
+
+
+async def run(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    # Carry the caller's context along so query metrics reach its request
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_executor(), partial(context.run, func, *args, **kwargs))
+
+
+class AsyncCollection:
+    """
+    The awaitable subset of a pymongo collection the async views need
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def find(self, *args, **kwargs):
+        return await run(lambda: list(self.collection.find(*args, **kwargs)))
+
+
+def get_async_collection(model, alias=DEFAULT_DB_ALIAS):
+    # The name is read per call: tests swap in the test database's name
+    database = get_client(alias)[connections[alias].settings_dict['NAME']]
+    return AsyncCollection(database[model._meta.db_table])
+
+
+async def resolve_lookup_async(model, ids, projection=None):
+    """
+    serializers.resolve_lookup for the async path: names, or documents with
+    the projected fields when projection is given
+    """
+    ids = object_ids(ids)
+    if not ids:
+        return {}
+    fields = ['name'] if projection is None else list(projection)
+    documents = await get_async_collection(model).find({'_id': {'$in': ids}}, fields)
+    if projection is None:
+        return {document['_id']: document['name'] for document in documents}
+    return {
+        document['_id']: {'id': str(document['_id']), **{field: plain(document.get(field)) for field in fields}}
+        for document in documents
+    }
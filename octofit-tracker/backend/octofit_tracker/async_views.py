@@ -0,0 +1,104 @@
+"""
+Async read path for the hot list endpoints
+
+The views query Mongo directly (see async_db) instead of going through
+djongo, without blocking the event loop, so one worker can serve many
+concurrent list requests.
+
+Each view mirrors a DRF viewset's list: same serializer, cursor ordering
+and keyset pagination, so /api/async/<name>/ returns what /api/<name>/
+returns, ?fields= and ?expand= included. Lookups are fetched concurrently
+and handed to the serializer through its context, the way
+NameLookupListSerializer primes it.
+"""
+import asyncio
+from asgiref.sync import sync_to_async
+from django.db import DEFAULT_DB_ALIAS
+from django.http import JsonResponse
+from django.views import View
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.utils.encoders import JSONEncoder
+from .async_db import get_async_collection, resolve_lookup_async
+from .pagination import KeysetPagination
+
+
+def instance_from_document(model, document):
+    fields = model._meta.concrete_fields
+    return model.from_db(
+        DEFAULT_DB_ALIAS,
+        [field.attname for field in fields],
+        [document.get(field.column) for field in fields]
+    )
+
+
+class AsyncListView(View):
+    """
+    Read-only async counterpart of a viewset's list action, filtered by
+    the viewset's list_query() when it has one (see RepositoryListMixin);
+    ?around= is ignored
+    """
+    viewset = None
+    http_method_names = ['get']
+
+    async def get(self, request):
+        request = Request(request)
+        try:
+            data = await self.list(request)
+        except APIException as error:
+            return JsonResponse({'detail': error.detail}, status=error.status_code, encoder=JSONEncoder)
+        return JsonResponse(data, encoder=JSONEncoder)
+
+    async def list(self, request):
+        model = self.viewset.queryset.model
+        paginator = KeysetPagination()
+        ordering, position = paginator.start(
+            request,
+            model,
+            getattr(self.viewset, 'cursor_ordering', None),
+            getattr(self.viewset, 'cursor_nulls_last', ())
+        )
+        query = await sync_to_async(self.list_query)(request)
+        if position is not None:
+            after = paginator.mongo_after(ordering, position)
+            query = {'$and': [query, after]} if query else after
+        documents = []
+        for read_query, sort in paginator.mongo_reads(query, ordering):
+            documents += await get_async_collection(model).find(
+                read_query,
+                sort=sort,
+                limit=paginator.page_size + 1 - len(documents)
+            )
+            if len(documents) > paginator.page_size:
+                break
+        rows = paginator.finish([instance_from_document(model, document) for document in documents], position)
+
+        context = {'request': request}
+        serializer = self.viewset.serializer_class(context=context)
+        await self.prime_lookups(serializer, rows)
+        return {
+            'next': paginator.get_next_link(),
+            'previous': paginator.get_previous_link(),
+            'results': [serializer.to_representation(row) for row in rows],
+        }
+
+    def list_query(self, request):
+        """
+        The viewset's list filter; sync, as it may read team members
+        """
+        viewset = self.viewset()
+        return viewset.list_query(request) if hasattr(viewset, 'list_query') else {}
+
+    async def prime_lookups(self, serializer, rows):
+        """
+        Resolve the serializer's lookups concurrently into its context
+        """
+        if not hasattr(serializer, 'pending_lookups'):
+            return
+        lookups = serializer.pending_lookups()
+        resolved = await asyncio.gather(*(
+            resolve_lookup_async(model, {getattr(row, attr) for row in rows}, projection)
+            for _, attr, model, projection in lookups
+        ))
+        for (context_key, _, _, _), values in zip(lookups, resolved):
+            serializer.context[context_key] = values
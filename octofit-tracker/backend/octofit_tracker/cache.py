@@ -0,0 +1,162 @@
+"""
+Response caching for read-heavy endpoints
+
+Rendered responses are cached per URL, query string and Accept header.
+Every cache key also embeds the current version of the namespaces the
+response depends on ("leaderboard", "activities:user:<id>", ...), so a
+write invalidates exactly the responses built from the data it touched by
+bumping those versions; stale entries are never read again and age out.
+
+Cached responses carry an ETag, and a matching If-None-Match gets a 304.
+"""
+import hashlib
+import threading
+import time
+from functools import partial, wraps
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from .fields import to_object_id
+
+
+GLOBAL_NAMESPACE = 'global'
+
+_counter_lock = threading.Lock()
+_counters = {'hits': 0, 'misses': 0, 'not_modified': 0}
+
+
+def get_cache():
+    return caches[getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')]
+
+
+def count(name):
+    with _counter_lock:
+        _counters[name] += 1
+
+
+def cache_stats():
+    with _counter_lock:
+        return dict(_counters)
+
+
+def version_key(namespace):
+    return f'octofit:ns:{namespace}'
+
+
+def namespace_versions(namespaces):
+    """
+    Current version of each namespace; a missing (never bumped or evicted)
+    version gets a fresh unique value so old entries can't match it
+    """
+    cache = get_cache()
+    keys = [version_key(namespace) for namespace in (GLOBAL_NAMESPACE, *namespaces)]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def invalidate(*namespaces):
+    """
+    Bump the namespaces so every response built from them is recomputed
+    """
+    get_cache().set_many({version_key(namespace): time.time_ns() for namespace in namespaces}, None)
+
+
+def invalidate_all():
+    invalidate(GLOBAL_NAMESPACE)
+
+
+def response_key(request, namespaces):
+    query = sorted(request.query_params.lists())
+    parts = [
+        request.build_absolute_uri(request.path),
+        repr(query),
+        request.META.get('HTTP_ACCEPT', ''),
+        repr(namespace_versions(namespaces)),
+    ]
+    return 'octofit:response:' + hashlib.sha1('|'.join(parts).encode()).hexdigest()
+
+
+def cached_response(request, namespaces, produce):
+    """
+    Serve the response for request from the cache, calling produce() to
+    build (and store) it on a miss; only 200 JSON responses are cached
+    """
+    cache = get_cache()
+    key = response_key(request, namespaces)
+    entry = cache.get(key)
+    if entry is None:
+        count('misses')
+        response = produce()
+        # The browsable API embeds per-user CSRF tokens and forms
+        if response.status_code != 200 or request.accepted_renderer.format == 'api':
+            return response
+        view = request.parser_context['view']
+        response = view.finalize_response(request, response)
+        response.render()
+        entry = {
+            'content': response.content,
+            'content_type': response['Content-Type'],
+            'etag': '"%s"' % hashlib.md5(response.content).hexdigest(),
+        }
+        cache.set(key, entry, getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300))
+    else:
+        count('hits')
+        response = None
+
+    if entry['etag'] in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        count('not_modified')
+        response = HttpResponseNotModified()
+    elif response is None:
+        response = HttpResponse(entry['content'], content_type=entry['content_type'])
+    response['ETag'] = entry['etag']
+    response['Cache-Control'] = 'no-cache'
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+class CachedResponseMixin:
+    """
+    Cache list and retrieve responses of a viewset under the namespaces
+    returned by get_cache_namespaces()
+    """
+    cache_namespaces = ()
+
+    def get_cache_namespaces(self, request):
+        return self.cache_namespaces
+
+    def list(self, request, *args, **kwargs):
+        produce = partial(super().list, request, *args, **kwargs)
+        return cached_response(request, self.get_cache_namespaces(request), produce)
+
+    def retrieve(self, request, *args, **kwargs):
+        produce = partial(super().retrieve, request, *args, **kwargs)
+        return cached_response(request, self.get_cache_namespaces(request), produce)
+
+
+def cache_api_view(*namespaces):
+    """
+    Cache a function-based view; apply it beneath @api_view
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(request, *args, **kwargs):
+            return cached_response(request, namespaces, partial(func, request, *args, **kwargs))
+        return wrapper
+    return decorator
+
+
+def activity_namespaces(user_id=None):
+    """
+    The namespaces of a user's activities, or of all of them; the id is
+    normalized so a query string and an ObjectId name the same namespace
+    """
+    user_id = to_object_id(user_id)
+    if user_id is not None:
+        return [f'activities:user:{user_id}']
+    return ['activities']
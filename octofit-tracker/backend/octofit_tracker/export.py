@@ -0,0 +1,120 @@
+"""
+Streaming activity export
+
+Activities are read from a server-side cursor a batch at a time, user
+names are resolved with one query per batch, and each batch is encoded
+and handed to the response before the next one is fetched. Nothing is
+accumulated across batches, so memory stays bounded by the batch size
+however many rows are exported.
+"""
+import csv
+import json
+from datetime import timezone as dt_timezone
+from itertools import islice
+from django.http import StreamingHttpResponse
+from .models import User, Activity
+from .repository import fetch_names, plain
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+EXPORT_BATCH_SIZE = 2000
+
+COLUMNS = ['id', 'user_id', 'user_name', 'activity_type', 'duration', 'distance', 'calories', 'date', 'notes']
+
+PROJECTION = {column: 1 for column in COLUMNS if column not in ('id', 'user_name')}
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+def format_date(value):
+    """
+    ISO 8601 in UTC with a "Z" suffix, as the API renders dates
+    """
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(dt_timezone.utc).replace(tzinfo=None)
+    return value.isoformat() + 'Z'
+
+
+def export_batches(match, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Yield lists of export rows (dicts keyed by COLUMNS) for the activities
+    matching the filter, newest first
+    """
+    cursor = Activity.objects.mongo_find(
+        match,
+        PROJECTION,
+        sort=[('date', -1), ('_id', -1)],
+        batch_size=batch_size
+    )
+    while True:
+        documents = list(islice(cursor, batch_size))
+        if not documents:
+            return
+        names = fetch_names(User, {document.get('user_id') for document in documents})
+        yield [
+            {
+                'id': str(document['_id']),
+                'user_id': plain(document.get('user_id')),
+                'user_name': names.get(document.get('user_id'), 'Unknown User'),
+                'activity_type': document.get('activity_type'),
+                'duration': document.get('duration'),
+                'distance': document.get('distance'),
+                'calories': document.get('calories'),
+                'date': format_date(document.get('date')),
+                'notes': document.get('notes'),
+            }
+            for document in documents
+        ]
+
+
+def dumps(row):
+    if orjson is not None:
+        return orjson.dumps(row)
+    return json.dumps(row, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def ndjson_stream(batches):
+    for rows in batches:
+        yield b''.join(dumps(row) + b'\n' for row in rows)
+
+
+class LineBuffer:
+    """
+    A write-only file for csv.writer that hands back what was written
+    """
+    def write(self, value):
+        return value
+
+
+def csv_stream(batches):
+    writer = csv.writer(LineBuffer())
+    yield writer.writerow(COLUMNS).encode()
+    for rows in batches:
+        yield ''.join(writer.writerow([row[column] for column in COLUMNS]) for row in rows).encode()
+
+
+STREAMS = {
+    'ndjson': ndjson_stream,
+    'csv': csv_stream,
+}
+
+
+def export_response(match, export_format, batch_size=EXPORT_BATCH_SIZE):
+    """
+    A StreamingHttpResponse exporting the matching activities as NDJSON or CSV
+    """
+    response = StreamingHttpResponse(
+        STREAMS[export_format](export_batches(match, batch_size)),
+        content_type=CONTENT_TYPES[export_format]
+    )
+    response['Content-Disposition'] = f'attachment; filename="activities.{export_format}"'
+    return response
@@ -0,0 +1,124 @@
+"""
+Query-parameter filters for activity reads
+
+Filters are built as Mongo filter documents for the raw queries; the
+activity list passes them to the repository (see views.RepositoryListMixin).
+"""
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+from .fields import to_object_id
+from .repository import team_member_ids
+
+
+# Query parameter -> (field, Mongo operator, type)
+RANGE_PARAMS = {
+    'calories__gte': ('calories', '$gte', int),
+    'calories__lte': ('calories', '$lte', int),
+    'distance__gte': ('distance', '$gte', float),
+    'distance__lte': ('distance', '$lte', float),
+}
+
+# Fields an activity filter can be answered from an index on
+INDEXED_FIELDS = {'user_id', 'date'}
+
+
+def parse_datetime_param(params, name):
+    """
+    Read an ISO date or datetime query parameter as an aware datetime
+    """
+    value = params.get(name)
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValidationError({name: 'Enter a valid ISO 8601 date or datetime.'})
+        parsed = datetime.combine(day, time.min)
+    if timezone.is_naive(parsed):
+        parsed = parsed.replace(tzinfo=dt_timezone.utc)
+    return parsed
+
+
+def parse_number_param(params, name, kind):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return kind(value)
+    except ValueError:
+        raise ValidationError({name: f'A valid {"integer" if kind is int else "number"} is required.'})
+
+
+def parse_object_id_param(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    object_id = to_object_id(value)
+    if object_id is None:
+        raise ValidationError({name: 'Must be a valid ObjectId.'})
+    return object_id
+
+
+def activity_match(params):
+    """
+    A Mongo filter document for the user_id, team_id, activity_type,
+    date__gte/date__lt, calories__gte/calories__lte and
+    distance__gte/distance__lte query parameters
+    """
+    match = {}
+    user_ids = None
+    user_id = parse_object_id_param(params, 'user_id')
+    team_id = parse_object_id_param(params, 'team_id')
+    if user_id is not None:
+        user_ids = [user_id]
+    if team_id is not None:
+        members = team_member_ids(team_id)
+        user_ids = members if user_ids is None else [user for user in user_ids if user in members]
+    if user_ids is not None:
+        match['user_id'] = user_ids[0] if len(user_ids) == 1 else {'$in': user_ids}
+
+    date_range = {}
+    since = parse_datetime_param(params, 'date__gte')
+    until = parse_datetime_param(params, 'date__lt')
+    if since:
+        date_range['$gte'] = since
+    if until:
+        date_range['$lt'] = until
+    if date_range:
+        match['date'] = date_range
+
+    if params.get('activity_type'):
+        match['activity_type'] = params['activity_type']
+    for name, (field, operator, kind) in RANGE_PARAMS.items():
+        value = parse_number_param(params, name, kind)
+        if value is not None:
+            match.setdefault(field, {})[operator] = value
+    return match
+
+
+def check_indexed(match, max_days=None):
+    """
+    Reject a filter that Mongo could only answer by scanning most of the
+    collection: filters on fields without an index (activity_type,
+    calories, distance) need an indexed bound to go with them, either a
+    user (user_id or team_id) or a date range of at most max_days
+    """
+    residual = [field for field in match if field not in INDEXED_FIELDS]
+    if not residual or 'user_id' in match:
+        return
+    if max_days is None:
+        max_days = getattr(settings, 'ACTIVITY_SCAN_MAX_DAYS', 92)
+    date_range = match.get('date', {})
+    if '$gte' in date_range:
+        until = date_range.get('$lt') or timezone.now()
+        if until - date_range['$gte'] <= timedelta(days=max_days):
+            return
+    raise ValidationError({'non_field_errors': [
+        f'Filtering by {", ".join(sorted(residual))} needs user_id, team_id or a '
+        f'date__gte/date__lt range of at most {max_days} days.'
+    ]})
+
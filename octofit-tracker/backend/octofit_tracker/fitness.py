@@ -0,0 +1,111 @@
+"""
+Fitness levels derived from leaderboard calorie totals
+
+The level is stored on the user and only rewritten when a change in the
+user's total calories moves them into another tier, so serializing users
+needs no leaderboard lookup. Tiers come from the FITNESS_TIERS setting;
+after changing them run the recompute_fitness_levels command.
+"""
+from collections import defaultdict
+from django.conf import settings
+from .cache import invalidate
+from .fields import to_object_id
+from .models import User, Leaderboard
+
+
+FITNESS_BATCH_SIZE = 1000
+
+DEFAULT_FITNESS_TIERS = [
+    (7000, 'Advanced'),
+    (5000, 'Intermediate'),
+    (0, 'Beginner'),
+]
+
+
+def fitness_tiers():
+    """
+    (minimum total calories, level) pairs, highest minimum first
+    """
+    return sorted(getattr(settings, 'FITNESS_TIERS', DEFAULT_FITNESS_TIERS), reverse=True)
+
+
+def fitness_level(total_calories):
+    tiers = fitness_tiers()
+    for minimum, level in tiers:
+        if total_calories >= minimum:
+            return level
+    return tiers[-1][1]
+
+
+def update_fitness_level(user_id, old_calories, new_calories):
+    """
+    Store the user's level if their calories moved them to another tier;
+    old_calories is None when the previous total is unknown
+    """
+    level = fitness_level(new_calories)
+    if old_calories is not None and fitness_level(old_calories) == level:
+        return
+    user_id = to_object_id(user_id)
+    if user_id is None:
+        return
+    result = User.objects.mongo_update_one(
+        {'_id': user_id, 'fitness_level': {'$ne': level}},
+        {'$set': {'fitness_level': level}}
+    )
+    if result.modified_count:
+        invalidate('users')
+
+
+def store_fitness_levels(totals):
+    """
+    Write every user's level from a user_id -> total calories mapping;
+    users missing from totals get the level for 0 calories. Only users
+    whose level changes are written, one update per tier for every
+    FITNESS_BATCH_SIZE of them, so no filter grows with the number of
+    users. Returns the number of users whose level changed.
+    """
+    calories_by_user = {}
+    for user_id, calories in totals.items():
+        user_id = to_object_id(user_id)
+        if user_id is not None:
+            calories_by_user[user_id] = calories
+
+    modified = 0
+    pending = defaultdict(list)
+    waiting = 0
+    users = User.objects.mongo_find({}, {'fitness_level': 1}).batch_size(FITNESS_BATCH_SIZE)
+    for user in users:
+        level = fitness_level(calories_by_user.get(user['_id'], 0))
+        if user.get('fitness_level') == level:
+            continue
+        pending[level].append(user['_id'])
+        waiting += 1
+        if waiting >= FITNESS_BATCH_SIZE:
+            modified += write_levels(pending)
+            pending, waiting = defaultdict(list), 0
+    modified += write_levels(pending)
+    if modified:
+        invalidate('users')
+    return modified
+
+
+def write_levels(user_ids_by_level):
+    modified = 0
+    for level, user_ids in user_ids_by_level.items():
+        modified += User.objects.mongo_update_many(
+            {'_id': {'$in': user_ids}, 'fitness_level': {'$ne': level}},
+            {'$set': {'fitness_level': level}}
+        ).modified_count
+    return modified
+
+
+def recompute_fitness_levels():
+    """
+    Rewrite every user's level from the leaderboard totals, e.g. after
+    FITNESS_TIERS changed; returns the number of users whose level changed
+    """
+    totals = {
+        row['user_id']: row['total_calories']
+        for row in Leaderboard.objects.mongo_find({}, {'user_id': 1, 'total_calories': 1})
+    }
+    return store_fitness_levels(totals)
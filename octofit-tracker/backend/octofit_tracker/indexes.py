@@ -0,0 +1,119 @@
+"""
+MongoDB index declarations derived from the models
+
+djongo's migrations create every index ascending, mangle descending
+columns and can't express conditions, so the index sync reads
+Meta.indexes, unique constraints and unique fields directly and compares
+them with what the collections actually have. A constraint's condition
+becomes a partialFilterExpression.
+"""
+from django.apps import apps
+from django.db import connections, router
+from django.db.models import Q, UniqueConstraint
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+
+def declared_indexes(model):
+    """
+    The IndexModels a model's collection should have
+    """
+    declared = []
+    for index in model._meta.indexes:
+        keys = [
+            (model._meta.get_field(name).column, DESCENDING if order == 'DESC' else ASCENDING)
+            for name, order in index.fields_orders
+        ]
+        declared.append(IndexModel(keys, name=index.name))
+    for constraint in model._meta.constraints:
+        if isinstance(constraint, UniqueConstraint) and constraint.fields:
+            keys = [(model._meta.get_field(name).column, ASCENDING) for name in constraint.fields]
+            options = {}
+            if constraint.condition is not None:
+                options['partialFilterExpression'] = partial_filter(model, constraint.condition)
+            declared.append(IndexModel(keys, name=constraint.name, unique=True, **options))
+    for field in model._meta.local_fields:
+        if field.unique and not field.primary_key:
+            declared.append(IndexModel(
+                [(field.column, ASCENDING)],
+                name=f'{model._meta.db_table}_{field.column}_uniq',
+                unique=True
+            ))
+    return declared
+
+
+def partial_filter(model, condition):
+    """
+    A condition ANDing field equalities as a partialFilterExpression
+    """
+    expression = {}
+    for child in condition.children:
+        if condition.negated or condition.connector != Q.AND or isinstance(child, Q):
+            raise ValueError(f'Only equality conditions can be declared as partial indexes, not {condition}')
+        lookup, value = child
+        name, _, lookup_type = lookup.partition('__')
+        if lookup_type not in ('', 'exact'):
+            raise ValueError(f'Only equality conditions can be declared as partial indexes, not {condition}')
+        expression[model._meta.get_field(name).column] = value
+    return expression
+
+
+def index_signature(key, unique=False, partial=None):
+    return (
+        tuple((name, int(direction)) for name, direction in key),
+        bool(unique),
+        tuple(sorted((partial or {}).items())),
+    )
+
+
+def diff_indexes(collection, declared):
+    """
+    Compare declared IndexModels with a collection's indexes
+
+    Returns (missing, mismatched, extra): declared indexes that don't exist,
+    declared indexes whose name is taken by an index with a different key
+    or filter,
+    and existing index names that nothing declares.
+    """
+    existing = collection.index_information()
+    by_signature = {
+        index_signature(info['key'], info.get('unique'), info.get('partialFilterExpression')): name
+        for name, info in existing.items()
+    }
+    matched = {'_id_'}
+    missing, mismatched = [], []
+    for index in declared:
+        spec = index.document
+        signature = index_signature(spec['key'].items(), spec.get('unique'), spec.get('partialFilterExpression'))
+        if signature in by_signature:
+            matched.add(by_signature[signature])
+        elif spec['name'] in existing:
+            matched.add(spec['name'])
+            mismatched.append(index)
+        else:
+            missing.append(index)
+    extra = [name for name in existing if name not in matched]
+    return missing, mismatched, extra
+
+
+def unused_indexes(collection):
+    """
+    Names of indexes with no recorded accesses since the server started
+    """
+    return [
+        stats['name']
+        for stats in collection.aggregate([{'$indexStats': {}}])
+        if stats['name'] != '_id_' and not stats['accesses']['ops']
+    ]
+
+
+def collection_for(model):
+    connection = connections[router.db_for_write(model)]
+    connection.ensure_connection()
+    return connection.connection[model._meta.db_table]
+
+
+def indexed_models():
+    return [
+        model for model in apps.get_app_config('octofit_tracker').get_models()
+        if declared_indexes(model)
+    ]
@@ -0,0 +1,212 @@
+"""
+Bulk activity ingestion
+
+Payloads are read from the request stream item by item (a JSON array or
+NDJSON, one object per line), validated and inserted in fixed-size chunks,
+so memory stays bounded by the chunk size however large the upload is.
+"""
+import codecs
+import json
+import re
+from .analytics import activity_store
+from .cache import activity_namespaces, invalidate
+from .leaderboard import ActivityContribution, apply_contributions
+from .models import Activity
+from .serializers import ActivitySerializer
+
+
+READ_SIZE = 64 * 1024
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+class MalformedPayload(Exception):
+    pass
+
+
+class InvalidItem:
+    """
+    Placeholder for an NDJSON line that isn't valid JSON
+    """
+    def __init__(self, message):
+        self.message = message
+
+
+def iter_ndjson(stream):
+    for line in iter(stream.readline, b''):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as error:
+            yield InvalidItem(f'Invalid JSON: {error}')
+
+
+def iter_json_array(stream, read_size=READ_SIZE):
+    """
+    Yield the elements of a top-level JSON array without loading the whole
+    document, decoding one element at a time from a rolling buffer
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')()
+    buffer, position, eof = '', 0, False
+
+    def fill():
+        nonlocal buffer, position, eof
+        chunk = stream.read(read_size)
+        eof = not chunk
+        buffer = buffer[position:] + text.decode(chunk, final=eof)
+        position = 0
+
+    def peek():
+        """
+        Skip whitespace and return the next character, or '' at the end
+        """
+        nonlocal position
+        while True:
+            position = WHITESPACE.match(buffer, position).end()
+            if position < len(buffer) or eof:
+                return buffer[position:position + 1]
+            fill()
+
+    if peek() != '[':
+        raise MalformedPayload('Expected a JSON array')
+    position += 1
+    if peek() == ']':
+        return
+
+    while True:
+        if not peek():
+            raise MalformedPayload('Unexpected end of JSON array')
+        while True:
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                if eof:
+                    raise MalformedPayload('Invalid JSON in array')
+                fill()
+                continue
+            following = WHITESPACE.match(buffer, end).end()
+            truncated_number = (
+                following == end and isinstance(item, (int, float)) and not isinstance(item, bool)
+            )
+            if not eof and (following == len(buffer) or truncated_number):
+                # The element may have been cut off at the end of the buffer
+                # ("12" of "125", "1." of "1.5"), decode it again with more input
+                fill()
+                continue
+            break
+        yield item
+        position = end
+
+        separator = peek()
+        if separator == ']':
+            return
+        if separator != ',':
+            raise MalformedPayload('Expected "," or "]" between array elements')
+        position += 1
+
+
+def chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class IngestResult:
+    def __init__(self, max_errors):
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+        self.max_errors = max_errors
+        self.payload_error = None
+
+    def add_error(self, index, errors):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'index': index, 'errors': errors})
+
+    def as_dict(self):
+        result = {
+            'created': self.created,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+        }
+        if self.payload_error:
+            result['payload_error'] = self.payload_error
+        return result
+
+
+def ingest_activities(items, chunk_size, max_errors, context=None):
+    """
+    Validate and insert activities chunk by chunk, updating the leaderboard
+    once per chunk; returns an IngestResult with per-item errors
+
+    A malformed payload stops ingestion at the chunk where it was found;
+    chunks before it stay inserted and are counted in the result.
+    """
+    result = IngestResult(max_errors)
+    try:
+        for chunk in chunks(enumerate(items), chunk_size):
+            ingest_chunk(chunk, result, context)
+    except MalformedPayload as error:
+        result.payload_error = str(error)
+    return result
+
+
+def ingest_chunk(chunk, result, context):
+    """
+    Validate and insert one chunk, recording failures in result
+    """
+    candidates = []
+    for index, item in chunk:
+        if isinstance(item, InvalidItem):
+            result.add_error(index, {'non_field_errors': [item.message]})
+        else:
+            candidates.append((index, item))
+    if not candidates:
+        return
+
+    serializer = ActivitySerializer(data=[item for _, item in candidates], many=True, context=context)
+    if not serializer.is_valid():
+        # A list serializer drops all validated data when any item fails,
+        # so record the failures and validate the rest again
+        valid = []
+        for (index, item), errors in zip(candidates, serializer.errors):
+            if errors:
+                result.add_error(index, errors)
+            else:
+                valid.append((index, item))
+        if not valid:
+            return
+        serializer = ActivitySerializer(data=[item for _, item in valid], many=True, context=context)
+        serializer.is_valid(raise_exception=True)
+
+    documents = [dict(data) for data in serializer.validated_data]
+    Activity.objects.mongo_insert_many(documents, ordered=False)
+    result.created += len(documents)
+    namespaces = set(activity_namespaces())
+    for data in documents:
+        namespaces.update(activity_namespaces(data['user_id']))
+    invalidate(*namespaces)
+    activity_store.mark_inserted()
+    apply_contributions(
+        (
+            ActivityContribution(
+                user_id=data['user_id'],
+                date=data['date'],
+                count=1,
+                duration=data['duration'],
+                calories=data['calories'],
+                distance=data.get('distance') or 0.0,
+            )
+            for data in documents
+        ),
+        bulk=True
+    )
@@ -0,0 +1,444 @@
+"""
+Incremental leaderboard engine
+
+Activity writes are folded into per-user deltas and applied to the
+leaderboard collection with $inc, so totals stay live without a full
+rebuild. The user's stored fitness level is updated when their calories
+cross a tier boundary.
+
+Ranks use competition ranking (1 + the number of users with strictly more
+calories, ties share a rank), which means a change in one user's calories
+only moves the rows whose calories lie between the old and the new value;
+single writes shift those ranks inline. Bulk ingests touch many users at
+once, so they leave ranks to the assign_ranks background job instead, and
+a burst of them costs one pass over the board (see tasks.py); until it
+runs their new rows have no rank. The in-process rank index (ranking.py)
+is updated inline either way, so ?around= is always current.
+
+The same deltas are summed per team into the team leaderboard, which the
+assign_team_ranks job re-ranks the same way.
+
+rebuild_leaderboard recomputes the whole board from the activities
+collection, for when the incremental totals can't be trusted (raw imports,
+a bug in the write path).
+"""
+import math
+import time
+from collections import defaultdict, namedtuple
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from .cache import invalidate
+from .fitness import recompute_fitness_levels, update_fitness_level
+from .models import User, Team, Activity, Leaderboard, TeamLeaderboard
+from .ranking import rank_index, record_calories
+from .repository import fetch_names
+from .rollups import apply_daily_rollups
+from .tasks import enqueue
+
+
+RANK_BATCH_SIZE = 1000
+REBUILD_BATCH_SIZE = 1000
+
+
+class ActivityContribution(namedtuple(
+    'ActivityContribution',
+    ['user_id', 'date', 'count', 'duration', 'calories', 'distance']
+)):
+    """
+    What a single activity adds to the aggregates derived from it
+    """
+    __slots__ = ()
+
+    def negated(self):
+        return self._replace(
+            count=-self.count,
+            duration=-self.duration,
+            calories=-self.calories,
+            distance=-self.distance,
+        )
+
+
+def contribution(activity, sign=1):
+    return ActivityContribution(
+        user_id=activity.user_id,
+        date=activity.date,
+        count=sign,
+        duration=sign * (activity.duration or 0),
+        calories=sign * (activity.calories or 0),
+        distance=sign * (activity.distance or 0.0),
+    )
+
+
+def apply_contributions(contributions, bulk=False):
+    """
+    Fold activity contributions into one delta per user and apply them,
+    then update the daily rollups; bulk schedules one re-rank rather than
+    shifting ranks per user
+    """
+    contributions = list(contributions)
+    deltas = defaultdict(lambda: [0, 0, 0.0])
+    for item in contributions:
+        delta = deltas[item.user_id]
+        delta[0] += item.count
+        delta[1] += item.calories
+        delta[2] += item.distance
+
+    team_deltas = defaultdict(lambda: [0, 0, 0.0])
+    for user_id, delta in deltas.items():
+        if any(delta):
+            team_id = apply_user_delta(user_id, *delta, shift=not bulk)
+            if team_id is not None:
+                team_deltas[team_id] = [a + b for a, b in zip(team_deltas[team_id], delta)]
+    apply_team_deltas(team_deltas)
+    if bulk and deltas:
+        enqueue('assign_ranks')
+    if deltas:
+        invalidate('leaderboard')
+    apply_daily_rollups(contributions)
+
+
+def apply_user_delta(user_id, activities, calories, distance, shift=True):
+    """
+    Add the deltas to a user's leaderboard row, creating the row on the
+    user's first activity, and re-rank the rows its calories moved past
+    unless shift is off; returns the row's team_id
+    """
+    increments = {
+        'total_activities': activities,
+        'total_calories': calories,
+        'total_distance': distance,
+    }
+    before = Leaderboard.objects.mongo_find_one_and_update(
+        {'user_id': user_id},
+        {'$inc': increments},
+        projection={'total_calories': 1, 'team_id': 1},
+        return_document=ReturnDocument.BEFORE
+    )
+    if before is None:
+        team_id = team_of(user_id)
+        try:
+            before = Leaderboard.objects.mongo_find_one_and_update(
+                {'user_id': user_id},
+                {'$inc': increments, '$setOnInsert': {'team_id': team_id, 'rank': None}},
+                projection={'total_calories': 1, 'team_id': 1},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE
+            )
+        except DuplicateKeyError:
+            # A concurrent first activity created the row in between; the
+            # unique user_id index turned our insert away, so add to it
+            before = Leaderboard.objects.mongo_find_one_and_update(
+                {'user_id': user_id},
+                {'$inc': increments},
+                projection={'total_calories': 1, 'team_id': 1},
+                return_document=ReturnDocument.BEFORE
+            )
+    if before is not None:
+        team_id = before.get('team_id')
+
+    if before is None:
+        old_calories, new_calories = None, calories
+    else:
+        old_calories, new_calories = before['total_calories'], before['total_calories'] + calories
+    if shift and new_calories != old_calories:
+        shift_ranks(user_id, old_calories, new_calories)
+    record_calories(user_id, new_calories)
+    update_fitness_level(user_id, old_calories, new_calories)
+    return team_id
+
+
+def shift_ranks(user_id, old_calories, new_calories):
+    """
+    Move a user from old_calories (None for a new row) to new_calories,
+    adjusting only the ranks of the rows in between
+    """
+    ranked_others = {'user_id': {'$ne': user_id}, 'rank': {'$type': 'number'}}
+    if old_calories is None:
+        # Everyone below the new row drops one place
+        calorie_range, step = {'$lt': new_calories}, 1
+    elif new_calories > old_calories:
+        # Rows the user overtook drop one place
+        calorie_range, step = {'$gte': old_calories, '$lt': new_calories}, 1
+    else:
+        # Rows that overtook the user move up one place
+        calorie_range, step = {'$gte': new_calories, '$lt': old_calories}, -1
+    Leaderboard.objects.mongo_update_many(
+        {**ranked_others, 'total_calories': calorie_range},
+        {'$inc': {'rank': step}}
+    )
+
+    rank = 1 + Leaderboard.objects.mongo_count_documents({'total_calories': {'$gt': new_calories}})
+    Leaderboard.objects.mongo_update_one({'user_id': user_id}, {'$set': {'rank': rank}})
+
+
+def assign_ranks():
+    """
+    Recompute every rank from scratch in one ordered pass, writing only the
+    rows whose rank changed; returns the number of rows updated
+    """
+    updates = []
+    updated = 0
+    rank = previous_calories = None
+    rows = Leaderboard.objects.mongo_find({}, {'total_calories': 1, 'rank': 1}).sort('total_calories', -1)
+    for position, row in enumerate(rows, start=1):
+        if row['total_calories'] != previous_calories:
+            rank, previous_calories = position, row['total_calories']
+        if row.get('rank') != rank:
+            updates.append(UpdateOne({'_id': row['_id']}, {'$set': {'rank': rank}}))
+        if len(updates) >= RANK_BATCH_SIZE:
+            Leaderboard.objects.mongo_bulk_write(updates, ordered=False)
+            updated += len(updates)
+            updates = []
+    if updates:
+        Leaderboard.objects.mongo_bulk_write(updates, ordered=False)
+        updated += len(updates)
+    if updated:
+        invalidate('leaderboard')
+    return updated
+
+
+def team_of(user_id):
+    user = User.objects.mongo_find_one({'_id': user_id}, {'team_id': 1})
+    return (user or {}).get('team_id')
+
+
+def apply_team_deltas(deltas):
+    """
+    Add team_id -> [activities, calories, distance] deltas to the team
+    leaderboard, creating missing rows, and schedule a re-rank of the teams
+    """
+    deltas = {team_id: delta for team_id, delta in deltas.items() if team_id is not None and any(delta)}
+    if not deltas:
+        return
+    names = fetch_names(Team, deltas)
+    TeamLeaderboard.objects.mongo_bulk_write([
+        UpdateOne(
+            {'team_id': team_id},
+            {
+                '$inc': {'total_activities': activities, 'total_calories': calories, 'total_distance': distance},
+                '$setOnInsert': {'team_name': names.get(team_id), 'rank': None},
+            },
+            upsert=True
+        )
+        for team_id, (activities, calories, distance) in deltas.items()
+    ], ordered=False)
+    enqueue('assign_team_ranks')
+
+
+def assign_team_ranks():
+    """
+    Rank the teams by total calories; returns the number of rows updated
+    """
+    updates = []
+    rank = previous_calories = None
+    rows = TeamLeaderboard.objects.mongo_find({}, {'total_calories': 1, 'rank': 1}).sort('total_calories', -1)
+    for position, row in enumerate(rows, start=1):
+        if row['total_calories'] != previous_calories:
+            rank, previous_calories = position, row['total_calories']
+        if row.get('rank') != rank:
+            updates.append(UpdateOne({'_id': row['_id']}, {'$set': {'rank': rank}}))
+    if updates:
+        TeamLeaderboard.objects.mongo_bulk_write(updates, ordered=False)
+        invalidate('leaderboard')
+    return len(updates)
+
+
+def move_user_team(user_id, old_team_id, new_team_id):
+    """
+    Point a user's leaderboard row at their new team and move their
+    totals between the two teams
+    """
+    row = Leaderboard.objects.mongo_find_one_and_update(
+        {'user_id': user_id},
+        {'$set': {'team_id': new_team_id}},
+        projection={'total_activities': 1, 'total_calories': 1, 'total_distance': 1}
+    )
+    if row is None:
+        return
+    totals = [row['total_activities'], row['total_calories'], row['total_distance']]
+    deltas = defaultdict(lambda: [0, 0, 0.0])
+    if old_team_id is not None:
+        deltas[old_team_id] = [-value for value in totals]
+    if new_team_id is not None:
+        deltas[new_team_id] = [a + b for a, b in zip(deltas[new_team_id], totals)]
+    apply_team_deltas(deltas)
+    invalidate('leaderboard')
+
+
+def rebuild_team_leaderboard():
+    """
+    Recompute the team leaderboard from the per-user rows; returns the
+    number of teams written. Rows are upserted in place and teams left
+    without users deleted afterwards, so readers never see an empty board
+    and concurrent apply_team_deltas upserts don't collide with inserts.
+    """
+    groups = list(Leaderboard.objects.mongo_aggregate([
+        {'$match': {'team_id': {'$ne': None}}},
+        {'$group': {
+            '_id': '$team_id',
+            'total_activities': {'$sum': '$total_activities'},
+            'total_calories': {'$sum': '$total_calories'},
+            'total_distance': {'$sum': '$total_distance'},
+        }},
+    ]))
+    team_ids = [group['_id'] for group in groups]
+    names = fetch_names(Team, team_ids)
+    if groups:
+        TeamLeaderboard.objects.mongo_bulk_write([
+            UpdateOne(
+                {'team_id': group['_id']},
+                {
+                    '$set': {
+                        'team_name': names.get(group['_id']),
+                        'total_activities': group['total_activities'],
+                        'total_calories': group['total_calories'],
+                        'total_distance': group['total_distance'],
+                    },
+                    '$setOnInsert': {'rank': None},
+                },
+                upsert=True
+            )
+            for group in groups
+        ], ordered=False)
+    # There are few teams, so the ids fit in one filter
+    TeamLeaderboard.objects.mongo_delete_many({'team_id': {'$nin': team_ids}})
+    assign_team_ranks()
+    invalidate('leaderboard')
+    return len(groups)
+
+
+class LeaderboardRebuild(namedtuple(
+    'LeaderboardRebuild',
+    ['users', 'activities', 'inserted', 'updated', 'zeroed']
+)):
+    """
+    What rebuild_user_totals did: users and activities seen in the
+    activities collection, and leaderboard rows written
+    """
+    __slots__ = ()
+
+
+def rebuild_user_totals(batch_size=REBUILD_BATCH_SIZE):
+    """
+    Recompute every user's leaderboard totals and team from the activities
+    collection, leaving ranks to assign_ranks.
+
+    The per-user sums are computed by Mongo in one $group pipeline, sorted
+    by user, and merged with the leaderboard rows read in the same order,
+    so memory stays flat however many users there are and only rows whose
+    totals changed are written. Rows of users without activities are
+    zeroed, as the incremental engine leaves them. Activities written while
+    the rebuild runs may be lost from the totals, so run it when writes are
+    quiet or follow it with another run.
+    """
+    totals = Activity.objects.mongo_aggregate([
+        {'$match': {'user_id': {'$ne': None}}},
+        {'$group': {
+            '_id': '$user_id',
+            'total_activities': {'$sum': 1},
+            'total_calories': {'$sum': '$calories'},
+            'total_distance': {'$sum': {'$ifNull': ['$distance', 0]}},
+        }},
+        {'$sort': {'_id': 1}},
+    ], allowDiskUse=True)
+    rows = Leaderboard.objects.mongo_find(
+        {}, {'user_id': 1, 'team_id': 1, 'total_activities': 1, 'total_calories': 1, 'total_distance': 1}
+    ).sort('user_id', 1)
+
+    counts = dict.fromkeys(LeaderboardRebuild._fields, 0)
+    pending = []
+    for total, row in join_by_user(totals, rows):
+        if total is not None:
+            counts['users'] += 1
+            counts['activities'] += total['total_activities']
+        pending.append((total, row))
+        if len(pending) >= batch_size:
+            write_user_totals(pending, counts)
+            pending = []
+    if pending:
+        write_user_totals(pending, counts)
+    return LeaderboardRebuild(**counts)
+
+
+def join_by_user(totals, rows):
+    """
+    Pair per-user totals with leaderboard rows, both sorted by user id;
+    either side of a pair is None when the other has no match
+    """
+    totals, rows = iter(totals), iter(rows)
+    total, row = next(totals, None), next(rows, None)
+    while total is not None or row is not None:
+        if row is None or (total is not None and total['_id'] < row['user_id']):
+            yield total, None
+            total = next(totals, None)
+        elif total is None or row['user_id'] < total['_id']:
+            yield None, row
+            row = next(rows, None)
+        else:
+            yield total, row
+            total, row = next(totals, None), next(rows, None)
+
+
+def write_user_totals(pending, counts):
+    """
+    Write one batch of (totals, row) pairs from join_by_user in a single
+    bulk write, looking up the batch's teams in one query
+    """
+    user_ids = [total['_id'] for total, _ in pending if total is not None]
+    teams = {
+        user['_id']: user.get('team_id')
+        for user in User.objects.mongo_find({'_id': {'$in': user_ids}}, {'team_id': 1})
+    }
+    updates = []
+    for total, row in pending:
+        if total is None:
+            values = {'total_activities': 0, 'total_calories': 0, 'total_distance': 0.0}
+        else:
+            values = {
+                'team_id': teams.get(total['_id']),
+                'total_activities': total['total_activities'],
+                'total_calories': total['total_calories'],
+                'total_distance': total['total_distance'],
+            }
+        if row is None:
+            updates.append(UpdateOne(
+                {'user_id': total['_id']},
+                {'$set': values, '$setOnInsert': {'rank': None}},
+                upsert=True
+            ))
+            counts['inserted'] += 1
+        elif any(changed(row.get(key), value) for key, value in values.items()):
+            updates.append(UpdateOne({'_id': row['_id']}, {'$set': values}))
+            counts['updated' if total is not None else 'zeroed'] += 1
+    if updates:
+        Leaderboard.objects.mongo_bulk_write(updates, ordered=False)
+
+
+def changed(stored, value):
+    # Distances summed in another order than the $inc path differ in the
+    # last bits; that isn't a change worth a write
+    if isinstance(stored, float) and isinstance(value, float):
+        return not math.isclose(stored, value, rel_tol=1e-9, abs_tol=1e-9)
+    return stored != value
+
+
+def rebuild_leaderboard(batch_size=REBUILD_BATCH_SIZE, on_phase=None):
+    """
+    Rebuild the user totals, ranks, team leaderboard and fitness levels
+    from the activities collection; returns the LeaderboardRebuild.
+    on_phase(name, result, seconds) is called as each phase ends.
+    """
+    def run(name, function, *args):
+        started = time.perf_counter()
+        result = function(*args)
+        if on_phase is not None:
+            on_phase(name, result, time.perf_counter() - started)
+        return result
+
+    result = run('user totals', rebuild_user_totals, batch_size)
+    run('ranks', assign_ranks)
+    run('team leaderboard', rebuild_team_leaderboard)
+    run('fitness levels', recompute_fitness_levels)
+    rank_index.invalidate()
+    invalidate('leaderboard', 'users')
+    return result
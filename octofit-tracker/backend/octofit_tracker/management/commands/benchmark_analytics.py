@@ -0,0 +1,61 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from octofit_tracker.analytics import ActivityStore, numpy
+from octofit_tracker.stats import aggregate_groups
+
+
+class Command(BaseCommand):
+    help = (
+        'Load the columnar analytics store, report its memory per activity and compare its group-by '
+        'and top-N queries with the Mongo aggregation pipeline'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per query')
+        parser.add_argument('--top', type=int, default=10, help='N for the top-N queries')
+
+    def handle(self, *args, **options):
+        if numpy is None:
+            raise CommandError('The analytics store needs NumPy, install it first')
+
+        store = ActivityStore()
+        started = time.perf_counter()
+        loaded = store.load()
+        load_seconds = time.perf_counter() - started
+        if not loaded:
+            raise CommandError('No data to benchmark, seed the database with populate_db first')
+
+        self.stdout.write(
+            f'Loaded {loaded} activities of {len(store.users)} users in {load_seconds:.2f}s '
+            f'({loaded / load_seconds:,.0f} activities/s)'
+        )
+        self.stdout.write(f'Columns: {store.nbytes / 2 ** 20:.1f} MiB, {store.bytes_per_activity():.1f} bytes per activity')
+
+        started = time.perf_counter()
+        store.refresh()
+        self.stdout.write(f'Incremental refresh with nothing new: {(time.perf_counter() - started) * 1e3:.1f} ms')
+
+        top = options['top']
+        queries = [
+            ('group by activity_type', 'activity_type', None),
+            ('group by day', 'day', None),
+            ('group by week', 'week', None),
+            ('group by user', 'user', None),
+            (f'top {top} users by calories', 'user', top),
+            (f'top {top} days by calories', 'day', top),
+        ]
+        self.stdout.write(f'{"query":32} {"mongo ms":>10} {"store ms":>10} {"speedup":>8}')
+        for label, group_by, limit in queries:
+            mongo_ms = self.measure(lambda: aggregate_groups(group_by, {}, limit), options['repeat'])
+            store_ms = self.measure(lambda: store.group(group_by, {}, limit), options['repeat'])
+            self.stdout.write(f'{label:32} {mongo_ms:10.1f} {store_ms:10.1f} {mongo_ms / store_ms:7.1f}x')
+
+    def measure(self, query, repeat):
+        """
+        Mean wall time per call in milliseconds, after one warm-up call
+        """
+        query()
+        started = time.perf_counter()
+        for _ in range(repeat):
+            query()
+        return (time.perf_counter() - started) / repeat * 1e3
@@ -0,0 +1,274 @@
+import json
+import statistics
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import resolve, reverse
+from djongo import database as djongo_database
+from octofit_tracker import metrics
+from octofit_tracker.models import User
+
+
+DEFAULT_SIZES = [1000, 100000, 1000000]
+
+# name -> (route name, path arguments, query parameters); {user} and {team}
+# are replaced with ids sampled from the seeded dataset
+ENDPOINTS = {
+    'activities': ('activity-list', [], {}),
+    'activity-stats': ('activity-stats', [], {'group_by': 'day'}),
+    'leaderboard': ('leaderboard-list', [], {}),
+    'leaderboard-around': ('leaderboard-list', [], {'around': '{user}'}),
+    'users': ('user-list', [], {}),
+    'user-timeline': ('user-timeline', ['{user}'], {}),
+    'teams': ('team-list', [], {}),
+    'team-members': ('team-members', ['{team}'], {}),
+    'team-leaderboard': ('team-leaderboard', [], {}),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed datasets of increasing size into a scratch database and load test the main '
+        'API endpoints, reporting latency percentiles, throughput and queries per request'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            type=int,
+            nargs='+',
+            default=DEFAULT_SIZES,
+            help='Dataset sizes in activities (default: 1000 100000 1000000)'
+        )
+        parser.add_argument('--endpoints', nargs='+', choices=list(ENDPOINTS), default=list(ENDPOINTS))
+        parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint and size')
+        parser.add_argument('--concurrency', type=int, default=8, help='Requests in flight at once')
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--activities-per-user', type=int, default=20)
+        parser.add_argument('--teams', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument(
+            '--database',
+            help='Scratch database to seed; it is wiped (default: <NAME>_benchmark)'
+        )
+        parser.add_argument(
+            '--in-memory',
+            action='store_true',
+            help='Run against mongomock instead of a local mongod'
+        )
+        parser.add_argument(
+            '--cached',
+            action='store_true',
+            help='Let requests use the response cache (disabled by default so every request hits Mongo)'
+        )
+        parser.add_argument(
+            '--output-dir',
+            default=str(Path(settings.BASE_DIR) / 'benchmarks'),
+            help='Directory the results are written to, one JSON file per commit'
+        )
+        parser.add_argument('--compare', help='Results file or commit to compare against')
+
+    def handle(self, *args, **options):
+        database = options['database'] or f'{connection.settings_dict["NAME"]}_benchmark'
+        if database == connection.settings_dict['NAME']:
+            raise CommandError('Refusing to seed the configured database, pick another --database')
+        baseline = self.load_baseline(options['compare'], options['output_dir']) if options['compare'] else None
+
+        backend = 'mongomock' if options['in_memory'] else 'mongod'
+        with self.stand_in(options['in_memory']), self.scratch_database(database):
+            call_command('migrate', verbosity=0)
+            cache = None if options['cached'] else {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+            results = []
+            for size in options['sizes']:
+                seconds = self.seed(size, options)
+                self.stdout.write(self.style.SUCCESS(f'{size} activities seeded in {seconds:.1f}s'))
+                self.stdout.write(
+                    f'{"endpoint":20} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"queries":>8} {"orm":>5}'
+                )
+                ids = self.sample_ids()
+                with override_settings(**({'CACHES': cache} if cache else {})):
+                    for name in options['endpoints']:
+                        result = self.run_endpoint(name, ids, options)
+                        result['size'] = size
+                        results.append(result)
+                        self.report(result, baseline)
+
+        path = self.store(results, backend, options)
+        self.stdout.write(self.style.SUCCESS(f'Results written to {path}'))
+
+    @contextmanager
+    def stand_in(self, enabled):
+        """
+        Point djongo at one shared mongomock client when enabled
+        """
+        if not enabled:
+            yield
+            return
+        try:
+            import mongomock
+        except ImportError:
+            raise CommandError('--in-memory needs mongomock (pip install mongomock)')
+        client = mongomock.MongoClient()
+        connection.close()
+        djongo_clients = dict(djongo_database.clients)
+        djongo_database.clients.clear()
+        try:
+            with mock.patch.object(djongo_database, 'MongoClient', lambda *args, **kwargs: client):
+                yield
+        finally:
+            connection.close()
+            djongo_database.clients.clear()
+            djongo_database.clients.update(djongo_clients)
+
+    @contextmanager
+    def scratch_database(self, name):
+        """
+        Switch the default connection to the scratch database for the duration
+        """
+        original = connection.settings_dict['NAME']
+        connection.close()
+        connection.settings_dict['NAME'] = name
+        try:
+            yield
+        finally:
+            connection.close()
+            connection.settings_dict['NAME'] = original
+
+    def seed(self, size, options):
+        """
+        Wipe the scratch database and bulk load size activities through populate_db
+        """
+        per_user = options['activities_per_user']
+        started = time.perf_counter()
+        call_command(
+            'populate_db',
+            users=max(size // per_user, 1),
+            teams=options['teams'],
+            activities_per_user=per_user,
+            days=365,
+            seed=options['seed'],
+            stdout=StringIO()
+        )
+        return time.perf_counter() - started
+
+    def sample_ids(self):
+        user = User.objects.mongo_find_one({'team_id': {'$ne': None}}, {'team_id': 1})
+        if user is None:
+            raise CommandError('The seeded dataset has no users')
+        return {'user': str(user['_id']), 'team': str(user['team_id'])}
+
+    def build_url(self, name, ids, page_size):
+        route, args, query = ENDPOINTS[name]
+        url = reverse(route, args=[arg.format(**ids) for arg in args])
+        query = {key: value.format(**ids) for key, value in query.items()}
+        query.setdefault('page_size', page_size)
+        return url, '&'.join(f'{key}={value}' for key, value in query.items())
+
+    def run_endpoint(self, name, ids, options):
+        path, query = self.build_url(name, ids, options['page_size'])
+        labels = (resolve(path).view_name, 'GET')
+        total, concurrency = options['requests'], options['concurrency']
+
+        def one(_):
+            client = Client(SERVER_NAME='localhost')
+            started = time.perf_counter()
+            response = client.get(path, QUERY_STRING=query)
+            elapsed = time.perf_counter() - started
+            if response.status_code != 200:
+                raise CommandError(f'{response.status_code} from {path}?{query}')
+            return elapsed
+
+        one(None)  # warm up
+        queries_before = metrics.DB_QUERIES.totals(labels)
+        statements_before = metrics.ORM_STATEMENTS.totals(labels)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = list(pool.map(one, range(total)))
+        seconds = time.perf_counter() - started
+        queries = [after - before for after, before in zip(metrics.DB_QUERIES.totals(labels), queries_before)]
+        statements = [after - before for after, before in zip(metrics.ORM_STATEMENTS.totals(labels), statements_before)]
+
+        cuts = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+        return {
+            'endpoint': name,
+            'requests': total,
+            'concurrency': concurrency,
+            'requests_per_second': round(total / seconds, 1),
+            'p50_ms': round(cuts[49] * 1000, 2),
+            'p95_ms': round(cuts[94] * 1000, 2),
+            'p99_ms': round(cuts[98] * 1000, 2),
+            'max_ms': round(max(latencies) * 1000, 2),
+            # mongomock doesn't report commands to listeners
+            'mongo_commands_per_request': (
+                round(queries[0] / queries[1], 2) if queries[1] and not options['in_memory'] else None
+            ),
+            'orm_statements_per_request': round(statements[0] / statements[1], 2) if statements[1] else 0,
+        }
+
+    def report(self, result, baseline):
+        queries = result['mongo_commands_per_request']
+        line = (
+            f'{result["endpoint"]:20} {result["requests_per_second"]:8.1f} {result["p50_ms"]:8.2f} '
+            f'{result["p95_ms"]:8.2f} {result["p99_ms"]:8.2f} {"-" if queries is None else queries:>8} '
+            f'{result["orm_statements_per_request"]:5}'
+        )
+        previous = (baseline or {}).get((result['size'], result['endpoint']))
+        if previous:
+            change = (result['p95_ms'] - previous['p95_ms']) / previous['p95_ms'] * 100 if previous['p95_ms'] else 0
+            line += f'  p95 {change:+.0f}% (was {previous["p95_ms"]:.2f} ms, {previous["requests_per_second"]:.1f} req/s)'
+        self.stdout.write(line)
+
+    def store(self, results, backend, options):
+        commit = git_revision()
+        output_dir = Path(options['output_dir'])
+        output_dir.mkdir(parents=True, exist_ok=True)
+        path = output_dir / f'{commit}.json'
+        path.write_text(json.dumps({
+            'commit': commit,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'backend': backend,
+            'cached': options['cached'],
+            'page_size': options['page_size'],
+            'results': results,
+        }, indent=2) + '\n')
+        return path
+
+    def load_baseline(self, reference, output_dir):
+        """
+        Earlier results keyed by (size, endpoint), from a file or a commit
+        """
+        path = Path(reference)
+        if not path.exists():
+            path = Path(output_dir) / f'{reference}.json'
+        if not path.exists():
+            raise CommandError(f'No benchmark results at {reference}')
+        stored = json.loads(path.read_text())
+        return {(result['size'], result['endpoint']): result for result in stored['results']}
+
+
+def git_revision():
+    """
+    The short hash of HEAD, suffixed with -dirty for uncommitted changes
+    """
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True, cwd=settings.BASE_DIR
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'],
+            capture_output=True, text=True, check=True, cwd=settings.BASE_DIR
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unversioned'
+    return f'{commit}-dirty' if dirty else commit
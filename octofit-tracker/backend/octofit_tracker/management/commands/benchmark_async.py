@@ -0,0 +1,92 @@
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+
+ENDPOINTS = ('activities', 'leaderboard', 'users', 'teams')
+SYNC_ROUTES = {
+    'activities': 'activity-list',
+    'leaderboard': 'leaderboard-list',
+    'users': 'user-list',
+    'teams': 'team-list',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test a list endpoint in-process: the sync DRF view on a thread pool '
+        'against the async view on one event loop, at the same concurrency'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('endpoint', nargs='?', choices=ENDPOINTS, default='activities')
+        parser.add_argument('--requests', type=int, default=500, help='Requests per path')
+        parser.add_argument('--concurrency', type=int, default=32, help='Requests in flight at once')
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument(
+            '--cached',
+            action='store_true',
+            help='Let the sync path use the response cache (disabled by default so both paths hit Mongo)'
+        )
+
+    def handle(self, *args, **options):
+        endpoint, total, concurrency = options['endpoint'], options['requests'], options['concurrency']
+        query = f'?page_size={options["page_size"]}'
+        sync_url = reverse(SYNC_ROUTES[endpoint]) + query
+        async_url = reverse(f'async-{SYNC_ROUTES[endpoint]}') + query
+        
+        self.stdout.write(f'{total} requests to {endpoint}, {concurrency} concurrent')
+        if options['cached']:
+            sync_latencies, sync_seconds = self.run_sync(sync_url, total, concurrency)
+        else:
+            with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+                sync_latencies, sync_seconds = self.run_sync(sync_url, total, concurrency)
+        async_latencies, async_seconds = asyncio.run(self.run_async(async_url, total, concurrency))
+        
+        self.stdout.write(f'{"path":8} {"req/s":>9} {"p50 ms":>9} {"p95 ms":>9} {"max ms":>9}')
+        self.report('sync', total, sync_latencies, sync_seconds)
+        self.report('async', total, async_latencies, async_seconds)
+
+    def run_sync(self, url, total, concurrency):
+        def one(_):
+            client = Client(SERVER_NAME='localhost')
+            started = time.perf_counter()
+            response = client.get(url)
+            self.check(response)
+            return time.perf_counter() - started
+        
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = list(pool.map(one, range(total)))
+        return latencies, time.perf_counter() - started
+
+    async def run_async(self, url, total, concurrency):
+        client = AsyncClient(server=('localhost', '80'))
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def one():
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get(url)
+                self.check(response)
+                return time.perf_counter() - started
+        
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(one() for _ in range(total)))
+        return latencies, time.perf_counter() - started
+
+    def check(self, response):
+        if response.status_code != 200:
+            raise CommandError(f'{response.status_code} from {response.request}')
+
+    def report(self, label, total, latencies, seconds):
+        cuts = statistics.quantiles(latencies, n=20) if len(latencies) > 1 else latencies * 19
+        self.stdout.write(
+            f'{label:8} {total / seconds:9.1f} {cuts[9] * 1000:9.2f} {cuts[18] * 1000:9.2f} '
+            f'{max(latencies) * 1000:9.2f}'
+        )
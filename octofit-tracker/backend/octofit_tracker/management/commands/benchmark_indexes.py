@@ -0,0 +1,65 @@
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from pymongo.errors import OperationFailure
+from octofit_tracker.indexes import collection_for
+from octofit_tracker.models import User, Activity, Leaderboard
+
+
+class Command(BaseCommand):
+    help = 'Time the hot queries with a forced collection scan and with their declared index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per query, the best time is reported')
+        parser.add_argument('--limit', type=int, default=50, help='Page size used by the list queries')
+
+    def handle(self, *args, **options):
+        sample_activity = collection_for(Activity).find_one({}, {'user_id': 1, 'date': 1})
+        sample_user = collection_for(User).find_one({'team_id': {'$ne': None}}, {'team_id': 1})
+        if sample_activity is None or sample_user is None:
+            raise CommandError('No data to benchmark, seed the database with populate_db first')
+        
+        week_ago = timezone.now() - timedelta(days=7)
+        limit = options['limit']
+        queries = [
+            ('activities of one user, newest first', Activity, 'activities_user_date_idx',
+             {'user_id': sample_activity['user_id']}, [('date', -1), ('_id', -1)], limit),
+            ('activities in the last week', Activity, 'activities_date_idx',
+             {'date': {'$gte': week_ago}}, [('date', -1), ('_id', -1)], limit),
+            ('members of one team', User, 'users_team_idx',
+             {'team_id': sample_user['team_id']}, None, 0),
+            ('leaderboard row of one user', Leaderboard, 'leaderboard_user_uniq',
+             {'user_id': sample_activity['user_id']}, None, 0),
+            ('leaderboard first page', Leaderboard, 'leaderboard_rank_idx',
+             {}, [('rank', 1), ('_id', 1)], limit),
+        ]
+        
+        self.stdout.write(f'{"query":40} {"scan ms":>9} {"scanned":>9} {"index ms":>9} {"scanned":>9}')
+        for label, model, index_name, query, sort, query_limit in queries:
+            collection = collection_for(model)
+            try:
+                scan = self.measure(collection, query, sort, query_limit, {'$natural': 1}, options['repeat'])
+                indexed = self.measure(collection, query, sort, query_limit, index_name, options['repeat'])
+            except OperationFailure as error:
+                raise CommandError(f'{label}: {error}. Run sync_indexes first.')
+            self.stdout.write(
+                f'{label:40} {scan[0]:9.2f} {scan[1]:9d} {indexed[0]:9.2f} {indexed[1]:9d}'
+            )
+
+    def measure(self, collection, query, sort, limit, hint, repeat):
+        """
+        Best wall time in ms over repeat runs, and documents examined
+        """
+        def cursor():
+            result = collection.find(query).hint(hint).limit(limit)
+            return result.sort(sort) if sort else result
+        
+        best = float('inf')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for _ in cursor():
+                pass
+            best = min(best, time.perf_counter() - started)
+        examined = cursor().explain()['executionStats']['totalDocsExamined']
+        return best * 1000, examined
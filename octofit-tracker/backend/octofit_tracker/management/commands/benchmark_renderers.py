@@ -0,0 +1,73 @@
+import json
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+from bson import ObjectId
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from octofit_tracker.models import Activity
+from octofit_tracker.renderers import FastJSONParser, FastJSONRenderer, orjson
+from octofit_tracker.serializers import ActivitySerializer
+
+
+class Command(BaseCommand):
+    help = 'Time rendering and parsing a page of serialized activities with the stdlib and orjson JSON pairs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=10000, help='Activities in the payload')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per renderer, the best time is reported')
+
+    def handle(self, *args, **options):
+        if orjson is None:
+            raise CommandError('orjson is not installed; FastJSONRenderer falls back to the stdlib renderer')
+        
+        data = {'next': None, 'previous': None, 'results': self.activities(options['count'])}
+        stdlib, fast = JSONRenderer(), FastJSONRenderer()
+        stdlib_bytes, fast_bytes = stdlib.render(data), fast.render(data)
+        if json.loads(stdlib_bytes) != json.loads(fast_bytes):
+            raise CommandError('The renderers disagree on the payload')
+        
+        repeat = options['repeat']
+        timings = [
+            ('render stdlib', self.measure(lambda: stdlib.render(data), repeat)),
+            ('render orjson', self.measure(lambda: fast.render(data), repeat)),
+            ('parse stdlib', self.measure(lambda: json.loads(stdlib_bytes), repeat)),
+            ('parse orjson', self.measure(lambda: FastJSONParser().parse(BytesIO(fast_bytes)), repeat)),
+        ]
+        self.stdout.write(f'{options["count"]} activities, {len(fast_bytes) / 1024:.0f} KiB of JSON')
+        for label, seconds in timings:
+            self.stdout.write(f'{label:16} {seconds * 1000:9.2f} ms')
+        self.stdout.write(f'render speedup  {timings[0][1] / timings[1][1]:8.1f}x')
+        self.stdout.write(f'parse speedup   {timings[2][1] / timings[3][1]:8.1f}x')
+
+    def activities(self, count):
+        """
+        Serialized activities built in memory, so no database is needed
+        """
+        rng = random.Random(0)
+        user_ids = [ObjectId() for _ in range(100)]
+        start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        serializer = ActivitySerializer(context={'user_names': {user_id: f'User {str(user_id)[-4:]}' for user_id in user_ids}})
+        return [
+            serializer.to_representation(Activity(
+                _id=ObjectId(),
+                user_id=rng.choice(user_ids),
+                activity_type=rng.choice(['Running', 'Cycling', 'Swimming']),
+                duration=rng.randint(20, 120),
+                distance=round(rng.uniform(1, 20), 2),
+                calories=rng.randint(100, 1000),
+                date=start + timedelta(seconds=rng.randint(0, 86400 * 365)),
+                notes='Benchmark activity'
+            ))
+            for _ in range(count)
+        ]
+
+    def measure(self, func, repeat):
+        best = float('inf')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - started)
+        return best
+
@@ -0,0 +1,67 @@
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from octofit_tracker import repository
+from octofit_tracker.models import User, Activity, Leaderboard
+
+
+class Command(BaseCommand):
+    help = 'Compare the per-query cost of the hot reads through the djongo ORM and through the repository'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=200, help='Runs per query')
+        parser.add_argument('--limit', type=int, default=50, help='Page size used by the list queries')
+
+    def handle(self, *args, **options):
+        sample = Activity.objects.mongo_find_one({}, {'user_id': 1})
+        member = User.objects.mongo_find_one({'team_id': {'$ne': None}}, {'team_id': 1})
+        if sample is None or member is None:
+            raise CommandError('No data to benchmark, seed the database with populate_db first')
+        
+        user_id, team_id, limit = sample['user_id'], member['team_id'], options['limit']
+        week_ago = timezone.now() - timedelta(days=7)
+        user_ids = repository.team_member_ids(team_id)[:limit]
+        queries = [
+            (
+                'activities of one user, newest first',
+                lambda: list(Activity.objects.filter(user_id=user_id).order_by('-date', '-_id')[:limit]),
+                lambda: repository.find_activities(user_id=user_id, limit=limit),
+            ),
+            (
+                'activities in the last week',
+                lambda: list(Activity.objects.filter(date__gte=week_ago).order_by('-date', '-_id')[:limit]),
+                lambda: repository.find_activities(date_gte=week_ago, limit=limit),
+            ),
+            (
+                'leaderboard top N',
+                lambda: list(Leaderboard.objects.filter(rank__isnull=False).order_by('rank', '_id')[:limit]),
+                lambda: repository.leaderboard_top(limit),
+            ),
+            (
+                'member ids of one team',
+                lambda: list(User.objects.filter(team_id=team_id).values_list('_id', flat=True)),
+                lambda: repository.team_member_ids(team_id),
+            ),
+            (
+                'names of a page of users',
+                lambda: dict(User.objects.filter(_id__in=user_ids).values_list('_id', 'name')),
+                lambda: repository.fetch_names(User, user_ids),
+            ),
+        ]
+        
+        self.stdout.write(f'{"query":40} {"orm us":>10} {"direct us":>10} {"speedup":>8}')
+        for label, orm, direct in queries:
+            orm_us = self.measure(orm, options['repeat'])
+            direct_us = self.measure(direct, options['repeat'])
+            self.stdout.write(f'{label:40} {orm_us:10.1f} {direct_us:10.1f} {orm_us / direct_us:7.1f}x')
+
+    def measure(self, query, repeat):
+        """
+        Mean wall time per call in microseconds, after one warm-up call
+        """
+        query()
+        started = time.perf_counter()
+        for _ in range(repeat):
+            query()
+        return (time.perf_counter() - started) / repeat * 1e6
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker.tasks import JOBS, enqueue
+
+
+class Command(BaseCommand):
+    help = 'Schedule background jobs; a job that is already pending is merged with the new request'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='+', choices=list(JOBS), metavar='job', help=', '.join(JOBS))
+        parser.add_argument(
+            '--delay',
+            type=float,
+            help="Seconds before the job may run (default: the job's debounce delay)"
+        )
+
+    def handle(self, *args, **options):
+        for name in options['names']:
+            enqueue(name, options['delay'])
+            self.stdout.write(self.style.SUCCESS(f'Enqueued {name}'))
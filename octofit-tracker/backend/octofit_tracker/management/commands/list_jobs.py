@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker.models import Job
+from octofit_tracker.tasks import STATUSES
+
+
+class Command(BaseCommand):
+    help = 'Show background job counts by status and the most recent jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--status', choices=STATUSES, help='Only list jobs with this status')
+        parser.add_argument('--name', help='Only list jobs with this name')
+        parser.add_argument('--limit', type=int, default=20)
+
+    def handle(self, *args, **options):
+        counts = {
+            row['_id']: row['count']
+            for row in Job.objects.mongo_aggregate([{'$group': {'_id': '$status', 'count': {'$sum': 1}}}])
+        }
+        self.stdout.write('  '.join(f'{status} {counts.get(status, 0)}' for status in STATUSES))
+        
+        query = {}
+        if options['status']:
+            query['status'] = options['status']
+        if options['name']:
+            query['name'] = options['name']
+        jobs = Job.objects.mongo_find(query, sort=[('created_at', -1)], limit=options['limit'])
+        self.stdout.write(
+            f'{"id":24} {"name":26} {"status":8} {"requests":>8} {"attempts":>8} {"run after":19} {"finished":19} outcome'
+        )
+        for job in jobs:
+            self.stdout.write(
+                f'{str(job["_id"]):24} {job["name"]:26} {job["status"]:8} {job.get("requests", 0):8} '
+                f'{job.get("attempts", 0):8} {format_time(job.get("run_after")):19} '
+                f'{format_time(job.get("finished_at")):19} {job.get("last_error") or job.get("result") or ""}'
+            )
+
+
+def format_time(value):
+    return value.strftime('%Y-%m-%d %H:%M:%S') if value else '-'
@@ -0,0 +1,112 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from octofit_tracker.analytics import activity_store
+from octofit_tracker.cache import invalidate_all
+from octofit_tracker.fields import ReferenceField, to_object_id
+from octofit_tracker.ranking import rank_index
+
+
+class Command(BaseCommand):
+    help = (
+        'Convert user and team references stored as hex strings to ObjectIds. Each collection is '
+        'streamed in _id order and only documents still holding strings are read, so the command '
+        'can be interrupted and run again to pick up where it stopped'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Updates per bulk write')
+        parser.add_argument('--dry-run', action='store_true', help='Count the documents to convert without writing')
+
+    def handle(self, *args, **options):
+        for model, columns in reference_columns():
+            pending = {'$or': [{column: {'$type': 'string'}} for column in columns]}
+            if options['dry_run']:
+                count = model.objects.mongo_count_documents(pending)
+                self.stdout.write(f'{model._meta.db_table}: {count} documents to convert')
+                continue
+            converted, skipped, failed = self.convert(model, columns, pending, options['batch_size'])
+            self.stdout.write(
+                f'{model._meta.db_table}: {converted} converted, {skipped} left with invalid ids, {failed} failed'
+            )
+        if options['dry_run']:
+            return
+        # Raw updates bypass the invalidation signals
+        invalidate_all()
+        rank_index.invalidate()
+        activity_store.invalidate()
+        self.stdout.write(self.style.SUCCESS('References migrated'))
+
+    def convert(self, model, columns, pending, batch_size):
+        """
+        Rewrite the string references of one collection; returns (converted,
+        skipped, failed) document counts
+        """
+        converted = skipped = failed = 0
+        updates = []
+        last_id = None
+        while True:
+            # Restart the cursor after each batch rather than holding one open
+            # for the whole collection; documents skipped for invalid ids
+            # still match pending, the _id bound steps past them
+            query = pending if last_id is None else {**pending, '_id': {'$gt': last_id}}
+            documents = list(model.objects.mongo_find(query, columns, sort=[('_id', 1)], limit=batch_size))
+            if not documents:
+                break
+            for document in documents:
+                last_id = document['_id']
+                update = conversion(document, columns)
+                if update is None:
+                    skipped += 1
+                    continue
+                updates.append(update)
+            if updates:
+                written, errors = self.write(model, updates)
+                converted += written
+                failed += errors
+                updates = []
+        return converted, skipped, failed
+
+    def write(self, model, updates):
+        try:
+            result = model.objects.mongo_bulk_write(updates, ordered=False)
+            return result.modified_count, 0
+        except BulkWriteError as error:
+            # e.g. a unique (user_id, day) rollup whose ObjectId twin was
+            # already written; rebuild_rollups and rebuild_team_leaderboard
+            # recompute those collections from scratch
+            details = error.details
+            for write_error in details['writeErrors'][:3]:
+                self.stderr.write(f'{model._meta.db_table}: {write_error["errmsg"]}')
+            return details['nModified'], len(details['writeErrors'])
+
+
+def reference_columns():
+    """
+    (model, reference columns) for every model with ReferenceFields
+    """
+    for model in apps.get_app_config('octofit_tracker').get_models():
+        columns = [field.column for field in model._meta.concrete_fields if isinstance(field, ReferenceField)]
+        if columns:
+            yield model, columns
+
+
+def conversion(document, columns):
+    """
+    The update converting the document's string references, or None when
+    one of them isn't a valid ObjectId; the filter repeats the old values
+    so a concurrent write to the document isn't overwritten
+    """
+    match = {'_id': document['_id']}
+    values = {}
+    for column in columns:
+        value = document.get(column)
+        if not isinstance(value, str):
+            continue
+        object_id = None if value == '' else to_object_id(value)
+        if value and object_id is None:
+            return None
+        match[column] = value
+        values[column] = object_id
+    return UpdateOne(match, {'$set': values})
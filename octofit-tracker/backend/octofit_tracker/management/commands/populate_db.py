@@ -1,202 +1,330 @@
+from contextlib import contextmanager
+from datetime import timedelta
 from django.core.management.base import BaseCommand
+from django.utils import timezone
+from bson import ObjectId
+from octofit_tracker.analytics import activity_store
+from octofit_tracker.cache import invalidate_all
+from octofit_tracker.fitness import fitness_level, store_fitness_levels
+from octofit_tracker.leaderboard import rebuild_team_leaderboard
+from octofit_tracker.ranking import rank_index
+from octofit_tracker.rollups import rebuild_daily_rollups
 from octofit_tracker.models import User, Team, Activity, Leaderboard, Workout
-from datetime import datetime, timedelta
 import random
+import time
+
+
+ACTIVITY_TYPES = ['Running', 'Swimming', 'Cycling', 'Weight Training', 'Yoga', 'Boxing']
+DISTANCE_TYPES = {'Running', 'Cycling', 'Swimming'}
+
+MARVEL_TEAM = {'name': 'Team Marvel', 'description': 'Earth\'s Mightiest Heroes'}
+DC_TEAM = {'name': 'Team DC', 'description': 'Justice League Members'}
+
+MARVEL_HEROES = [
+    {'name': 'Tony Stark', 'email': 'ironman@marvel.com', 'password': 'stark123'},
+    {'name': 'Steve Rogers', 'email': 'captainamerica@marvel.com', 'password': 'rogers123'},
+    {'name': 'Thor Odinson', 'email': 'thor@marvel.com', 'password': 'thor123'},
+    {'name': 'Natasha Romanoff', 'email': 'blackwidow@marvel.com', 'password': 'natasha123'},
+    {'name': 'Bruce Banner', 'email': 'hulk@marvel.com', 'password': 'banner123'},
+    {'name': 'Peter Parker', 'email': 'spiderman@marvel.com', 'password': 'parker123'},
+]
+
+DC_HEROES = [
+    {'name': 'Clark Kent', 'email': 'superman@dc.com', 'password': 'kent123'},
+    {'name': 'Bruce Wayne', 'email': 'batman@dc.com', 'password': 'wayne123'},
+    {'name': 'Diana Prince', 'email': 'wonderwoman@dc.com', 'password': 'diana123'},
+    {'name': 'Barry Allen', 'email': 'flash@dc.com', 'password': 'barry123'},
+    {'name': 'Arthur Curry', 'email': 'aquaman@dc.com', 'password': 'arthur123'},
+    {'name': 'Hal Jordan', 'email': 'greenlantern@dc.com', 'password': 'hal123'},
+]
+
+WORKOUTS = [
+    {
+        'name': 'Super Soldier Strength',
+        'description': 'High-intensity strength training inspired by Captain America',
+        'difficulty': 'Hard',
+        'duration': 60,
+        'calories_estimate': 600,
+        'category': 'Strength'
+    },
+    {
+        'name': 'Web-Slinger Cardio',
+        'description': 'Fast-paced cardio workout like Spider-Man swinging through the city',
+        'difficulty': 'Medium',
+        'duration': 45,
+        'calories_estimate': 450,
+        'category': 'Cardio'
+    },
+    {
+        'name': 'Amazon Warrior Training',
+        'description': 'Combat-focused workout inspired by Wonder Woman',
+        'difficulty': 'Hard',
+        'duration': 75,
+        'calories_estimate': 700,
+        'category': 'Combat'
+    },
+    {
+        'name': 'Flash Speed Circuit',
+        'description': 'High-speed interval training for maximum calorie burn',
+        'difficulty': 'Hard',
+        'duration': 30,
+        'calories_estimate': 500,
+        'category': 'HIIT'
+    },
+    {
+        'name': 'Zen Master Meditation',
+        'description': 'Mindfulness and flexibility workout',
+        'difficulty': 'Easy',
+        'duration': 30,
+        'calories_estimate': 150,
+        'category': 'Yoga'
+    },
+    {
+        'name': 'Dark Knight Endurance',
+        'description': 'Batman-inspired endurance and stamina training',
+        'difficulty': 'Medium',
+        'duration': 60,
+        'calories_estimate': 550,
+        'category': 'Endurance'
+    },
+    {
+        'name': 'Asgardian Power Lift',
+        'description': 'Thor-inspired heavy lifting and power training',
+        'difficulty': 'Hard',
+        'duration': 50,
+        'calories_estimate': 600,
+        'category': 'Powerlifting'
+    },
+    {
+        'name': 'Atlantean Swimming',
+        'description': 'Aquaman-inspired swimming workout for full-body conditioning',
+        'difficulty': 'Medium',
+        'duration': 45,
+        'calories_estimate': 400,
+        'category': 'Swimming'
+    },
+]
 
 
 class Command(BaseCommand):
     help = 'Populate the octofit_db database with test data'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users',
+            type=int,
+            help='Generate this many synthetic users instead of the superhero roster'
+        )
+        parser.add_argument(
+            '--teams',
+            type=int,
+            default=2,
+            help='Number of teams synthetic users are spread across'
+        )
+        parser.add_argument(
+            '--activities-per-user',
+            type=int,
+            help='Activities per user (default: between 5 and 15)'
+        )
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=30,
+            help='Spread activity dates over this many past days'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            help='Random seed for a reproducible dataset'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Documents per insert_many call'
+        )
+
     def handle(self, *args, **options):
-        self.stdout.write('Clearing existing data...')
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.timings = []
+        self.now = timezone.now()
         
-        # Delete existing data
-        User.objects.all().delete()
-        Team.objects.all().delete()
-        Activity.objects.all().delete()
-        Leaderboard.objects.all().delete()
-        Workout.objects.all().delete()
+        with self.phase('Clearing existing data'):
+            # Collections are cleared directly so per-row delete signals
+            # don't replay against data that is about to disappear
+            for model in (Activity, Leaderboard, User, Team):
+                model.objects.mongo_delete_many({})
+            Workout.objects.all().delete()
         
-        self.stdout.write('Creating teams...')
+        with self.phase('Creating teams'):
+            if options['users'] is None:
+                teams = [MARVEL_TEAM, DC_TEAM]
+            else:
+                teams = [
+                    {'name': f'Team {number}', 'description': f'Synthetic team {number}'}
+                    for number in range(1, options['teams'] + 1)
+                ]
+            team_ids = [ObjectId() for _ in teams]
         
-        # Create teams
-        team_marvel = Team.objects.create(
-            name='Team Marvel',
-            description='Earth\'s Mightiest Heroes'
-        )
+        with self.phase('Creating users'):
+            users = self.create_users(options['users'], team_ids)
+            member_counts = {}
+            for _, team_id, _ in users:
+                member_counts[team_id] = member_counts.get(team_id, 0) + 1
+            self.insert(Team, (
+                {
+                    '_id': team_id,
+                    'name': team['name'],
+                    'description': team['description'],
+                    'member_count': member_counts.get(team_id, 0),
+                    'created_at': self.now,
+                }
+                for team, team_id in zip(teams, team_ids)
+            ))
         
-        team_dc = Team.objects.create(
-            name='Team DC',
-            description='Justice League Members'
-        )
+        with self.phase('Creating activities'):
+            totals = self.create_activities(users, options['activities_per_user'], options['days'])
         
-        self.stdout.write('Creating users...')
-        
-        # Create Marvel superhero users
-        marvel_heroes = [
-            {'name': 'Tony Stark', 'email': 'ironman@marvel.com', 'password': 'stark123'},
-            {'name': 'Steve Rogers', 'email': 'captainamerica@marvel.com', 'password': 'rogers123'},
-            {'name': 'Thor Odinson', 'email': 'thor@marvel.com', 'password': 'thor123'},
-            {'name': 'Natasha Romanoff', 'email': 'blackwidow@marvel.com', 'password': 'natasha123'},
-            {'name': 'Bruce Banner', 'email': 'hulk@marvel.com', 'password': 'banner123'},
-            {'name': 'Peter Parker', 'email': 'spiderman@marvel.com', 'password': 'parker123'},
-        ]
-        
-        # Create DC superhero users
-        dc_heroes = [
-            {'name': 'Clark Kent', 'email': 'superman@dc.com', 'password': 'kent123'},
-            {'name': 'Bruce Wayne', 'email': 'batman@dc.com', 'password': 'wayne123'},
-            {'name': 'Diana Prince', 'email': 'wonderwoman@dc.com', 'password': 'diana123'},
-            {'name': 'Barry Allen', 'email': 'flash@dc.com', 'password': 'barry123'},
-            {'name': 'Arthur Curry', 'email': 'aquaman@dc.com', 'password': 'arthur123'},
-            {'name': 'Hal Jordan', 'email': 'greenlantern@dc.com', 'password': 'hal123'},
-        ]
-        
-        marvel_users = []
-        dc_users = []
-        
-        for hero in marvel_heroes:
-            user = User.objects.create(
-                name=hero['name'],
-                email=hero['email'],
-                password=hero['password'],
-                team_id=str(team_marvel._id)
-            )
-            marvel_users.append(user)
-        
-        for hero in dc_heroes:
-            user = User.objects.create(
-                name=hero['name'],
-                email=hero['email'],
-                password=hero['password'],
-                team_id=str(team_dc._id)
-            )
-            dc_users.append(user)
-        
-        all_users = marvel_users + dc_users
-        
-        self.stdout.write('Creating activities...')
-        
-        # Create activities for each user
-        activity_types = ['Running', 'Swimming', 'Cycling', 'Weight Training', 'Yoga', 'Boxing']
-        
-        for user in all_users:
-            for i in range(random.randint(5, 15)):
-                activity_type = random.choice(activity_types)
-                duration = random.randint(20, 120)
-                distance = round(random.uniform(1, 20), 2) if activity_type in ['Running', 'Cycling', 'Swimming'] else None
-                calories = duration * random.randint(5, 10)
-                date = datetime.now() - timedelta(days=random.randint(1, 30))
-                
-                Activity.objects.create(
-                    user_id=str(user._id),
-                    activity_type=activity_type,
-                    duration=duration,
-                    distance=distance,
-                    calories=calories,
-                    date=date,
-                    notes=f'{activity_type} session by {user.name}'
-                )
+        with self.phase('Creating leaderboard entries'):
+            self.create_leaderboard(users, totals)
         
-        self.stdout.write('Creating leaderboard entries...')
-        
-        # Create leaderboard entries
-        for user in all_users:
-            activities = Activity.objects.filter(user_id=str(user._id))
-            total_activities = activities.count()
-            total_calories = sum(activity.calories for activity in activities)
-            total_distance = sum(activity.distance for activity in activities if activity.distance)
-            
-            Leaderboard.objects.create(
-                user_id=str(user._id),
-                team_id=user.team_id,
-                total_activities=total_activities,
-                total_calories=total_calories,
-                total_distance=round(total_distance, 2)
-            )
+        with self.phase('Creating team leaderboard'):
+            rebuild_team_leaderboard()
+        
+        with self.phase('Assigning fitness levels'):
+            store_fitness_levels({user_id: calories for user_id, (_, calories, _) in totals.items()})
+        
+        with self.phase('Building daily activity rollups'):
+            rebuild_daily_rollups(self.batch_size)
+        
+        with self.phase('Creating workout suggestions'):
+            for workout in WORKOUTS:
+                Workout.objects.create(**workout)
         
-        # Update ranks
-        leaderboard_entries = Leaderboard.objects.all().order_by('-total_calories')
-        for rank, entry in enumerate(leaderboard_entries, start=1):
-            entry.rank = rank
-            entry.save()
-        
-        self.stdout.write('Creating workout suggestions...')
-        
-        # Create workout suggestions
-        workouts = [
-            {
-                'name': 'Super Soldier Strength',
-                'description': 'High-intensity strength training inspired by Captain America',
-                'difficulty': 'Hard',
-                'duration': 60,
-                'calories_estimate': 600,
-                'category': 'Strength'
-            },
-            {
-                'name': 'Web-Slinger Cardio',
-                'description': 'Fast-paced cardio workout like Spider-Man swinging through the city',
-                'difficulty': 'Medium',
-                'duration': 45,
-                'calories_estimate': 450,
-                'category': 'Cardio'
-            },
-            {
-                'name': 'Amazon Warrior Training',
-                'description': 'Combat-focused workout inspired by Wonder Woman',
-                'difficulty': 'Hard',
-                'duration': 75,
-                'calories_estimate': 700,
-                'category': 'Combat'
-            },
-            {
-                'name': 'Flash Speed Circuit',
-                'description': 'High-speed interval training for maximum calorie burn',
-                'difficulty': 'Hard',
-                'duration': 30,
-                'calories_estimate': 500,
-                'category': 'HIIT'
-            },
-            {
-                'name': 'Zen Master Meditation',
-                'description': 'Mindfulness and flexibility workout',
-                'difficulty': 'Easy',
-                'duration': 30,
-                'calories_estimate': 150,
-                'category': 'Yoga'
-            },
-            {
-                'name': 'Dark Knight Endurance',
-                'description': 'Batman-inspired endurance and stamina training',
-                'difficulty': 'Medium',
-                'duration': 60,
-                'calories_estimate': 550,
-                'category': 'Endurance'
-            },
-            {
-                'name': 'Asgardian Power Lift',
-                'description': 'Thor-inspired heavy lifting and power training',
-                'difficulty': 'Hard',
-                'duration': 50,
-                'calories_estimate': 600,
-                'category': 'Powerlifting'
-            },
-            {
-                'name': 'Atlantean Swimming',
-                'description': 'Aquaman-inspired swimming workout for full-body conditioning',
-                'difficulty': 'Medium',
-                'duration': 45,
-                'calories_estimate': 400,
-                'category': 'Swimming'
-            },
-        ]
-        
-        for workout in workouts:
-            Workout.objects.create(**workout)
+        # Raw inserts bypass the invalidation signals
+        invalidate_all()
+        rank_index.invalidate()
+        activity_store.invalidate()
         
         self.stdout.write(self.style.SUCCESS('Database populated successfully!'))
-        self.stdout.write(f'Created {len(all_users)} users')
-        self.stdout.write(f'Created 2 teams')
-        self.stdout.write(f'Created {Activity.objects.count()} activities')
-        self.stdout.write(f'Created {Leaderboard.objects.count()} leaderboard entries')
-        self.stdout.write(f'Created {Workout.objects.count()} workout suggestions')
+        self.stdout.write(f'Created {len(users)} users')
+        self.stdout.write(f'Created {len(teams)} teams')
+        self.stdout.write(f'Created {sum(count for count, _, _ in totals.values())} activities')
+        self.stdout.write(f'Created {len(totals)} leaderboard entries')
+        self.stdout.write(f'Created {len(WORKOUTS)} workout suggestions')
+        self.stdout.write('Timings:')
+        for label, seconds in self.timings:
+            self.stdout.write(f'  {label:32} {seconds:8.2f}s')
+
+    @contextmanager
+    def phase(self, label):
+        self.stdout.write(f'{label}...')
+        started = time.perf_counter()
+        yield
+        self.timings.append((label, time.perf_counter() - started))
+
+    def insert(self, model, documents):
+        """
+        Insert documents in batch_size chunks, bypassing the ORM and its signals
+        """
+        batch = []
+        for document in documents:
+            batch.append(document)
+            if len(batch) >= self.batch_size:
+                model.objects.mongo_insert_many(batch, ordered=False)
+                batch = []
+        if batch:
+            model.objects.mongo_insert_many(batch, ordered=False)
+
+    def create_users(self, count, team_ids):
+        """
+        Insert the users and return them as (user_id, team_id, name) tuples
+        """
+        if count is None:
+            roster = [(hero, team_ids[0]) for hero in MARVEL_HEROES] + [(hero, team_ids[1]) for hero in DC_HEROES]
+        else:
+            roster = (
+                (
+                    {'name': f'User {number}', 'email': f'user{number}@octofit.test', 'password': f'user{number}'},
+                    team_ids[number % len(team_ids)]
+                )
+                for number in range(count)
+            )
+        
+        users = []
+        documents = []
+        for hero, team_id in roster:
+            user_id = ObjectId()
+            users.append((user_id, team_id, hero['name']))
+            documents.append({
+                '_id': user_id,
+                'name': hero['name'],
+                'email': hero['email'],
+                'password': hero['password'],
+                'team_id': team_id,
+                'fitness_level': fitness_level(0),
+                'created_at': self.now,
+            })
+            if len(documents) >= self.batch_size:
+                self.insert(User, documents)
+                documents = []
+        self.insert(User, documents)
+        return users
+
+    def create_activities(self, users, per_user, days):
+        """
+        Stream generated activities into Mongo in batches, returning
+        per-user [count, calories, distance] totals
+        """
+        rng = self.rng
+        totals = {}
+        
+        def generate():
+            for user_id, _, name in users:
+                count = per_user if per_user is not None else rng.randint(5, 15)
+                user_totals = totals.setdefault(user_id, [0, 0, 0.0])
+                for _ in range(count):
+                    activity_type = rng.choice(ACTIVITY_TYPES)
+                    duration = rng.randint(20, 120)
+                    distance = round(rng.uniform(1, 20), 2) if activity_type in DISTANCE_TYPES else None
+                    calories = duration * rng.randint(5, 10)
+                    user_totals[0] += 1
+                    user_totals[1] += calories
+                    user_totals[2] += distance or 0.0
+                    yield {
+                        'user_id': user_id,
+                        'activity_type': activity_type,
+                        'duration': duration,
+                        'distance': distance,
+                        'calories': calories,
+                        'date': self.now - timedelta(days=rng.randint(1, days), seconds=rng.randint(0, 86399)),
+                        'notes': f'{activity_type} session by {name}',
+                    }
+        
+        self.insert(Activity, generate())
+        return totals
+
+    def create_leaderboard(self, users, totals):
+        """
+        Insert one leaderboard row per user with competition ranks
+        computed in memory
+        """
+        teams = {user_id: team_id for user_id, team_id, _ in users}
+        ordered = sorted(totals.items(), key=lambda item: -item[1][1])
+        
+        def rows():
+            rank = previous_calories = None
+            for position, (user_id, (count, calories, distance)) in enumerate(ordered, start=1):
+                if calories != previous_calories:
+                    rank, previous_calories = position, calories
+                yield {
+                    'user_id': user_id,
+                    'team_id': teams[user_id],
+                    'total_activities': count,
+                    'total_calories': calories,
+                    'total_distance': distance,
+                    'rank': rank,
+                }
+        
+        self.insert(Leaderboard, rows())
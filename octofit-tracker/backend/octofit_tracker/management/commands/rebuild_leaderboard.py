@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker.leaderboard import REBUILD_BATCH_SIZE, rebuild_leaderboard
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the leaderboard from the activities collection: user totals with one $group pipeline '
+        'and bulk upserts, then ranks, the team leaderboard and fitness levels'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=REBUILD_BATCH_SIZE, help='Rows per bulk write')
+
+    def handle(self, *args, **options):
+        self.phases = {}
+        
+        self.stdout.write('Rebuilding the leaderboard...')
+        result = rebuild_leaderboard(options['batch_size'], on_phase=self.phase_done)
+        
+        elapsed = sum(seconds for _, seconds in self.phases.values())
+        self.stdout.write(self.style.SUCCESS('Leaderboard rebuilt'))
+        self.stdout.write(
+            f'{result.users} users, {result.activities} activities: {result.inserted} rows inserted, '
+            f'{result.updated} updated, {result.zeroed} zeroed, {self.phases["ranks"][0]} re-ranked'
+        )
+        self.stdout.write(
+            f'{self.phases["team leaderboard"][0]} teams, {self.phases["fitness levels"][0]} fitness levels changed'
+        )
+        self.stdout.write(
+            f'Throughput: {rate(result.activities, self.phases["user totals"][1])} activities/s, '
+            f'{rate(result.users, elapsed)} users/s overall'
+        )
+        self.stdout.write('Timings:')
+        for name, (_, seconds) in self.phases.items():
+            self.stdout.write(f'  {name:32} {seconds:8.2f}s')
+
+    def phase_done(self, name, result, seconds):
+        self.stdout.write(f'  {name} done')
+        self.phases[name] = (result, seconds)
+
+
+def rate(count, seconds):
+    return f'{count / seconds:,.0f}' if seconds > 0 else 'n/a'
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker.rollups import REBUILD_BATCH_SIZE, rebuild_daily_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the activity_daily rollups from the activities collection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=REBUILD_BATCH_SIZE, help='Documents per insert')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding daily activity rollups...')
+        written = rebuild_daily_rollups(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} daily rollup documents'))
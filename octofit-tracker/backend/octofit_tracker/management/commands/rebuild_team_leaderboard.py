@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker.leaderboard import rebuild_team_leaderboard
+
+
+class Command(BaseCommand):
+    help = 'Recompute the team leaderboard from the per-user leaderboard rows'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding team leaderboard...')
+        teams = rebuild_team_leaderboard()
+        self.stdout.write(self.style.SUCCESS(f'Ranked {teams} teams'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker.fitness import recompute_fitness_levels
+
+
+class Command(BaseCommand):
+    help = 'Rewrite User.fitness_level from the leaderboard totals, e.g. after changing FITNESS_TIERS'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Recomputing fitness levels...')
+        
+        changed = recompute_fitness_levels()
+        
+        self.stdout.write(self.style.SUCCESS(f'Updated the fitness level of {changed} users'))
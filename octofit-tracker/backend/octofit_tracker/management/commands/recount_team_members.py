@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+from octofit_tracker.models import User, Team
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the materialized Team.member_count values from the users collection'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Counting team members...')
+        
+        counts = {
+            row['_id']: row['count']
+            for row in User.objects.mongo_aggregate([
+                {'$match': {'team_id': {'$ne': None}}},
+                {'$group': {'_id': '$team_id', 'count': {'$sum': 1}}},
+            ])
+        }
+        
+        # Every team gets a value so teams that lost all members drop to 0
+        updates = [
+            UpdateOne({'_id': team['_id']}, {'$set': {'member_count': counts.get(team['_id'], 0)}})
+            for team in Team.objects.mongo_find({}, {'_id': 1})
+        ]
+        if updates:
+            Team.objects.mongo_bulk_write(updates, ordered=False)
+        
+        self.stdout.write(self.style.SUCCESS(f'Recounted members for {len(updates)} teams'))
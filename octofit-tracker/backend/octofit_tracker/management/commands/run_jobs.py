@@ -0,0 +1,35 @@
+import time
+from django.core.management.base import BaseCommand
+from octofit_tracker.tasks import run_due_jobs, start_workers, stop_workers
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs in the foreground, e.g. on a worker host or when TASK_WORKERS is 0'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help='Worker threads')
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Run the jobs that are due now in this thread and exit'
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='With --once, also run pending jobs that are still within their delay'
+        )
+
+    def handle(self, *args, **options):
+        if options['once']:
+            count = run_due_jobs(force=options['force'])
+            self.stdout.write(self.style.SUCCESS(f'Ran {count} jobs'))
+            return
+        
+        start_workers(options['workers'])
+        self.stdout.write(self.style.SUCCESS(f'{options["workers"]} workers running, Ctrl-C to stop'))
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping workers...')
+            stop_workers()
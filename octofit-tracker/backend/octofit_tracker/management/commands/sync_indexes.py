@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker.indexes import (
+    collection_for,
+    declared_indexes,
+    diff_indexes,
+    indexed_models,
+    unused_indexes,
+)
+
+
+class Command(BaseCommand):
+    help = 'Create missing MongoDB indexes declared on the models and report extra or unused ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report what would change'
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        
+        for model in indexed_models():
+            collection = collection_for(model)
+            missing, mismatched, extra = diff_indexes(collection, declared_indexes(model))
+            self.stdout.write(f'{collection.name}:')
+            
+            # An index created by a migration under the declared name but
+            # with the wrong key has to be dropped before it can be rebuilt
+            for index in mismatched:
+                name = index.document['name']
+                self.stdout.write(self.style.WARNING(f'  rebuilding {name} (key differs from declaration)'))
+                if not dry_run:
+                    collection.drop_index(name)
+            
+            to_create = mismatched + missing
+            for index in missing:
+                self.stdout.write(self.style.SUCCESS(f'  creating {index.document["name"]}'))
+            if to_create and not dry_run:
+                collection.create_indexes(to_create)
+            
+            for name in extra:
+                self.stdout.write(self.style.WARNING(f'  extra index {name} is not declared on {model.__name__}'))
+            for name in unused_indexes(collection):
+                self.stdout.write(f'  index {name} has not been used since the server started')
+            
+            if not (to_create or extra):
+                self.stdout.write('  up to date')
+        
+        if dry_run:
+            self.stdout.write('Dry run, no indexes were changed')
@@ -0,0 +1,359 @@
+"""
+Per-endpoint request metrics in the Prometheus text format
+
+MetricsMiddleware measures every request and labels the observations with
+the resolved view name and method. The time a request spends in the
+database is split three ways:
+
+- Mongo I/O, measured by a pymongo CommandListener, so raw mongo_* reads
+  and the ORM are counted alike;
+- djongo's SQL translation, the time ORM statements spend in
+  cursor.execute() minus the Mongo I/O issued inside it;
+- serialization: serializer to_representation() plus response rendering.
+
+Commands slower than SLOW_QUERY_THRESHOLD_MS are logged to the
+octofit_tracker.slow_queries logger whether or not they ran in a request.
+
+Metrics live in process memory: with several workers each exposes its own,
+and Prometheus sums them across instances.
+"""
+import logging
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from pymongo import monitoring
+
+
+slow_query_logger = logging.getLogger('octofit_tracker.slow_queries')
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# Follow-up commands of a cursor that was already counted
+CURSOR_COMMANDS = {'getMore', 'killCursors'}
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_current = ContextVar('octofit_request_metrics', default=None)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values):
+    return ','.join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+
+
+class Histogram:
+    def __init__(self, name, documentation, buckets, labelnames=('view', 'method')):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labelnames = labelnames
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * len(self.buckets), 0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def totals(self, labels):
+        """
+        (sum, count) of the observations of one series
+        """
+        with self.lock:
+            series = self.series.get(labels)
+            return (series[1], series[2]) if series else (0, 0)
+
+    def collect(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        with self.lock:
+            series = sorted((labels, (list(counts), total, count)) for labels, (counts, total, count) in self.series.items())
+        for labels, (counts, total, count) in series:
+            prefix = format_labels(self.labelnames, labels)
+            for bound, bucket_count in zip(self.buckets, counts):
+                yield f'{self.name}_bucket{{{prefix},le="{bound}"}} {bucket_count}'
+            yield f'{self.name}_bucket{{{prefix},le="+Inf"}} {count}'
+            yield f'{self.name}_sum{{{prefix}}} {total}'
+            yield f'{self.name}_count{{{prefix}}} {count}'
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self.lock:
+            self.series[labels] = self.series.get(labels, 0) + amount
+
+    def collect(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        with self.lock:
+            series = sorted(self.series.items())
+        for labels, value in series:
+            if labels:
+                yield f'{self.name}{{{format_labels(self.labelnames, labels)}}} {value}'
+            else:
+                yield f'{self.name} {value}'
+
+
+REQUESTS = Counter('octofit_http_requests_total', 'Requests served', ('view', 'method', 'status'))
+REQUEST_DURATION = Histogram('octofit_http_request_duration_seconds', 'Time to produce the response', DURATION_BUCKETS)
+DB_QUERIES = Histogram('octofit_http_request_db_queries', 'Mongo commands issued per request', COUNT_BUCKETS)
+ORM_STATEMENTS = Histogram('octofit_http_request_orm_statements', 'ORM statements executed per request', COUNT_BUCKETS)
+DB_DURATION = Histogram('octofit_http_request_db_seconds', 'Time spent waiting on Mongo per request', DURATION_BUCKETS)
+TRANSLATION_DURATION = Histogram(
+    'octofit_http_request_translation_seconds', 'Time djongo spent translating SQL per request', DURATION_BUCKETS
+)
+SERIALIZATION_DURATION = Histogram(
+    'octofit_http_request_serialization_seconds', 'Time spent serializing and rendering per request', DURATION_BUCKETS
+)
+RESPONSE_SIZE = Histogram('octofit_http_response_size_bytes', 'Response body size', SIZE_BUCKETS)
+SLOW_QUERIES = Counter('octofit_slow_queries_total', 'Mongo commands slower than SLOW_QUERY_THRESHOLD_MS', ('command',))
+
+METRICS = [
+    REQUESTS,
+    REQUEST_DURATION,
+    DB_QUERIES,
+    ORM_STATEMENTS,
+    DB_DURATION,
+    TRANSLATION_DURATION,
+    SERIALIZATION_DURATION,
+    RESPONSE_SIZE,
+    SLOW_QUERIES,
+]
+
+
+class RequestMetrics:
+    """
+    What one request has spent so far
+    """
+    __slots__ = ('queries', 'statements', 'db_seconds', 'translation_seconds', 'serialization_seconds', 'serializing')
+
+    def __init__(self):
+        self.queries = 0
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.translation_seconds = 0.0
+        self.serialization_seconds = 0.0
+        self.serializing = False
+
+
+def current():
+    """
+    The metrics of the request being served, or None outside a request
+    """
+    return _current.get()
+
+
+@contextmanager
+def timed_serialization():
+    """
+    Add the time spent in the block to the request's serialization time;
+    nested blocks are counted once
+    """
+    metrics = _current.get()
+    if metrics is None or metrics.serializing:
+        yield
+        return
+    metrics.serializing = True
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serialization_seconds += time.perf_counter() - started
+        metrics.serializing = False
+
+
+def slow_query_threshold():
+    threshold = getattr(settings, 'SLOW_QUERY_THRESHOLD_MS', None)
+    return None if threshold is None else threshold / 1000
+
+
+class QueryListener(monitoring.CommandListener):
+    """
+    Counts Mongo commands and their time against the current request and
+    logs slow ones
+    """
+
+    def __init__(self):
+        self.pending = {}
+
+    def started(self, event):
+        if slow_query_threshold() is not None:
+            self.pending[(event.connection_id, event.request_id)] = event.command
+
+    def succeeded(self, event):
+        self.finished(event)
+
+    def failed(self, event):
+        self.finished(event)
+
+    def finished(self, event):
+        seconds = event.duration_micros / 1e6
+        command = self.pending.pop((event.connection_id, event.request_id), None)
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.db_seconds += seconds
+            if event.command_name not in CURSOR_COMMANDS:
+                metrics.queries += 1
+        threshold = slow_query_threshold()
+        if threshold is not None and seconds >= threshold:
+            SLOW_QUERIES.inc((event.command_name,))
+            slow_query_logger.warning(
+                'Slow Mongo %s on %s took %.1f ms: %s',
+                event.command_name, event.database_name, seconds * 1000, summarize(command)
+            )
+
+
+def summarize(command, limit=500):
+    """
+    The command as logged: documents being written are left out
+    """
+    if command is None:
+        return ''
+    shown = {key: value for key, value in command.items() if key not in ('documents', 'updates', 'deletes', 'lsid', '$db')}
+    text = repr(shown)
+    return text if len(text) <= limit else text[:limit] + '...'
+
+
+_listener = None
+
+
+def install_query_listener():
+    """
+    Register the command listener; clients created afterwards report to it
+    """
+    global _listener
+    if _listener is None:
+        _listener = QueryListener()
+        monitoring.register(_listener)
+
+
+def translation_wrapper(execute, sql, params, many, context):
+    """
+    A connection.execute_wrapper() measuring the time djongo spends in
+    cursor.execute() outside Mongo I/O
+    """
+    metrics = _current.get()
+    metrics.statements += 1
+    db_seconds = metrics.db_seconds
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.translation_seconds += max(elapsed - (metrics.db_seconds - db_seconds), 0.0)
+
+
+class MetricsMiddleware:
+    """
+    Hybrid middleware: under ASGI it stays async, so the rest of the chain
+    isn't adapted to sync and the async views keep sharing the event loop
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(translation_wrapper))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, metrics, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        # ORM statements of async code run on sync_to_async threads, whose
+        # connections the translation wrapper can't be installed on here;
+        # the Mongo I/O and serialization time are still measured
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, metrics, time.perf_counter() - started)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns; time that too
+        metrics = _current.get()
+        if metrics is not None:
+            started = time.perf_counter()
+
+            def rendered(response):
+                metrics.serialization_seconds += time.perf_counter() - started
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def record(self, request, response, metrics, seconds):
+        match = getattr(request, 'resolver_match', None)
+        labels = (match.view_name if match else '<unresolved>', request.method)
+        REQUESTS.inc((*labels, response.status_code))
+        REQUEST_DURATION.observe(labels, seconds)
+        DB_QUERIES.observe(labels, metrics.queries)
+        ORM_STATEMENTS.observe(labels, metrics.statements)
+        DB_DURATION.observe(labels, metrics.db_seconds)
+        TRANSLATION_DURATION.observe(labels, metrics.translation_seconds)
+        SERIALIZATION_DURATION.observe(labels, metrics.serialization_seconds)
+        if response.streaming:
+            response.streaming_content = counted(response.streaming_content, labels)
+        else:
+            RESPONSE_SIZE.observe(labels, len(response.content))
+
+
+def counted(chunks, labels):
+    """
+    Pass a streaming body through, observing its size once it is sent
+    """
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+        yield chunk
+    RESPONSE_SIZE.observe(labels, size)
+
+
+def render_metrics():
+    return '\n'.join(line for metric in METRICS for line in metric.collect()) + '\n'
+
+
+def metrics_view(request):
+    """
+    Every metric of this process in the Prometheus text format
+    """
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE)
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 00:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='team',
+            name='member_count',
+            field=models.IntegerField(default=0),
+        ),
+    ]
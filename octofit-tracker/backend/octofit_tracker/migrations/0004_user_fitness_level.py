@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 00:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0003_model_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='fitness_level',
+            field=models.CharField(default='Beginner', max_length=20),
+        ),
+    ]
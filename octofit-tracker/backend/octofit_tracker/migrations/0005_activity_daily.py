@@ -0,0 +1,33 @@
+# Generated by Django 4.1.7 on 2026-10-18 00:34
+
+from django.db import migrations, models
+import djongo.models.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0004_user_fitness_level'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityDaily',
+            fields=[
+                ('_id', djongo.models.fields.ObjectIdField(auto_created=True, primary_key=True, serialize=False)),
+                ('user_id', models.CharField(max_length=100)),
+                ('day', models.DateTimeField()),
+                ('activities', models.IntegerField(default=0)),
+                ('duration', models.IntegerField(default=0)),
+                ('calories', models.IntegerField(default=0)),
+                ('distance', models.FloatField(default=0.0)),
+            ],
+            options={
+                'db_table': 'activity_daily',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='activitydaily',
+            constraint=models.UniqueConstraint(fields=('user_id', 'day'), name='activity_daily_user_day_uniq'),
+        ),
+    ]
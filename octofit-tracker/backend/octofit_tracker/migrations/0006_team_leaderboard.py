@@ -0,0 +1,33 @@
+# Generated by Django 4.1.7 on 2026-10-18 00:35
+
+from django.db import migrations, models
+import djongo.models.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0005_activity_daily'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TeamLeaderboard',
+            fields=[
+                ('_id', djongo.models.fields.ObjectIdField(auto_created=True, primary_key=True, serialize=False)),
+                ('team_id', models.CharField(max_length=100, unique=True)),
+                ('team_name', models.CharField(blank=True, max_length=100, null=True)),
+                ('total_activities', models.IntegerField(default=0)),
+                ('total_calories', models.IntegerField(default=0)),
+                ('total_distance', models.FloatField(default=0.0)),
+                ('rank', models.IntegerField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'team_leaderboard',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='teamleaderboard',
+            index=models.Index(fields=['rank', '_id'], name='team_leaderboard_rank_idx'),
+        ),
+    ]
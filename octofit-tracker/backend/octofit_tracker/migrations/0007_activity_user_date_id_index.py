@@ -0,0 +1,21 @@
+# Generated by Django 4.1.7 on 2026-10-18 00:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0006_team_leaderboard'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='activity',
+            name='activities_user_date_idx',
+        ),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['user_id', '-date', '-_id'], name='activities_user_date_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.1.7 on 2026-10-18 01:03
+
+from django.db import migrations
+import octofit_tracker.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0007_activity_user_date_id_index'),
+    ]
+
+    # Mongo has no column types to alter and djongo can't translate ALTER
+    # COLUMN ... TYPE, so this only updates the model state; existing
+    # documents are converted by the migrate_object_ids command
+    operations = [
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.AlterField(
+                model_name='activity',
+                name='user_id',
+                field=octofit_tracker.fields.ReferenceField(),
+            ),
+            migrations.AlterField(
+                model_name='activitydaily',
+                name='user_id',
+                field=octofit_tracker.fields.ReferenceField(),
+            ),
+            migrations.AlterField(
+                model_name='leaderboard',
+                name='team_id',
+                field=octofit_tracker.fields.ReferenceField(blank=True, null=True),
+            ),
+            migrations.AlterField(
+                model_name='leaderboard',
+                name='user_id',
+                field=octofit_tracker.fields.ReferenceField(),
+            ),
+            migrations.AlterField(
+                model_name='teamleaderboard',
+                name='team_id',
+                field=octofit_tracker.fields.ReferenceField(unique=True),
+            ),
+            migrations.AlterField(
+                model_name='user',
+                name='team_id',
+                field=octofit_tracker.fields.ReferenceField(blank=True, null=True),
+            ),
+        ]),
+    ]
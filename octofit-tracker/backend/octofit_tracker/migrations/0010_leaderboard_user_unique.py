@@ -0,0 +1,50 @@
+# Generated by Django 4.1.7 on 2026-10-18 01:36
+
+from django.db import migrations, models
+
+
+def merge_duplicate_rows(apps, schema_editor):
+    # Concurrent first activities could each insert a row for the user,
+    # each holding part of the totals; fold them into the oldest row so
+    # the unique index can be built (assign_ranks re-ranks it)
+    schema_editor.connection.ensure_connection()
+    leaderboard = schema_editor.connection.connection['leaderboard']
+    duplicates = leaderboard.aggregate([
+        {'$sort': {'_id': 1}},
+        {'$group': {
+            '_id': '$user_id',
+            'ids': {'$push': '$_id'},
+            'total_activities': {'$sum': '$total_activities'},
+            'total_calories': {'$sum': '$total_calories'},
+            'total_distance': {'$sum': '$total_distance'},
+        }},
+        {'$match': {'ids.1': {'$exists': True}}},
+    ], allowDiskUse=True)
+    for duplicate in duplicates:
+        keep, *others = duplicate['ids']
+        leaderboard.update_one({'_id': keep}, {'$set': {
+            'total_activities': duplicate['total_activities'],
+            'total_calories': duplicate['total_calories'],
+            'total_distance': duplicate['total_distance'],
+            'rank': None,
+        }})
+        leaderboard.delete_many({'_id': {'$in': others}})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0009_job'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='leaderboard',
+            name='leaderboard_user_idx',
+        ),
+        migrations.RunPython(merge_duplicate_rows, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='leaderboard',
+            constraint=models.UniqueConstraint(fields=('user_id',), name='leaderboard_user_uniq'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 4.1.7 on 2026-10-18 01:46
+
+from django.db import migrations, models
+from pymongo import ASCENDING
+
+
+def create_pending_name_index(apps, schema_editor):
+    # djongo turns the condition into a bogus key, so the partial index is
+    # created directly; duplicates from before it existed are failed first
+    schema_editor.connection.ensure_connection()
+    jobs = schema_editor.connection.connection['jobs']
+    duplicates = jobs.aggregate([
+        {'$match': {'status': 'pending'}},
+        {'$sort': {'created_at': 1}},
+        {'$group': {'_id': '$name', 'ids': {'$push': '$_id'}}},
+    ])
+    for duplicate in duplicates:
+        jobs.update_many(
+            {'_id': {'$in': duplicate['ids'][1:]}},
+            {'$set': {'status': 'failed', 'last_error': 'Merged into an older pending job'}}
+        )
+    jobs.create_index(
+        [('name', ASCENDING)],
+        name='jobs_pending_name_uniq',
+        unique=True,
+        partialFilterExpression={'status': 'pending'}
+    )
+
+
+def drop_pending_name_index(apps, schema_editor):
+    schema_editor.connection.ensure_connection()
+    schema_editor.connection.connection['jobs'].drop_index('jobs_pending_name_uniq')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0010_leaderboard_user_unique'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['status', 'finished_at'], name='jobs_status_finished_idx'),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddConstraint(
+                    model_name='job',
+                    constraint=models.UniqueConstraint(condition=models.Q(('status', 'pending')), fields=('name',), name='jobs_pending_name_uniq'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(create_pending_name_index, drop_pending_name_index),
+            ],
+        ),
+    ]
@@ -1,4 +1,5 @@
 from djongo import models
+from .fields import ReferenceField
 
 
 class User(models.Model):
@@ -6,26 +7,35 @@ class User(models.Model):
     name = models.CharField(max_length=100)
     email = models.EmailField(unique=True)
     password = models.CharField(max_length=255)
-    team_id = models.CharField(max_length=100, null=True, blank=True)
+    team_id = ReferenceField(null=True, blank=True)
+    fitness_level = models.CharField(max_length=20, default='Beginner')  # maintained by the leaderboard engine
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = models.DjongoManager()
+    
     class Meta:
         db_table = 'users'
+        indexes = [
+            models.Index(fields=['team_id'], name='users_team_idx'),
+        ]
 
 
 class Team(models.Model):
     _id = models.ObjectIdField()
     name = models.CharField(max_length=100)
     description = models.TextField(null=True, blank=True)
+    member_count = models.IntegerField(default=0)  # maintained by signals
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = models.DjongoManager()
+    
     class Meta:
         db_table = 'teams'
 
 
 class Activity(models.Model):
     _id = models.ObjectIdField()
-    user_id = models.CharField(max_length=100)
+    user_id = ReferenceField()
     activity_type = models.CharField(max_length=50)
     duration = models.IntegerField()  # in minutes
     distance = models.FloatField(null=True, blank=True)  # in kilometers
@@ -33,21 +43,79 @@ class Activity(models.Model):
     date = models.DateTimeField()
     notes = models.TextField(null=True, blank=True)
     
+    objects = models.DjongoManager()
+    
     class Meta:
         db_table = 'activities'
+        indexes = [
+            models.Index(fields=['user_id', '-date', '-_id'], name='activities_user_date_idx'),
+            models.Index(fields=['-date', '-_id'], name='activities_date_idx'),
+        ]
 
 
 class Leaderboard(models.Model):
     _id = models.ObjectIdField()
-    user_id = models.CharField(max_length=100)
-    team_id = models.CharField(max_length=100)
+    user_id = ReferenceField()
+    team_id = ReferenceField(null=True, blank=True)
     total_activities = models.IntegerField(default=0)
     total_calories = models.IntegerField(default=0)
     total_distance = models.FloatField(default=0.0)
     rank = models.IntegerField(null=True, blank=True)
     
+    objects = models.DjongoManager()
+    
     class Meta:
         db_table = 'leaderboard'
+        indexes = [
+            models.Index(fields=['rank', '_id'], name='leaderboard_rank_idx'),
+            models.Index(fields=['-total_calories'], name='leaderboard_calories_idx'),
+        ]
+        constraints = [
+            # One row per user: the leaderboard engine upserts by user_id
+            models.UniqueConstraint(fields=['user_id'], name='leaderboard_user_uniq'),
+        ]
+
+
+class TeamLeaderboard(models.Model):
+    """
+    Per-team totals and ranks, maintained by the leaderboard engine
+    """
+    _id = models.ObjectIdField()
+    team_id = ReferenceField(unique=True)
+    team_name = models.CharField(max_length=100, null=True, blank=True)
+    total_activities = models.IntegerField(default=0)
+    total_calories = models.IntegerField(default=0)
+    total_distance = models.FloatField(default=0.0)
+    rank = models.IntegerField(null=True, blank=True)
+    
+    objects = models.DjongoManager()
+    
+    class Meta:
+        db_table = 'team_leaderboard'
+        indexes = [
+            models.Index(fields=['rank', '_id'], name='team_leaderboard_rank_idx'),
+        ]
+
+
+class ActivityDaily(models.Model):
+    """
+    Per-user, per-day activity totals, maintained from activity writes
+    """
+    _id = models.ObjectIdField()
+    user_id = ReferenceField()
+    day = models.DateTimeField()  # midnight UTC
+    activities = models.IntegerField(default=0)
+    duration = models.IntegerField(default=0)
+    calories = models.IntegerField(default=0)
+    distance = models.FloatField(default=0.0)
+    
+    objects = models.DjongoManager()
+    
+    class Meta:
+        db_table = 'activity_daily'
+        constraints = [
+            models.UniqueConstraint(fields=['user_id', 'day'], name='activity_daily_user_day_uniq'),
+        ]
 
 
 class Workout(models.Model):
@@ -61,3 +129,37 @@ class Workout(models.Model):
     
     class Meta:
         db_table = 'workouts'
+
+
+class Job(models.Model):
+    """
+    A background job run by the workers in tasks.py
+    """
+    _id = models.ObjectIdField()
+    name = models.CharField(max_length=50)
+    status = models.CharField(max_length=10, default='pending')
+    requests = models.IntegerField(default=1)  # enqueues coalesced into this job
+    attempts = models.IntegerField(default=0)
+    run_after = models.DateTimeField()  # pushed back by each enqueue while pending
+    deadline = models.DateTimeField()  # runs by then however often it is enqueued
+    lease_until = models.DateTimeField(null=True, blank=True)
+    worker = models.CharField(max_length=100, null=True, blank=True)
+    result = models.TextField(null=True, blank=True)
+    last_error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField()
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    objects = models.DjongoManager()
+    
+    class Meta:
+        db_table = 'jobs'
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='jobs_status_run_after_idx'),
+            models.Index(fields=['name', 'status'], name='jobs_name_status_idx'),
+            models.Index(fields=['status', 'finished_at'], name='jobs_status_finished_idx'),
+        ]
+        constraints = [
+            # At most one pending job per name: enqueue merges into it
+            models.UniqueConstraint(fields=['name'], condition=models.Q(status='pending'), name='jobs_pending_name_uniq'),
+        ]
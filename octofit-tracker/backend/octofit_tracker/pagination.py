@@ -0,0 +1,217 @@
+"""
+Keyset (cursor) pagination for the list endpoints
+
+Pages are addressed by the sort key of the row at the page boundary rather
+than by an offset, so every page is a range read on the ordering index
+instead of a skip over all earlier rows, and rows written while a client is
+paging don't shift later pages.
+"""
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from bson import ObjectId
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over a compound ordering
+
+    Views choose the ordering with a `cursor_ordering` attribute; the last
+    field must be unique (normally `_id`) so every row has a distinct key.
+    Nulls sort first unless the field is in `cursor_nulls_last`, which the
+    Mongo reads (see mongo_reads) honour for the leading field.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    ordering = ('_id',)
+    nulls_last = ()
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self):
+        self.page_size = api_settings.PAGE_SIZE
+        self.max_page_size = getattr(settings, 'PAGINATION_MAX_PAGE_SIZE', 500)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        ordering, position = self.start(request, queryset.model, getattr(view, 'cursor_ordering', None))
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.after(ordering, position))
+        return self.finish(list(queryset[:self.page_size + 1]), position)
+
+    def start(self, request, model, cursor_ordering=None, nulls_last=()):
+        """
+        Read the page size and cursor; returns the ordering to fetch in and
+        the position to fetch after (None on the first page). Callers fetch
+        page_size + 1 rows from there and hand them to finish()
+        """
+        self.request = request
+        self.ordering = tuple(cursor_ordering or self.ordering)
+        self.nulls_last = tuple(nulls_last)
+        self.page_size = self.get_page_size(request)
+        position, self.reverse = self.decode_cursor(request, model)
+        return (self.reversed_ordering() if self.reverse else self.ordering), position
+
+    def finish(self, rows, position):
+        has_more = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        if self.reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            requested = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(requested, self.max_page_size))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.link_for(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            # Paged past the end; step back to the first page
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.link_for(self.page[0], reverse=True)
+
+    def link_for(self, row, reverse):
+        position = [self.encode_value(getattr(row, field.lstrip('-'))) for field in self.ordering]
+        token = urlsafe_b64encode(json.dumps({'p': position, 'r': reverse}).encode()).decode()
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, token)
+
+    def decode_cursor(self, request, model):
+        """
+        Return (position, reverse) from the request's cursor, or (None, False)
+        """
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None, False
+        try:
+            cursor = json.loads(urlsafe_b64decode(token.encode()))
+            values = cursor['p']
+            if len(values) != len(self.ordering):
+                raise ValueError('cursor does not match the ordering')
+            position = [
+                self.decode_value(model._meta.get_field(field.lstrip('-')), value)
+                for field, value in zip(self.ordering, values)
+            ]
+            return position, bool(cursor.get('r'))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_value(self, value):
+        if isinstance(value, datetime):
+            return value.isoformat()
+        if isinstance(value, ObjectId):
+            return str(value)
+        return value
+
+    def decode_value(self, field, value):
+        if value is None:
+            return None
+        return field.to_python(value)
+
+    def reversed_ordering(self):
+        return tuple(field[1:] if field.startswith('-') else '-' + field for field in self.ordering)
+
+    def after(self, ordering, position):
+        """
+        Rows strictly after position in the given ordering, as an OR of
+        "equal on the leading fields, past it on the next one" terms
+        """
+        terms = []
+        equal = Q()
+        for field, value in zip(ordering, position):
+            name, descending = field.lstrip('-'), field.startswith('-')
+            past = self.past(name, value, descending)
+            if past is not None:
+                terms.append(equal & past)
+            equal &= Q(**{f'{name}__isnull': True}) if value is None else Q(**{name: value})
+        condition = terms[0]
+        for term in terms[1:]:
+            condition |= term
+        return condition
+
+    def mongo_sort(self, ordering):
+        return [(field.lstrip('-'), -1 if field.startswith('-') else 1) for field in ordering]
+
+    def mongo_reads(self, query, ordering):
+        """
+        The (filter, sort) reads that return the rows matching query in the
+        given ordering when run in turn. Mongo sorts nulls first, so a
+        leading nulls_last field is read as its non-null rows and its null
+        rows separately
+        """
+        sort = self.mongo_sort(ordering)
+        name, direction = sort[0]
+        if name not in self.nulls_last:
+            return [(query, sort)]
+        matches = [{name: {'$ne': None}}, {name: None}]
+        if direction < 0:
+            matches.reverse()
+        return [({'$and': [query, match]} if query else match, sort) for match in matches]
+
+    def mongo_after(self, ordering, position):
+        """
+        after() as a Mongo filter document, for callers that query the
+        collection directly; field names must match their columns
+        """
+        terms = []
+        equal = []
+        for field, value in zip(ordering, position):
+            name, descending = field.lstrip('-'), field.startswith('-')
+            past = self.mongo_past(name, value, descending)
+            if past is not None:
+                terms.append({'$and': equal + [past]} if equal else past)
+            equal = equal + [{name: value}]
+        return {'$or': terms}
+
+    def mongo_past(self, name, value, descending):
+        # Nulls come after every other value when sorted descending, or
+        # ascending on a nulls_last field
+        nulls_after = descending != (name in self.nulls_last)
+        if value is None:
+            return None if nulls_after else {name: {'$ne': None}}
+        past = {name: {'$lt' if descending else '$gt': value}}
+        return {'$or': [past, {name: None}]} if nulls_after else past
+
+    def past(self, name, value, descending):
+        # Mongo sorts nulls before every other value
+        if descending:
+            if value is None:
+                return None
+            return Q(**{f'{name}__lt': value}) | Q(**{f'{name}__isnull': True})
+        if value is None:
+            return Q(**{f'{name}__isnull': False})
+        return Q(**{f'{name}__gt': value})
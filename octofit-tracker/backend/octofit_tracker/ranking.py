@@ -0,0 +1,122 @@
+"""
+Process-level rank index over leaderboard calories
+
+Keeps every user's total_calories in a sorted container so "rank of X",
+"top K" and "users around X" are answered in O(log n) without touching
+Mongo. Ranks match the stored Leaderboard.rank (competition ranking:
+1 + the number of users with strictly more calories).
+
+The index is loaded from the leaderboard collection on first use and
+kept in sync by the leaderboard engine. Writes made by other processes
+are picked up when the index is reloaded after RANK_INDEX_MAX_AGE seconds.
+"""
+import threading
+import time
+from django.conf import settings
+from sortedcontainers import SortedList
+from .models import Leaderboard
+
+
+class RankIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._keys = SortedList()
+        self._calories = {}
+        self.loaded_at = None
+
+    def __len__(self):
+        return len(self._calories)
+
+    def load(self, rows):
+        """
+        Replace the contents with (user_id, total_calories) pairs
+        """
+        calories = {user_id: total for user_id, total in rows}
+        keys = SortedList((-total, user_id) for user_id, total in calories.items())
+        with self._lock:
+            self._calories, self._keys = calories, keys
+            self.loaded_at = time.monotonic()
+
+    def invalidate(self):
+        """
+        Force a reload from Mongo on next use
+        """
+        self.loaded_at = None
+
+    def update(self, user_id, calories):
+        with self._lock:
+            previous = self._calories.get(user_id)
+            if previous is not None:
+                self._keys.remove((-previous, user_id))
+            self._calories[user_id] = calories
+            self._keys.add((-calories, user_id))
+
+    def remove(self, user_id):
+        with self._lock:
+            previous = self._calories.pop(user_id, None)
+            if previous is not None:
+                self._keys.remove((-previous, user_id))
+
+    def rank(self, user_id):
+        with self._lock:
+            calories = self._calories.get(user_id)
+            if calories is None:
+                return None
+            return self._rank_of(calories)
+
+    def top(self, k):
+        """
+        The k highest users as (user_id, total_calories, rank)
+        """
+        with self._lock:
+            return [self._entry(key) for key in self._keys.islice(0, k)]
+
+    def around(self, user_id, radius):
+        """
+        The user plus up to radius neighbours on each side as
+        (user_id, total_calories, rank), or None if the user is not ranked
+        """
+        with self._lock:
+            calories = self._calories.get(user_id)
+            if calories is None:
+                return None
+            position = self._keys.index((-calories, user_id))
+            start = max(position - radius, 0)
+            return [self._entry(key) for key in self._keys.islice(start, position + radius + 1)]
+
+    def _rank_of(self, calories):
+        return self._keys.bisect_left((-calories,)) + 1
+
+    def _entry(self, key):
+        negated_calories, user_id = key
+        return user_id, -negated_calories, self._rank_of(-negated_calories)
+
+
+rank_index = RankIndex()
+_load_lock = threading.Lock()
+
+
+def get_rank_index():
+    """
+    The shared index, (re)loaded from Mongo when missing or stale
+    """
+    max_age = getattr(settings, 'RANK_INDEX_MAX_AGE', 300)
+    if rank_index.loaded_at is None or time.monotonic() - rank_index.loaded_at > max_age:
+        with _load_lock:
+            if rank_index.loaded_at is None or time.monotonic() - rank_index.loaded_at > max_age:
+                rows = Leaderboard.objects.mongo_find({}, {'user_id': 1, 'total_calories': 1})
+                rank_index.load((row['user_id'], row['total_calories']) for row in rows)
+    return rank_index
+
+
+def record_calories(user_id, calories):
+    """
+    Write hook: mirror a leaderboard change into the index if it is loaded
+    """
+    if rank_index.loaded_at is not None:
+        rank_index.update(user_id, calories)
+
+
+def forget_user(user_id):
+    if rank_index.loaded_at is not None:
+        rank_index.remove(user_id)
@@ -0,0 +1,123 @@
+"""
+Fast JSON rendering and parsing
+
+FastJSONRenderer and FastJSONParser handle the vendor media type
+application/vnd.octofit+json with orjson when it is installed and fall
+back to DRF's stdlib-based JSON implementation otherwise. Clients opt in
+per request with `Accept: application/vnd.octofit+json` (or
+?format=fastjson); plain application/json keeps DRF's renderer.
+
+The output matches JSONRenderer's: UTC datetimes end in "Z", ObjectIds,
+Decimals and lazy strings are encoded the way DRF's encoder encodes them.
+
+NDJSONRenderer and CSVRenderer only take part in content negotiation for
+views that stream their own body (the activity export); they render error
+payloads.
+"""
+import codecs
+import csv
+import io
+from datetime import timedelta
+from decimal import Decimal
+from bson import ObjectId
+from django.conf import settings
+from django.utils.functional import Promise
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+FAST_JSON_MEDIA_TYPE = 'application/vnd.octofit+json'
+
+
+def default(value):
+    """
+    Encode the types orjson doesn't know natively
+    """
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Decimal):
+        # Serializers already coerce decimals to strings, as in DRF's encoder
+        return float(value)
+    if isinstance(value, Promise):
+        return str(value)
+    if isinstance(value, timedelta):
+        return str(value.total_seconds())
+    if isinstance(value, bytes):
+        return value.decode()
+    if hasattr(value, 'tolist'):
+        # numpy arrays and scalars
+        return value.tolist()
+    if hasattr(value, '__iter__'):
+        return list(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+class FastJSONRenderer(JSONRenderer):
+    media_type = FAST_JSON_MEDIA_TYPE
+    format = 'fastjson'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+        options = orjson.OPT_UTC_Z
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            options |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=default, option=options)
+
+
+class FastJSONParser(JSONParser):
+    media_type = FAST_JSON_MEDIA_TYPE
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or codecs.lookup(encoding).name != 'utf-8':
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as error:
+            raise ParseError(f'JSON parse error - {error}')
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Negotiates application/x-ndjson for streaming endpoints, which write
+    their own body; only error payloads are rendered here, as one line
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return JSONRenderer().render(data) + b'\n'
+
+
+class CSVRenderer(BaseRenderer):
+    """
+    Negotiates text/csv for streaming endpoints, which write their own
+    body; error payloads are rendered as field,error rows
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(['field', 'error'])
+        for field, errors in (data.items() if isinstance(data, dict) else [('non_field_errors', data)]):
+            for error in (errors if isinstance(errors, list) else [errors]):
+                writer.writerow([field, error])
+        return output.getvalue().encode(self.charset)
@@ -0,0 +1,184 @@
+"""
+Direct pymongo reads for the hot queries
+
+Every ORM call goes through djongo's SQL translation (sqlparse on the way
+in, row conversion on the way out), which for small indexed reads costs
+more CPU than the query itself. These functions query the collections
+through the models' DjongoManager instead and return slotted records
+carrying the model's attribute names, so the serializers read them like
+model instances. Records are read-only snapshots: they can't be saved.
+
+Datetimes are returned timezone-aware, as the ORM returns them.
+"""
+from datetime import timezone as dt_timezone
+from bson import ObjectId
+from django.db.models import DateTimeField
+from .fields import to_object_id
+from .models import User, Team, Activity, Leaderboard, TeamLeaderboard
+
+
+class Record:
+    __slots__ = ()
+    model = None
+    columns = ()
+    datetime_columns = frozenset()
+
+    @classmethod
+    def from_document(cls, document):
+        record = cls.__new__(cls)
+        for attname, column in cls.columns:
+            value = document.get(column)
+            if column in cls.datetime_columns and value is not None and value.tzinfo is None:
+                value = value.replace(tzinfo=dt_timezone.utc)
+            setattr(record, attname, value)
+        return record
+
+    def __repr__(self):
+        return f'<{type(self).__name__} {self._id}>'
+
+
+def record_type(model):
+    fields = model._meta.concrete_fields
+    return type(f'{model.__name__}Record', (Record,), {
+        '__slots__': tuple(field.attname for field in fields),
+        'model': model,
+        'columns': tuple((field.attname, field.column) for field in fields),
+        'datetime_columns': frozenset(field.column for field in fields if isinstance(field, DateTimeField)),
+    })
+
+
+UserRecord = record_type(User)
+TeamRecord = record_type(Team)
+ActivityRecord = record_type(Activity)
+LeaderboardRecord = record_type(Leaderboard)
+TeamLeaderboardRecord = record_type(TeamLeaderboard)
+
+
+def object_ids(values):
+    return list({object_id for object_id in map(to_object_id, values) if object_id is not None})
+
+
+def plain(value):
+    """
+    A document value as it appears in the API: references as hex strings
+    """
+    return str(value) if isinstance(value, ObjectId) else value
+
+
+def fetch_names(model, ids):
+    """
+    Resolve ObjectIds to names with a single $in query
+    """
+    ids = object_ids(ids)
+    if not ids:
+        return {}
+    return {
+        document['_id']: document['name']
+        for document in model.objects.mongo_find({'_id': {'$in': ids}}, {'name': 1})
+    }
+
+
+def fetch_documents(model, ids, fields):
+    """
+    Resolve ObjectIds to {'id': ..., field: ...} dicts with a single $in
+    query
+    """
+    ids = object_ids(ids)
+    if not ids:
+        return {}
+    return {
+        document['_id']: {'id': str(document['_id']), **{field: plain(document.get(field)) for field in fields}}
+        for document in model.objects.mongo_find({'_id': {'$in': ids}}, fields)
+    }
+
+
+ACTIVITY_SORT = [('date', -1), ('_id', -1)]
+LEADERBOARD_SORT = [('rank', 1), ('_id', 1)]
+
+
+def find_activities(user_id=None, date_gte=None, date_lt=None, query=None, sort=None, limit=0):
+    """
+    Activities newest first (or in sort order), optionally of one user and
+    within [date_gte, date_lt); query is ANDed in (e.g. a pagination condition)
+    """
+    match = dict(query or {})
+    if user_id is not None:
+        match['user_id'] = user_id
+    date_range = {}
+    if date_gte is not None:
+        date_range['$gte'] = date_gte
+    if date_lt is not None:
+        date_range['$lt'] = date_lt
+    if date_range:
+        match['date'] = date_range
+    cursor = Activity.objects.mongo_find(match, sort=sort or ACTIVITY_SORT, limit=limit)
+    return [ActivityRecord.from_document(document) for document in cursor]
+
+
+def find_leaderboard(query=None, sort=None, limit=0):
+    """
+    Leaderboard rows in rank order (or in sort order). Mongo sorts rows not
+    ranked yet before rank 1, so a full listing reads them separately (see
+    KeysetPagination.mongo_reads) to put them last
+    """
+    cursor = Leaderboard.objects.mongo_find(query or {}, sort=sort or LEADERBOARD_SORT, limit=limit)
+    return [LeaderboardRecord.from_document(document) for document in cursor]
+
+
+def leaderboard_top(n):
+    """
+    The n best ranked leaderboard rows, in rank order
+    """
+    return find_leaderboard({'rank': {'$type': 'number'}}, limit=n)
+
+
+def team_leaderboard():
+    """
+    Every team's totals in rank order
+    """
+    cursor = TeamLeaderboard.objects.mongo_find({}, sort=[('rank', 1), ('_id', 1)])
+    return [TeamLeaderboardRecord.from_document(document) for document in cursor]
+
+
+def leaderboard_entries(user_ids):
+    """
+    Leaderboard rows of the given users, keyed by user id
+    """
+    cursor = Leaderboard.objects.mongo_find({'user_id': {'$in': list(user_ids)}})
+    return {document['user_id']: LeaderboardRecord.from_document(document) for document in cursor}
+
+
+def get_user(user_id):
+    user_id = to_object_id(user_id)
+    if user_id is None:
+        return None
+    document = User.objects.mongo_find_one({'_id': user_id}, {'password': 0})
+    return UserRecord.from_document(document) if document else None
+
+
+def get_team(team_id):
+    team_id = to_object_id(team_id)
+    if team_id is None:
+        return None
+    document = Team.objects.mongo_find_one({'_id': team_id})
+    return TeamRecord.from_document(document) if document else None
+
+
+def team_members(team_id, query=None, sort=None, limit=0):
+    """
+    Users of a team without their password hashes; query is ANDed in
+    """
+    cursor = User.objects.mongo_find(
+        {**(query or {}), 'team_id': team_id},
+        {'password': 0},
+        sort=sort,
+        limit=limit
+    )
+    return [UserRecord.from_document(document) for document in cursor]
+
+
+def team_member_ids(team_id):
+    return [
+        user['_id']
+        for user in User.objects.mongo_find({'team_id': team_id}, {'_id': 1})
+    ]
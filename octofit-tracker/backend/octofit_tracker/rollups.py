@@ -0,0 +1,141 @@
+"""
+Daily activity rollups
+
+activity_daily holds one small document per user per UTC day with the
+totals of that day's activities. Activity writes fold into it with upserted
+$inc updates, so a user's timeline reads at most one document per day
+(366 for a year) instead of every activity. Weekly buckets are summed from
+the daily documents at read time.
+"""
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+from pymongo import UpdateOne
+from .cache import invalidate_all
+from .indexes import collection_for, declared_indexes
+from .models import Activity, ActivityDaily
+
+
+BUCKETS = ('day', 'week')
+TOTALS = ('activities', 'duration', 'calories', 'distance')
+REBUILD_BATCH_SIZE = 5000
+
+
+def day_of(moment):
+    """
+    Midnight UTC of the day moment falls on, as the naive datetime Mongo stores
+    """
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(dt_timezone.utc)
+    return datetime(moment.year, moment.month, moment.day)
+
+
+def apply_daily_rollups(contributions):
+    """
+    Fold activity contributions into the per-user daily documents
+    """
+    deltas = defaultdict(lambda: [0, 0, 0, 0.0])
+    for item in contributions:
+        delta = deltas[item.user_id, day_of(item.date)]
+        delta[0] += item.count
+        delta[1] += item.duration
+        delta[2] += item.calories
+        delta[3] += item.distance
+
+    updates = [
+        UpdateOne(
+            {'user_id': user_id, 'day': day},
+            {'$inc': dict(zip(TOTALS, delta))},
+            upsert=True
+        )
+        for (user_id, day), delta in deltas.items()
+        if any(delta)
+    ]
+    if not updates:
+        return
+    ActivityDaily.objects.mongo_bulk_write(updates, ordered=False)
+    emptied = [(user_id, day) for (user_id, day), delta in deltas.items() if delta[0] < 0]
+    if emptied:
+        ActivityDaily.objects.mongo_delete_many({
+            '$or': [{'user_id': user_id, 'day': day} for user_id, day in emptied],
+            'activities': {'$lte': 0},
+        })
+
+
+def rebuild_daily_rollups(batch_size=REBUILD_BATCH_SIZE):
+    """
+    Recompute activity_daily from the activities collection and drop the
+    cached responses built from it; returns the number of daily documents
+    written
+
+    The documents are written to a staging collection that then replaces
+    activity_daily in one rename, so timelines read the old rollups until
+    the new ones are complete
+    """
+    pipeline = [
+        {'$group': {
+            '_id': {
+                'user_id': '$user_id',
+                # Grouped as a string and parsed here: $dateToString is also
+                # understood by the in-memory stand-in, $dateFromParts is not
+                'day': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$date'}},
+            },
+            'activities': {'$sum': 1},
+            'duration': {'$sum': '$duration'},
+            'calories': {'$sum': '$calories'},
+            'distance': {'$sum': {'$ifNull': ['$distance', 0]}},
+        }},
+    ]
+    target = collection_for(ActivityDaily)
+    staging = target.database[f'{target.name}_rebuild']
+    staging.drop()
+    staging.create_indexes(declared_indexes(ActivityDaily))
+    written = 0
+    batch = []
+    for group in Activity.objects.mongo_aggregate(pipeline, allowDiskUse=True):
+        key = group.pop('_id')
+        batch.append({'user_id': key['user_id'], 'day': datetime.strptime(key['day'], '%Y-%m-%d'), **group})
+        if len(batch) >= batch_size:
+            staging.insert_many(batch, ordered=False)
+            written += len(batch)
+            batch = []
+    if batch:
+        staging.insert_many(batch, ordered=False)
+        written += len(batch)
+    staging.rename(target.name, dropTarget=True)
+    # Timelines are cached per user and any of them may have changed
+    invalidate_all()
+    return written
+
+
+def bucket_key(day, bucket):
+    if bucket == 'week':
+        year, week, _ = day.isocalendar()
+        return f'{year}-W{week:02d}'
+    return day.strftime('%Y-%m-%d')
+
+
+def user_timeline(user_id, bucket='day', since=None, until=None):
+    """
+    The user's totals per day or ISO week, oldest first, as {key, activities,
+    duration, calories, distance} dicts; days overlapping [since, until) are
+    included and days without activities are omitted
+    """
+    query = {'user_id': user_id}
+    day_range = {}
+    if since is not None:
+        day_range['$gte'] = day_of(since)
+    if until is not None:
+        day_range['$lt'] = until
+    if day_range:
+        query['day'] = day_range
+
+    results = []
+    for document in ActivityDaily.objects.mongo_find(query, sort=[('day', 1)]):
+        key = bucket_key(document['day'], bucket)
+        if not results or results[-1]['key'] != key:
+            results.append({'key': key, **dict.fromkeys(TOTALS, 0)})
+        for total in TOTALS:
+            results[-1][total] += document[total]
+    for row in results:
+        row['distance'] = round(row['distance'], 2)
+    return results
@@ -1,112 +1,267 @@
+from django.db import models
 from rest_framework import serializers
-from bson import ObjectId
-from .models import User, Team, Activity, Leaderboard, Workout
+from .fields import to_object_id
+from .metrics import timed_serialization
+from .models import User, Team, Activity, Leaderboard, TeamLeaderboard, Workout
+from .repository import fetch_documents, fetch_names
 
 
-class UserSerializer(serializers.ModelSerializer):
+def split_param(value):
+    return [name.strip() for name in value.split(',') if name.strip()] if value else []
+
+
+class ObjectIdField(serializers.Field):
+    """
+    A reference stored as an ObjectId, read and written as its hex string
+    """
+    default_error_messages = {
+        'invalid': 'Must be a valid ObjectId.',
+    }
+    
+    def to_internal_value(self, data):
+        if data == '' and self.allow_null:
+            return None
+        object_id = to_object_id(data)
+        if object_id is None:
+            self.fail('invalid')
+        return object_id
+    
+    def to_representation(self, value):
+        return str(value)
+
+
+class ExpandedField(serializers.Field):
+    """
+    A related object added with ?expand=, read from the lookup map primed
+    by NameLookupListSerializer
+    """
+    
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+    
+    def to_representation(self, value):
+        return self.parent.lookup_document(self.field_name, value)
+
+
+class TimedRepresentationMixin:
+    """
+    Count to_representation() towards the request's serialization time
+    """
+    
+    def to_representation(self, instance):
+        with timed_serialization():
+            return super().to_representation(instance)
+
+
+class SparseFieldsMixin:
+    """
+    On GET, ?fields=a,b limits the output to the named fields, so method
+    fields and lookups that weren't requested never run, and ?expand=x adds
+    the related objects listed in expandable_fields
+    """
+    # field name -> (attribute holding the id, related model, fields to include)
+    expandable_fields = {}
+    
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None or request.method != 'GET':
+            return fields
+        expand = [name for name in split_param(request.query_params.get('expand')) if name in self.expandable_fields]
+        for name in expand:
+            attr, _, _ = self.expandable_fields[name]
+            fields[name] = ExpandedField(source=attr)
+        requested = split_param(request.query_params.get('fields'))
+        if requested:
+            fields = {name: field for name, field in fields.items() if name in requested or name in expand}
+        return fields
+
+
+class NameLookupListSerializer(serializers.ListSerializer):
+    """
+    List serializer that gathers every user/team id referenced by the page
+    and resolves them up front, one query per collection, so the per-row
+    name and expanded fields read from a shared lookup map instead of querying
+    """
+    
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        items = list(iterable)
+        for context_key, attr, model, projection in self.child.pending_lookups():
+            self.context[context_key] = resolve_lookup(model, {getattr(item, attr) for item in items}, projection)
+        return [self.child.to_representation(item) for item in items]
+
+
+def resolve_lookup(model, ids, projection=None):
+    if projection is None:
+        return fetch_names(model, ids)
+    return fetch_documents(model, ids, projection)
+
+
+class NameLookupMixin:
+    """
+    Per-row name and expansion resolution that uses the lookup maps primed
+    by NameLookupListSerializer, falling back to a single query when the
+    serializer is used for one object
+    """
+    # context key -> (attribute holding the id, model to resolve it against, output field)
+    name_lookups = {}
+    
+    def pending_lookups(self):
+        """
+        (context key, id attribute, model, projection) for every lookup the
+        output fields need; projection is None for name lookups
+        """
+        fields = self.fields
+        lookups = [
+            (context_key, attr, model, None)
+            for context_key, (attr, model, field_name) in self.name_lookups.items()
+            if field_name in fields
+        ]
+        lookups += [
+            (f'expanded_{name}', attr, model, projection)
+            for name, (attr, model, projection) in self.expandable_fields.items()
+            if name in fields
+        ]
+        return lookups
+    
+    def lookup_name(self, context_key, value):
+        names = self.context.get(context_key)
+        if names is None:
+            _, model, _ = self.name_lookups[context_key]
+            names = fetch_names(model, [value])
+        return names.get(value)
+    
+    def lookup_document(self, name, value):
+        documents = self.context.get(f'expanded_{name}')
+        if documents is None:
+            _, model, projection = self.expandable_fields[name]
+            documents = fetch_documents(model, [value], projection)
+        return documents.get(value)
+
+
+class UserSerializer(TimedRepresentationMixin, SparseFieldsMixin, NameLookupMixin, serializers.ModelSerializer):
     id = serializers.SerializerMethodField()
     username = serializers.CharField(source='name', read_only=True)
+    team_id = ObjectIdField(allow_null=True, required=False)
     team_name = serializers.SerializerMethodField()
-    fitness_level = serializers.SerializerMethodField()
+    
+    name_lookups = {'team_names': ('team_id', Team, 'team_name')}
+    expandable_fields = {'team': ('team_id', Team, ['name', 'description', 'member_count'])}
     
     class Meta:
         model = User
         fields = ['id', 'name', 'username', 'email', 'password', 'team_id', 'team_name', 'fitness_level', 'created_at']
+        read_only_fields = ['fitness_level']
         extra_kwargs = {'password': {'write_only': True}}
+        list_serializer_class = NameLookupListSerializer
     
     def get_id(self, obj):
         return str(obj._id)
     
     def get_team_name(self, obj):
-        if obj.team_id:
-            try:
-                team = Team.objects.get(_id=ObjectId(obj.team_id))
-                return team.name
-            except (Team.DoesNotExist, Exception):
-                return None
+        if obj.team_id is not None:
+            return self.lookup_name('team_names', obj.team_id)
         return None
-    
-    def get_fitness_level(self, obj):
-        # Calculate fitness level based on activity data
-        try:
-            leaderboard = Leaderboard.objects.get(user_id=str(obj._id))
-            if leaderboard.total_calories >= 7000:
-                return 'Advanced'
-            elif leaderboard.total_calories >= 5000:
-                return 'Intermediate'
-            else:
-                return 'Beginner'
-        except Leaderboard.DoesNotExist:
-            return 'Beginner'
-
-
-class TeamSerializer(serializers.ModelSerializer):
+
+
+class TeamSerializer(TimedRepresentationMixin, SparseFieldsMixin, serializers.ModelSerializer):
     id = serializers.SerializerMethodField()
-    member_count = serializers.SerializerMethodField()
     
     class Meta:
         model = Team
         fields = ['id', 'name', 'description', 'member_count', 'created_at']
+        read_only_fields = ['member_count']
     
     def get_id(self, obj):
         return str(obj._id)
-    
-    def get_member_count(self, obj):
-        return User.objects.filter(team_id=str(obj._id)).count()
 
 
-class ActivitySerializer(serializers.ModelSerializer):
+class ActivitySerializer(TimedRepresentationMixin, SparseFieldsMixin, NameLookupMixin, serializers.ModelSerializer):
     id = serializers.SerializerMethodField()
+    user_id = ObjectIdField()
     user_name = serializers.SerializerMethodField()
     duration_minutes = serializers.IntegerField(source='duration', read_only=True)
     calories_burned = serializers.IntegerField(source='calories', read_only=True)
     
+    name_lookups = {'user_names': ('user_id', User, 'user_name')}
+    expandable_fields = {'user': ('user_id', User, ['name', 'team_id', 'fitness_level'])}
+    
     class Meta:
         model = Activity
         fields = ['id', 'user_id', 'user_name', 'activity_type', 'duration', 'duration_minutes', 
                   'distance', 'calories', 'calories_burned', 'date', 'notes']
+        list_serializer_class = NameLookupListSerializer
     
     def get_id(self, obj):
         return str(obj._id)
     
     def get_user_name(self, obj):
-        try:
-            user = User.objects.get(_id=ObjectId(obj.user_id))
-            return user.name
-        except (User.DoesNotExist, Exception):
-            return 'Unknown User'
+        return self.lookup_name('user_names', obj.user_id) or 'Unknown User'
 
 
-class LeaderboardSerializer(serializers.ModelSerializer):
+class LeaderboardSerializer(TimedRepresentationMixin, SparseFieldsMixin, NameLookupMixin, serializers.ModelSerializer):
     id = serializers.SerializerMethodField()
+    user_id = ObjectIdField()
     user_name = serializers.SerializerMethodField()
+    team_id = ObjectIdField(allow_null=True, required=False)
     team_name = serializers.SerializerMethodField()
     total_points = serializers.IntegerField(source='total_calories', read_only=True)
     
+    name_lookups = {
+        'user_names': ('user_id', User, 'user_name'),
+        'team_names': ('team_id', Team, 'team_name'),
+    }
+    expandable_fields = {
+        'user': ('user_id', User, ['name', 'team_id', 'fitness_level']),
+        'team': ('team_id', Team, ['name', 'member_count']),
+    }
+    
     class Meta:
         model = Leaderboard
         fields = ['id', 'user_id', 'user_name', 'team_id', 'team_name', 'total_activities', 
                   'total_calories', 'total_points', 'total_distance', 'rank']
+        list_serializer_class = NameLookupListSerializer
     
     def get_id(self, obj):
         return str(obj._id)
     
     def get_user_name(self, obj):
-        try:
-            user = User.objects.get(_id=ObjectId(obj.user_id))
-            return user.name
-        except (User.DoesNotExist, Exception):
-            return 'Unknown User'
+        return self.lookup_name('user_names', obj.user_id) or 'Unknown User'
     
     def get_team_name(self, obj):
-        try:
-            team = Team.objects.get(_id=ObjectId(obj.team_id))
-            return team.name
-        except (Team.DoesNotExist, Exception):
-            return None
+        return self.lookup_name('team_names', obj.team_id)
+    
+    def validate_user_id(self, value):
+        # DRF builds no validator from the leaderboard_user_uniq constraint,
+        # and UniqueValidator's exists() query is beyond djongo
+        query = {'user_id': value}
+        if self.instance is not None:
+            query['_id'] = {'$ne': self.instance._id}
+        if Leaderboard.objects.mongo_count_documents(query, limit=1):
+            raise serializers.ValidationError('This user already has a leaderboard entry.')
+        return value
+
+
+class TeamLeaderboardSerializer(TimedRepresentationMixin, SparseFieldsMixin, NameLookupMixin, serializers.ModelSerializer):
+    id = serializers.SerializerMethodField()
+    team_id = ObjectIdField()
+    total_points = serializers.IntegerField(source='total_calories', read_only=True)
+    
+    expandable_fields = {'team': ('team_id', Team, ['name', 'description', 'member_count'])}
+    
+    class Meta:
+        model = TeamLeaderboard
+        fields = ['id', 'team_id', 'team_name', 'total_activities', 'total_calories',
+                  'total_points', 'total_distance', 'rank']
+        list_serializer_class = NameLookupListSerializer
+    
+    def get_id(self, obj):
+        return str(obj._id)
 
 
-class WorkoutSerializer(serializers.ModelSerializer):
+class WorkoutSerializer(TimedRepresentationMixin, SparseFieldsMixin, serializers.ModelSerializer):
     id = serializers.SerializerMethodField()
     difficulty_level = serializers.CharField(source='difficulty', read_only=True)
     duration_minutes = serializers.IntegerField(source='duration', read_only=True)
@@ -56,6 +56,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'octofit_tracker.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -102,6 +103,31 @@ DATABASES = {
     }
 }
 
+# Connection pool size of the pymongo client used by the async views
+ASYNC_MONGO_MAX_POOL_SIZE = 100
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# Local memory by default; point CACHE_BACKEND/CACHE_LOCATION at a shared
+# backend (e.g. django.core.cache.backends.redis.RedisCache) in production
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'octofit'),
+    }
+}
+
+# Seconds a cached API response may be served before it is rebuilt
+RESPONSE_CACHE_TIMEOUT = 300
+
+# Mongo commands slower than this are logged to octofit_tracker.slow_queries;
+# None turns the log off
+SLOW_QUERY_THRESHOLD_MS = os.environ.get('SLOW_QUERY_THRESHOLD_MS')
+if SLOW_QUERY_THRESHOLD_MS is not None:
+    SLOW_QUERY_THRESHOLD_MS = float(SLOW_QUERY_THRESHOLD_MS)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -144,6 +170,60 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Django REST Framework
+REST_FRAMEWORK = {
+    'DEFAULT_PAGINATION_CLASS': 'octofit_tracker.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
+    # application/vnd.octofit+json selects the orjson-backed pair
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+        'octofit_tracker.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'octofit_tracker.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+# Upper bound for the ?page_size= query parameter
+PAGINATION_MAX_PAGE_SIZE = 500
+
+# Widest date range the activity list accepts for filters without an index
+# (activity_type, calories, distance) when no user or team is given
+ACTIVITY_SCAN_MAX_DAYS = 92
+
+# Seconds before the in-process leaderboard rank index is reloaded from Mongo
+RANK_INDEX_MAX_AGE = 300
+
+# Answer the activity stats from an in-memory columnar copy of the
+# activities instead of Mongo (needs NumPy; see analytics.py). The copy
+# picks up new activities every ANALYTICS_REFRESH_INTERVAL seconds and is
+# reloaded in full, in the background, after ANALYTICS_MAX_AGE seconds
+ANALYTICS_STORE = os.environ.get('ANALYTICS_STORE', '') == '1'
+ANALYTICS_REFRESH_INTERVAL = 1.0
+ANALYTICS_MAX_AGE = 300
+
+# Background job workers started in each web process (see tasks.py); 0
+# leaves the jobs to `python manage.py run_jobs`
+TASK_WORKERS = int(os.environ.get('TASK_WORKERS', 1))
+# Seconds an idle worker waits before looking for due jobs again
+TASK_POLL_INTERVAL = 1.0
+# Seconds a worker may hold a job before another may take it over
+TASK_LEASE_SECONDS = 600
+# Seconds finished jobs are kept for list_jobs before they are deleted
+TASK_RETENTION_SECONDS = 7 * 86400
+
+# Fitness levels as (minimum total calories, level); after changing them run
+# `python manage.py recompute_fitness_levels`
+FITNESS_TIERS = [
+    (7000, 'Advanced'),
+    (5000, 'Intermediate'),
+    (0, 'Beginner'),
+]
+
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
@@ -0,0 +1,141 @@
+"""
+Signal handlers that keep denormalized data in sync with model writes
+"""
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from .analytics import activity_document, activity_store
+from .cache import activity_namespaces, invalidate
+from .fitness import update_fitness_level
+from .leaderboard import apply_contributions, contribution, move_user_team
+from .models import User, Team, Activity, Leaderboard, TeamLeaderboard, Workout
+from .ranking import forget_user, record_calories
+from .tasks import enqueue
+
+
+# Activity fields the derived aggregates are computed from
+ACTIVITY_TRACKED_FIELDS = {'user_id', 'date', 'duration', 'calories', 'distance'}
+
+
+def adjust_member_count(team_id, delta):
+    """
+    Atomically add delta to a team's materialized member_count
+    """
+    if team_id is not None:
+        Team.objects.mongo_update_one(
+            {'_id': team_id},
+            {'$inc': {'member_count': delta}}
+        )
+        invalidate('teams')
+
+
+@receiver(post_init, sender=User)
+def remember_user_team(sender, instance, **kwargs):
+    # Snapshot the team as loaded so saves can tell whether it changed
+    instance._loaded_team_id = instance.team_id
+
+
+@receiver(post_save, sender=User)
+def update_member_count_on_save(sender, instance, created, **kwargs):
+    previous = None if created else instance._loaded_team_id
+    if previous != instance.team_id:
+        adjust_member_count(previous, -1)
+        adjust_member_count(instance.team_id, 1)
+        if not created:
+            move_user_team(instance._id, previous, instance.team_id)
+    instance._loaded_team_id = instance.team_id
+
+
+@receiver(post_delete, sender=User)
+def update_member_count_on_delete(sender, instance, **kwargs):
+    adjust_member_count(instance._loaded_team_id, -1)
+
+
+@receiver(post_init, sender=Activity)
+def remember_activity_contribution(sender, instance, **kwargs):
+    # Deferred fields would be fetched here (and recurse), so skip the
+    # snapshot for partially loaded rows
+    if instance.get_deferred_fields() & ACTIVITY_TRACKED_FIELDS:
+        instance._loaded_contribution = None
+    else:
+        instance._loaded_contribution = contribution(instance)
+
+
+@receiver(post_save, sender=Activity)
+def update_leaderboard_on_save(sender, instance, created, **kwargs):
+    changes = [contribution(instance)]
+    if not created and instance._loaded_contribution is not None:
+        changes.append(instance._loaded_contribution.negated())
+    apply_contributions(changes)
+    invalidate_activity_pages(changes)
+    instance._loaded_contribution = contribution(instance)
+    if created:
+        activity_store.mark_inserted()
+    else:
+        activity_store.saved(activity_document(instance))
+
+
+@receiver(post_delete, sender=Activity)
+def update_leaderboard_on_delete(sender, instance, **kwargs):
+    loaded = instance._loaded_contribution or contribution(instance)
+    apply_contributions([loaded.negated()])
+    invalidate_activity_pages([loaded])
+    activity_store.deleted(instance._id)
+
+
+def invalidate_activity_pages(changes):
+    namespaces = set(activity_namespaces())
+    for change in changes:
+        namespaces.update(activity_namespaces(change.user_id))
+    invalidate(*namespaces)
+
+
+@receiver(post_save, sender=Leaderboard)
+def update_rank_index_on_save(sender, instance, **kwargs):
+    # Rows edited through the API rather than the leaderboard engine
+    record_calories(instance.user_id, instance.total_calories)
+    update_fitness_level(instance.user_id, None, instance.total_calories)
+    enqueue('assign_ranks')
+    enqueue('rebuild_team_leaderboard')
+
+
+@receiver(post_delete, sender=Leaderboard)
+def update_rank_index_on_delete(sender, instance, **kwargs):
+    forget_user(instance.user_id)
+    update_fitness_level(instance.user_id, None, 0)
+    enqueue('assign_ranks')
+    enqueue('rebuild_team_leaderboard')
+
+
+@receiver(post_save, sender=Team)
+def rename_team_leaderboard_row(sender, instance, created, **kwargs):
+    if not created:
+        TeamLeaderboard.objects.mongo_update_one(
+            {'team_id': instance._id},
+            {'$set': {'team_name': instance.name}}
+        )
+
+
+@receiver(post_delete, sender=Team)
+def drop_team_leaderboard_row(sender, instance, **kwargs):
+    if TeamLeaderboard.objects.mongo_delete_one({'team_id': instance._id}).deleted_count:
+        enqueue('assign_team_ranks')
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_user_responses(sender, **kwargs):
+    invalidate('users')
+
+
+@receiver([post_save, post_delete], sender=Team)
+def invalidate_team_responses(sender, **kwargs):
+    invalidate('teams')
+
+
+@receiver([post_save, post_delete], sender=Leaderboard)
+def invalidate_leaderboard_responses(sender, **kwargs):
+    invalidate('leaderboard')
+
+
+@receiver([post_save, post_delete], sender=Workout)
+def invalidate_workout_responses(sender, **kwargs):
+    invalidate('workouts')
@@ -0,0 +1,90 @@
+"""
+Activity totals computed server-side with the Mongo aggregation pipeline,
+or by the in-memory analytics store when it is enabled (see analytics.py)
+"""
+from collections import defaultdict
+from .analytics import analytics_groups
+from .models import User, Team, Activity
+from .repository import fetch_names, plain
+
+
+GROUP_KEYS = {
+    'activity_type': '$activity_type',
+    'day': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$date'}},
+    'week': {'$dateToString': {'format': '%G-W%V', 'date': '$date'}},
+    'user': '$user_id',
+    # Grouped per user in Mongo, then folded into teams
+    'team': '$user_id',
+}
+
+TOTALS = ('activities', 'calories', 'duration', 'distance')
+
+
+def activity_stats(group_by, match, top=None):
+    """
+    Totals of calories, duration and distance per group for the activities
+    matching the filter, as a list of dicts sorted by key; with top, only
+    the top groups by calories, highest first
+    """
+    groups = analytics_groups(group_by, match, top)
+    if groups is None:
+        groups = aggregate_groups(group_by, match, None if group_by == 'team' else top)
+
+    if group_by == 'team':
+        groups = fold_into_teams(groups)
+    if top is not None:
+        groups = sorted(groups, key=lambda group: -group['calories'])[:top]
+
+    results = [
+        {
+            'key': group['_id'],
+            **{total: group[total] for total in TOTALS},
+        }
+        for group in groups
+    ]
+    if group_by in ('user', 'team'):
+        names = fetch_names(User if group_by == 'user' else Team, [row['key'] for row in results])
+        for row in results:
+            row['name'] = names.get(row['key'])
+    for row in results:
+        row['key'] = plain(row['key'])
+        row['distance'] = round(row['distance'], 2)
+    return results
+
+
+def aggregate_groups(group_by, match, top=None):
+    pipeline = [
+        {'$match': match},
+        {'$group': {
+            '_id': GROUP_KEYS[group_by],
+            'activities': {'$sum': 1},
+            'calories': {'$sum': '$calories'},
+            'duration': {'$sum': '$duration'},
+            'distance': {'$sum': {'$ifNull': ['$distance', 0]}},
+        }},
+    ]
+    if top is None:
+        pipeline.append({'$sort': {'_id': 1}})
+    else:
+        pipeline += [{'$sort': {'calories': -1, '_id': 1}}, {'$limit': top}]
+    return list(Activity.objects.mongo_aggregate(pipeline, allowDiskUse=True))
+
+
+def fold_into_teams(user_groups):
+    """
+    Sum per-user groups into per-team groups using each user's team_id
+    """
+    user_ids = [group['_id'] for group in user_groups]
+    teams = {
+        user['_id']: user.get('team_id')
+        for user in User.objects.mongo_find({'_id': {'$in': user_ids}}, {'team_id': 1})
+    }
+    folded = defaultdict(lambda: dict.fromkeys(TOTALS, 0))
+    for group in user_groups:
+        team = folded[teams.get(group['_id'])]
+        for total in TOTALS:
+            team[total] += group[total]
+    return [
+        {'_id': team_id, **totals}
+        for team_id, totals in sorted(folded.items(), key=lambda item: str(item[0] or ''))
+    ]
@@ -0,0 +1,271 @@
+"""
+Background jobs
+
+Work a response doesn't have to wait for (re-ranking the leaderboard,
+rebuilding team totals or the daily rollups) is enqueued as a document in
+the jobs collection and run by worker threads.
+
+Enqueueing a job that is already pending updates that document instead of
+adding another (a unique partial index on the name of pending jobs keeps
+concurrent enqueues from adding two), so a burst of bulk ingests costs
+one re-rank rather than one per chunk, and the enqueue itself is a single
+upsert. Each enqueue also pushes the run back by the job's debounce
+delay, so the job runs once the burst is over, but never later than
+max_delay after it was first enqueued. A retry waiting out its backoff
+is not brought forward.
+
+A job that raises is retried with exponential backoff until it has used
+max_attempts, then left failed for inspection with the list_jobs command.
+Workers hold a lease on the job they run; a job whose worker died is
+picked up again once the lease expires. Jobs recompute derived data from
+scratch, so one that runs twice does no harm.
+
+Finished jobs are kept for TASK_RETENTION_SECONDS, then deleted by the
+workers and run_due_jobs.
+
+Workers run in the web process, started from wsgi.py/asgi.py when
+TASK_WORKERS is above 0, or standalone with the run_jobs command.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from collections import namedtuple
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from .models import Job
+
+
+logger = logging.getLogger('octofit_tracker.tasks')
+
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+STATUSES = (PENDING, RUNNING, DONE, FAILED)
+
+# debounce and max_delay in seconds
+JobSpec = namedtuple('JobSpec', ['function', 'debounce', 'max_delay', 'max_attempts'])
+
+JOBS = {
+    'assign_ranks': JobSpec('octofit_tracker.leaderboard.assign_ranks', 1, 10, 5),
+    'assign_team_ranks': JobSpec('octofit_tracker.leaderboard.assign_team_ranks', 1, 10, 5),
+    'rebuild_team_leaderboard': JobSpec('octofit_tracker.leaderboard.rebuild_team_leaderboard', 2, 30, 5),
+    'rebuild_leaderboard': JobSpec('octofit_tracker.leaderboard.rebuild_leaderboard', 0, 0, 3),
+    'rebuild_rollups': JobSpec('octofit_tracker.rollups.rebuild_daily_rollups', 0, 0, 3),
+    'recompute_fitness_levels': JobSpec('octofit_tracker.fitness.recompute_fitness_levels', 0, 0, 3),
+}
+
+RETRY_DELAY = 5
+DEFAULT_LEASE = 600
+DEFAULT_RETENTION = 7 * 86400
+PURGE_INTERVAL = 300
+
+
+def enqueue(name, delay=None):
+    """
+    Schedule the named job, merging into the pending one if there is one;
+    delay overrides the job's debounce
+    """
+    spec = JOBS[name]
+    now = timezone.now()
+    delay = spec.debounce if delay is None else delay
+    update = {
+        '$max': {'run_after': now + timedelta(seconds=delay)},
+        '$inc': {'requests': 1},
+        '$setOnInsert': {
+            'attempts': 0,
+            'deadline': now + timedelta(seconds=max(spec.max_delay, delay)),
+            'created_at': now,
+        },
+    }
+    try:
+        Job.objects.mongo_update_one({'name': name, 'status': PENDING}, update, upsert=True)
+    except DuplicateKeyError:
+        # A concurrent enqueue inserted the pending job first; merge into it
+        Job.objects.mongo_update_one({'name': name, 'status': PENDING}, update)
+
+
+def due(now, force=False):
+    """
+    The filter for jobs a worker may claim: pending ones past their delay
+    or deadline and running ones whose lease expired. force also takes
+    pending jobs still within their debounce delay, though not retries
+    waiting out their backoff.
+    """
+    clauses = [
+        {'status': PENDING, 'run_after': {'$lte': now}},
+        {'status': PENDING, 'deadline': {'$lte': now}},
+        {'status': RUNNING, 'lease_until': {'$lt': now}},
+    ]
+    if force:
+        clauses.append({'status': PENDING, 'attempts': 0})
+    return {'$or': clauses}
+
+
+def claim(worker, force=False):
+    """
+    Atomically take the next due job, or return None. A job whose name is
+    already running elsewhere is left for later so the two don't race.
+    """
+    now = timezone.now()
+    lease = timedelta(seconds=getattr(settings, 'TASK_LEASE_SECONDS', DEFAULT_LEASE))
+    for candidate in Job.objects.mongo_find(due(now, force), {'name': 1, 'status': 1}, sort=[('run_after', 1)]):
+        if Job.objects.mongo_count_documents({
+            'name': candidate['name'], 'status': RUNNING, 'lease_until': {'$gte': now}, '_id': {'$ne': candidate['_id']},
+        }):
+            continue
+        job = Job.objects.mongo_find_one_and_update(
+            {'_id': candidate['_id'], 'status': candidate['status']},
+            {
+                '$set': {'status': RUNNING, 'worker': worker, 'started_at': now, 'lease_until': now + lease},
+                '$inc': {'attempts': 1},
+            },
+            return_document=ReturnDocument.AFTER
+        )
+        if job is not None:
+            return job
+    return None
+
+
+def execute(job):
+    """
+    Run a claimed job and record how it went
+    """
+    spec = JOBS.get(job['name'])
+    try:
+        if spec is None:
+            raise LookupError(f'Unknown job {job["name"]}')
+        result = import_string(spec.function)()
+    except Exception as error:
+        logger.exception('Job %s failed (attempt %d)', job['name'], job['attempts'])
+        retry(job, spec, error)
+    else:
+        Job.objects.mongo_update_one({'_id': job['_id']}, {'$set': {
+            'status': DONE,
+            'result': None if result is None else str(result),
+            'finished_at': timezone.now(),
+            'lease_until': None,
+        }})
+    finally:
+        close_old_connections()
+
+
+def retry(job, spec, error):
+    now = timezone.now()
+    update = {'last_error': f'{type(error).__name__}: {error}', 'lease_until': None}
+    if spec is not None and job['attempts'] < spec.max_attempts:
+        backoff = now + timedelta(seconds=RETRY_DELAY * 2 ** (job['attempts'] - 1))
+        update.update(status=PENDING, run_after=backoff, deadline=backoff)
+    else:
+        update.update(status=FAILED, finished_at=now)
+    # A newer enqueue may have created a pending job of the same name
+    # meanwhile; that one covers the retry
+    if update['status'] == PENDING and Job.objects.mongo_count_documents({'name': job['name'], 'status': PENDING}):
+        update.update(status=FAILED, finished_at=now)
+    try:
+        Job.objects.mongo_update_one({'_id': job['_id']}, {'$set': update})
+    except DuplicateKeyError:
+        # ...or did so since the count
+        update.update(status=FAILED, finished_at=now)
+        Job.objects.mongo_update_one({'_id': job['_id']}, {'$set': update})
+
+
+def purge_finished(now=None):
+    """
+    Delete the jobs that finished more than TASK_RETENTION_SECONDS ago;
+    returns how many were deleted
+    """
+    now = now or timezone.now()
+    retention = timedelta(seconds=getattr(settings, 'TASK_RETENTION_SECONDS', DEFAULT_RETENTION))
+    return Job.objects.mongo_delete_many({
+        'status': {'$in': [DONE, FAILED]},
+        'finished_at': {'$lt': now - retention},
+    }).deleted_count
+
+
+def run_next(worker, force=False):
+    """
+    Claim and run one job; returns False when none was due
+    """
+    job = claim(worker, force)
+    if job is None:
+        return False
+    execute(job)
+    return True
+
+
+def run_due_jobs(force=False):
+    """
+    Run jobs in this thread until none is due; force runs pending jobs
+    without waiting for their delay. Returns the number of jobs run.
+    """
+    worker = worker_name(threading.current_thread().name)
+    purge_finished()
+    count = 0
+    while run_next(worker, force):
+        count += 1
+    return count
+
+
+def worker_name(thread_name):
+    return f'{socket.gethostname()}:{os.getpid()}:{thread_name}'
+
+
+class Worker(threading.Thread):
+    def __init__(self, number, poll_interval):
+        super().__init__(name=f'octofit-jobs-{number}', daemon=True)
+        self.poll_interval = poll_interval
+        self.stopped = threading.Event()
+        self.purged_at = None
+
+    def run(self):
+        worker = worker_name(self.name)
+        while not self.stopped.is_set():
+            try:
+                if self.purged_at is None or time.monotonic() - self.purged_at > PURGE_INTERVAL:
+                    purge_finished()
+                    self.purged_at = time.monotonic()
+                ran = run_next(worker)
+            except Exception:
+                # Mongo unreachable or similar; keep polling
+                logger.exception('Job worker %s could not claim a job', worker)
+                ran = False
+            if not ran:
+                self.stopped.wait(self.poll_interval)
+
+    def stop(self):
+        self.stopped.set()
+
+
+_lock = threading.Lock()
+_workers = []
+
+
+def start_workers(count=None):
+    """
+    Start count worker threads (TASK_WORKERS by default) in this process,
+    unless they are already running; returns the workers
+    """
+    if count is None:
+        count = getattr(settings, 'TASK_WORKERS', 0)
+    poll_interval = getattr(settings, 'TASK_POLL_INTERVAL', 1.0)
+    with _lock:
+        if not _workers:
+            _workers.extend(Worker(number, poll_interval) for number in range(count))
+            for worker in _workers:
+                worker.start()
+        return list(_workers)
+
+
+def stop_workers(timeout=None):
+    with _lock:
+        workers = list(_workers)
+        _workers.clear()
+    for worker in workers:
+        worker.stop()
+    for worker in workers:
+        worker.join(timeout)
@@ -1,9 +1,37 @@
-from django.test import TestCase
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
 from django.urls import reverse
-from .models import User, Team, Activity, Leaderboard, Workout
-from datetime import datetime
+import asyncio
+import json
+from .models import User, Team, Activity, ActivityDaily, Job, Leaderboard, TeamLeaderboard, Workout
+from .analytics import ActivityStore, activity_store, numpy, reload_in_background
+from .async_views import AsyncListView
+from .cache import cache_stats
+from .fitness import store_fitness_levels
+from .indexes import collection_for, declared_indexes, diff_indexes
+from .ingest import ingest_activities
+from .metrics import DB_QUERIES, Histogram
+from .ranking import RankIndex, rank_index
+from .renderers import FAST_JSON_MEDIA_TYPE, FastJSONRenderer
+from .repository import fetch_names, find_activities, leaderboard_top, team_members
+from .serializers import ActivitySerializer
+from .tasks import DONE, FAILED, JOBS, PENDING, JobSpec, enqueue, run_due_jobs
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from unittest import skipIf
+from unittest.mock import patch
+
+
+# References are ObjectIds; these stand in for documents the tests don't need
+USER_ID = '000000000000000000000123'
+TEAM_ID = '000000000000000000000456'
 
 
 class UserModelTest(TestCase):
@@ -36,7 +64,7 @@ class TeamModelTest(TestCase):
 class ActivityModelTest(TestCase):
     def setUp(self):
         self.activity = Activity.objects.create(
-            user_id="user123",
+            user_id=USER_ID,
             activity_type="Running",
             duration=30,
             distance=5.0,
@@ -54,8 +82,8 @@ class ActivityModelTest(TestCase):
 class LeaderboardModelTest(TestCase):
     def setUp(self):
         self.leaderboard = Leaderboard.objects.create(
-            user_id="user123",
-            team_id="team456",
+            user_id=USER_ID,
+            team_id=TEAM_ID,
             total_activities=10,
             total_calories=3000,
             total_distance=50.0,
@@ -63,7 +91,7 @@ class LeaderboardModelTest(TestCase):
         )
     
     def test_leaderboard_creation(self):
-        self.assertEqual(self.leaderboard.user_id, "user123")
+        self.assertEqual(self.leaderboard.user_id, ObjectId(USER_ID))
         self.assertEqual(self.leaderboard.total_activities, 10)
         self.assertEqual(self.leaderboard.rank, 1)
         self.assertIsNotNone(self.leaderboard._id)
@@ -120,7 +148,7 @@ class UserAPITest(APITestCase):
         url = reverse('user-list')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
 
 class TeamAPITest(APITestCase):
@@ -143,14 +171,14 @@ class TeamAPITest(APITestCase):
         url = reverse('team-list')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
 
 class ActivityAPITest(APITestCase):
     def setUp(self):
         self.client = APIClient()
         self.activity_data = {
-            'user_id': 'user123',
+            'user_id': USER_ID,
             'activity_type': 'Running',
             'duration': 30,
             'distance': 5.0,
@@ -166,7 +194,7 @@ class ActivityAPITest(APITestCase):
     
     def test_get_activities(self):
         Activity.objects.create(
-            user_id='user123',
+            user_id=USER_ID,
             activity_type='Running',
             duration=30,
             distance=5.0,
@@ -176,15 +204,15 @@ class ActivityAPITest(APITestCase):
         url = reverse('activity-list')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
 
 class LeaderboardAPITest(APITestCase):
     def setUp(self):
         self.client = APIClient()
         self.leaderboard_data = {
-            'user_id': 'user123',
-            'team_id': 'team456',
+            'user_id': USER_ID,
+            'team_id': TEAM_ID,
             'total_activities': 10,
             'total_calories': 3000,
             'total_distance': 50.0,
@@ -197,12 +225,49 @@ class LeaderboardAPITest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(Leaderboard.objects.count(), 1)
     
+    def test_one_entry_per_user(self):
+        url = reverse('leaderboard-list')
+        self.client.post(url, self.leaderboard_data, format='json')
+        response = self.client.post(url, self.leaderboard_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('user_id', response.data)
+        
+        other = self.client.post(url, {**self.leaderboard_data, 'user_id': str(ObjectId())}, format='json')
+        detail = reverse('leaderboard-detail', args=[other.data['id']])
+        response = self.client.patch(detail, {'user_id': USER_ID}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.patch(detail, {'user_id': other.data['user_id'], 'rank': 2}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Leaderboard.objects.count(), 2)
+    
     def test_get_leaderboard(self):
         Leaderboard.objects.create(**self.leaderboard_data)
         url = reverse('leaderboard-list')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
+    
+    def test_unranked_entries_are_listed_last(self):
+        caches['default'].clear()
+        rows = [{**self.leaderboard_data, '_id': ObjectId(), 'user_id': ObjectId(), 'rank': rank}
+                for rank in (2, None, 1, None, 3)]
+        Leaderboard.objects.mongo_insert_many(rows)
+        unranked = sorted(row['_id'] for row in rows if row['rank'] is None)
+        expected = [1, 2, 3, None, None]
+        for route in ('leaderboard-list', 'async-leaderboard-list'):
+            with self.subTest(route):
+                url = reverse(route) + '?page_size=2'
+                pages = []
+                while url:
+                    page = self.client.get(url).json()
+                    pages.append(page)
+                    url = page['next']
+                results = [row for page in pages for row in page['results']]
+                self.assertEqual([row['rank'] for row in results], expected)
+                self.assertEqual([row['id'] for row in results[3:]], [str(_id) for _id in unranked])
+                
+                back = self.client.get(pages[-1]['previous']).json()
+                self.assertEqual(back['results'], pages[-2]['results'])
 
 
 class WorkoutAPITest(APITestCase):
@@ -228,4 +293,1397 @@ class WorkoutAPITest(APITestCase):
         url = reverse('workout-list')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
+
+
+class ListQueryCountTest(APITestCase):
+    """
+    The list endpoints issue a fixed number of Mongo commands however many
+    rows they return. Commands are counted by the metrics CommandListener,
+    which unlike assertNumQueries also sees the direct $in name lookups.
+    """
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.users = 0
+        self.add_users(3)
+    
+    def add_users(self, count):
+        team = Team.objects.create(name=f'Team {self.users}', description='A test team')
+        for number in range(self.users, self.users + count):
+            user = User.objects.create(
+                name=f'User {number}',
+                email=f'user{number}@example.com',
+                password='testpass123',
+                team_id=str(team._id)
+            )
+            Activity.objects.create(
+                user_id=str(user._id),
+                activity_type='Running',
+                duration=30,
+                distance=5.0,
+                calories=300,
+                date=datetime.now()
+            )
+        self.users += count
+        run_due_jobs(force=True)
+    
+    def get(self, view_name):
+        """
+        One uncached GET of the list; returns the response and the Mongo
+        commands it issued
+        """
+        caches['default'].clear()
+        before = DB_QUERIES.totals((view_name, 'GET'))[0]
+        response = self.client.get(reverse(view_name))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, DB_QUERIES.totals((view_name, 'GET'))[0] - before
+    
+    def assertCommandsDoNotGrow(self, view_name):
+        _, few = self.get(view_name)
+        self.add_users(3)
+        response, many = self.get(view_name)
+        self.assertGreater(few, 0)
+        self.assertEqual(many, few)
+        return response
+    
+    def test_activity_list_queries(self):
+        # the activities, then the user names in one $in read
+        response = self.assertCommandsDoNotGrow('activity-list')
+        self.assertEqual({item['user_name'] for item in response.data['results']},
+                         {f'User {number}' for number in range(6)})
+    
+    def test_leaderboard_list_queries(self):
+        # the rows, then user and team names in one $in read each
+        response = self.assertCommandsDoNotGrow('leaderboard-list')
+        self.assertEqual({item['team_name'] for item in response.data['results']}, {'Team 0', 'Team 3'})
+    
+    def test_user_list_queries(self):
+        # the users, then the team names in one $in read; fitness_level is stored
+        response = self.assertCommandsDoNotGrow('user-list')
+        self.assertEqual({item['fitness_level'] for item in response.data['results']}, {'Beginner'})
+    
+    def test_team_list_queries(self):
+        # member_count is stored on the team
+        response = self.assertCommandsDoNotGrow('team-list')
+        self.assertEqual({item['member_count'] for item in response.data['results']}, {3})
+
+
+class TeamMemberCountTest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.marvel = Team.objects.create(name='Team Marvel')
+        self.dc = Team.objects.create(name='Team DC')
+        self.user = User.objects.create(
+            name='Tony Stark',
+            email='ironman@marvel.com',
+            password='stark123',
+            team_id=str(self.marvel._id)
+        )
+    
+    def member_counts(self):
+        self.marvel.refresh_from_db()
+        self.dc.refresh_from_db()
+        return self.marvel.member_count, self.dc.member_count
+    
+    def test_count_follows_user_writes(self):
+        self.assertEqual(self.member_counts(), (1, 0))
+        self.user.team_id = str(self.dc._id)
+        self.user.save()
+        self.assertEqual(self.member_counts(), (0, 1))
+        self.user.delete()
+        self.assertEqual(self.member_counts(), (0, 0))
+    
+    def test_recount_command(self):
+        Team.objects.mongo_update_many({}, {'$set': {'member_count': 42}})
+        call_command('recount_team_members', stdout=StringIO())
+        self.assertEqual(self.member_counts(), (1, 0))
+
+
+class LeaderboardEngineTest(TestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create(name=f'User {i}', email=f'user{i}@example.com', password='testpass123')
+            for i in range(3)
+        ]
+    
+    def log(self, user, calories):
+        return Activity.objects.create(
+            user_id=str(user._id),
+            activity_type='Running',
+            duration=30,
+            distance=5.0,
+            calories=calories,
+            date=datetime.now()
+        )
+    
+    def board(self):
+        run_due_jobs(force=True)
+        return {
+            entry.user_id: (entry.total_activities, entry.total_calories, entry.rank)
+            for entry in Leaderboard.objects.all()
+        }
+    
+    def test_totals_and_ranks_follow_activity_writes(self):
+        first, second, third = (user._id for user in self.users)
+        self.log(self.users[0], 300)
+        self.log(self.users[1], 500)
+        activity = self.log(self.users[2], 100)
+        self.assertEqual(self.board(), {
+            first: (1, 300, 2),
+            second: (1, 500, 1),
+            third: (1, 100, 3),
+        })
+        
+        activity.calories = 900
+        activity.save()
+        self.assertEqual(self.board(), {
+            first: (1, 300, 3),
+            second: (1, 500, 2),
+            third: (1, 900, 1),
+        })
+        
+        activity.delete()
+        self.assertEqual(self.board(), {
+            first: (1, 300, 2),
+            second: (1, 500, 1),
+            third: (0, 0, 3),
+        })
+    
+    def test_concurrent_first_activities_share_one_row(self):
+        user = self.users[0]
+        
+        def race(user_id):
+            # Another writer creates the row between our two updates
+            Leaderboard.objects.mongo_insert_one({
+                'user_id': user_id, 'team_id': None, 'total_activities': 1,
+                'total_calories': 50, 'total_distance': 0.0, 'rank': None,
+            })
+        
+        with patch('octofit_tracker.leaderboard.team_of', side_effect=race):
+            self.log(user, 300)
+        self.assertEqual(Leaderboard.objects.mongo_count_documents({'user_id': user._id}), 1)
+        self.assertEqual(self.board(), {user._id: (2, 350, 1)})
+    
+    def test_single_writes_rank_without_a_job(self):
+        first, second = (user._id for user in self.users[:2])
+        self.log(self.users[0], 300)
+        activity = self.log(self.users[1], 100)
+        activity.calories = 500
+        activity.save()
+        self.assertEqual(Job.objects.mongo_count_documents({'name': 'assign_ranks'}), 0)
+        self.assertEqual(dict(Leaderboard.objects.values_list('user_id', 'rank')), {first: 2, second: 1})
+    
+    def test_ties_share_a_rank(self):
+        self.log(self.users[0], 300)
+        self.log(self.users[1], 300)
+        self.assertEqual({rank for _, _, rank in self.board().values()}, {1})
+    
+    def test_fitness_level_follows_calorie_tiers(self):
+        user = self.users[0]
+        with self.settings(FITNESS_TIERS=[(1000, 'Advanced'), (500, 'Intermediate'), (0, 'Beginner')]):
+            self.log(user, 400)
+            user.refresh_from_db()
+            self.assertEqual(user.fitness_level, 'Beginner')
+            
+            activity = self.log(user, 700)
+            user.refresh_from_db()
+            self.assertEqual(user.fitness_level, 'Advanced')
+            
+            activity.delete()
+            user.refresh_from_db()
+            self.assertEqual(user.fitness_level, 'Beginner')
+    
+    def test_levels_are_stored_in_batches(self):
+        more = [
+            User.objects.create(name=f'User {i}', email=f'user{i}@example.com', password='testpass123')
+            for i in range(3, 6)
+        ]
+        User.objects.mongo_update_many({}, {'$set': {'fitness_level': 'Intermediate'}})
+        totals = {user._id: 200 * number for number, user in enumerate(self.users + more)}
+        del totals[more[-1]._id]
+        tiers = [(600, 'Advanced'), (200, 'Intermediate'), (0, 'Beginner')]
+        with self.settings(FITNESS_TIERS=tiers), patch('octofit_tracker.fitness.FITNESS_BATCH_SIZE', 2):
+            self.assertEqual(store_fitness_levels(totals), 4)
+        self.assertEqual(
+            [user.fitness_level for user in User.objects.order_by('email')],
+            ['Beginner', 'Intermediate', 'Intermediate', 'Advanced', 'Advanced', 'Beginner']
+        )
+
+
+class TaskQueueTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(name='Tony Stark', email='ironman@marvel.com', password='stark123')
+    
+    def log(self, calories):
+        # Bulk ingests leave ranking to the assign_ranks job
+        item = {'user_id': str(self.user._id), 'activity_type': 'Running', 'duration': 30, 'calories': calories,
+                'date': datetime.now().isoformat()}
+        ingest_activities([item], chunk_size=10, max_errors=0, context={})
+    
+    def test_bursts_are_coalesced_into_one_job(self):
+        for calories in (100, 200, 300):
+            self.log(calories)
+        jobs = list(Job.objects.mongo_find({'name': 'assign_ranks'}))
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual((jobs[0]['status'], jobs[0]['requests']), (PENDING, 3))
+        self.assertIsNone(Leaderboard.objects.get(user_id=self.user._id).rank)
+    
+    def test_jobs_wait_for_their_debounce_delay(self):
+        self.log(100)
+        self.assertEqual(run_due_jobs(), 0)
+        Job.objects.mongo_update_many({}, {'$set': {'deadline': datetime.now(dt_timezone.utc) - timedelta(seconds=1)}})
+        self.assertEqual(run_due_jobs(), 1)
+        self.assertEqual(Job.objects.mongo_find_one({'name': 'assign_ranks'})['status'], DONE)
+        self.assertEqual(Leaderboard.objects.get(user_id=self.user._id).rank, 1)
+    
+    def test_failing_jobs_are_retried_then_marked_failed(self):
+        jobs = {**JOBS, 'assign_ranks': JobSpec('octofit_tracker.tests.failing_job', 0, 0, 2)}
+        with patch('octofit_tracker.tasks.JOBS', jobs):
+            enqueue('assign_ranks')
+            run_due_jobs(force=True)
+            job = Job.objects.mongo_find_one({'name': 'assign_ranks'})
+            self.assertEqual((job['status'], job['attempts']), (PENDING, 1))
+            self.assertEqual(job['last_error'], 'RuntimeError: boom')
+            self.assertGreater(job['run_after'], job['started_at'])
+            
+            Job.objects.mongo_update_one({'_id': job['_id']}, {'$set': {'run_after': job['started_at'],
+                                                                        'deadline': job['started_at']}})
+            run_due_jobs()
+            job = Job.objects.mongo_find_one({'name': 'assign_ranks'})
+            self.assertEqual((job['status'], job['attempts']), (FAILED, 2))
+    
+    def test_enqueue_keeps_retry_backoff(self):
+        jobs = {**JOBS, 'assign_ranks': JobSpec('octofit_tracker.tests.failing_job', 0, 0, 2)}
+        with patch('octofit_tracker.tasks.JOBS', jobs):
+            enqueue('assign_ranks')
+            run_due_jobs(force=True)
+            backoff = Job.objects.mongo_find_one({'name': 'assign_ranks'})['run_after']
+            enqueue('assign_ranks')
+            job = Job.objects.mongo_find_one({'name': 'assign_ranks'})
+            self.assertEqual((job['run_after'], job['requests']), (backoff, 2))
+    
+    def test_one_pending_job_per_name(self):
+        now = datetime.now(dt_timezone.utc)
+        job = {'name': 'assign_ranks', 'requests': 1, 'attempts': 0, 'run_after': now, 'deadline': now,
+               'created_at': now}
+        Job.objects.mongo_insert_one({**job, 'status': DONE})
+        Job.objects.mongo_insert_one({**job, 'status': PENDING})
+        with self.assertRaises(DuplicateKeyError):
+            Job.objects.mongo_insert_one({**job, 'status': PENDING})
+        enqueue('assign_ranks')
+        self.assertEqual(Job.objects.mongo_count_documents({'name': 'assign_ranks'}), 2)
+    
+    def test_finished_jobs_are_purged(self):
+        enqueue('assign_ranks')
+        enqueue('assign_team_ranks')
+        run_due_jobs(force=True)
+        old = datetime.now(dt_timezone.utc) - timedelta(days=8)
+        Job.objects.mongo_update_one({'name': 'assign_ranks'}, {'$set': {'finished_at': old}})
+        run_due_jobs()
+        self.assertEqual([job['name'] for job in Job.objects.mongo_find({})], ['assign_team_ranks'])
+    
+    def test_commands(self):
+        call_command('enqueue_job', 'rebuild_team_leaderboard', 'recompute_fitness_levels', stdout=StringIO())
+        out = StringIO()
+        call_command('list_jobs', stdout=out)
+        self.assertIn('pending 2', out.getvalue())
+        out = StringIO()
+        call_command('run_jobs', once=True, force=True, stdout=out)
+        self.assertIn('Ran 2 jobs', out.getvalue())
+        out = StringIO()
+        call_command('list_jobs', status=DONE, stdout=out)
+        self.assertIn('rebuild_team_leaderboard', out.getvalue())
+
+
+def failing_job():
+    raise RuntimeError('boom')
+
+
+class RankIndexTest(SimpleTestCase):
+    def setUp(self):
+        self.index = RankIndex()
+        self.index.load([('a', 500), ('b', 300), ('c', 300), ('d', 100), ('e', 50)])
+    
+    def test_rank_uses_competition_ranking(self):
+        self.assertEqual(self.index.rank('a'), 1)
+        self.assertEqual(self.index.rank('b'), 2)
+        self.assertEqual(self.index.rank('c'), 2)
+        self.assertEqual(self.index.rank('d'), 4)
+        self.assertIsNone(self.index.rank('missing'))
+    
+    def test_top_and_around(self):
+        self.assertEqual(self.index.top(2), [('a', 500, 1), ('b', 300, 2)])
+        self.assertEqual(self.index.around('d', 1), [('c', 300, 2), ('d', 100, 4), ('e', 50, 5)])
+        self.assertEqual([user for user, _, _ in self.index.around('a', 1)], ['a', 'b'])
+    
+    def test_update_and_remove(self):
+        self.index.update('e', 1000)
+        self.assertEqual(self.index.rank('e'), 1)
+        self.assertEqual(self.index.rank('a'), 2)
+        self.index.remove('e')
+        self.assertEqual(self.index.rank('a'), 1)
+        self.assertEqual(len(self.index), 4)
+
+
+class LeaderboardAroundAPITest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        rank_index.invalidate()
+        for i, calories in enumerate([100, 200, 300, 400, 500]):
+            Leaderboard.objects.create(
+                user_id=self.user(i),
+                team_id=TEAM_ID,
+                total_calories=calories,
+                rank=5 - i
+            )
+    
+    def user(self, i):
+        return f'{i:024x}'
+    
+    def test_around_user(self):
+        url = reverse('leaderboard-list')
+        response = self.client.get(url, {'around': self.user(2), 'radius': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(item['user_id'], item['rank']) for item in response.data],
+            [(self.user(3), 2), (self.user(2), 3), (self.user(1), 4)]
+        )
+    
+    def test_around_unknown_user(self):
+        url = reverse('leaderboard-list')
+        response = self.client.get(url, {'around': 'nobody'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class KeysetPaginationTest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        start = datetime(2024, 1, 1, 12, 0)
+        for day in range(5):
+            # Two activities per day so pages have to break ties on _id
+            for _ in range(2):
+                Activity.objects.create(
+                    user_id=USER_ID,
+                    activity_type='Running',
+                    duration=30,
+                    calories=300,
+                    date=start + timedelta(days=day)
+                )
+    
+    def collect(self, url, link):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(item['id'] for item in response.data['results'])
+            url = response.data[link]
+        return ids
+    
+    def test_pages_cover_every_row_once_in_order(self):
+        url = reverse('activity-list') + '?page_size=3'
+        ids = self.collect(url, 'next')
+        expected = [
+            str(activity._id) for activity in Activity.objects.order_by('-date', '-_id')
+        ]
+        self.assertEqual(ids, expected)
+    
+    def test_previous_link_walks_back(self):
+        url = reverse('activity-list') + '?page_size=4'
+        first = self.client.get(url).data
+        second = self.client.get(first['next']).data
+        back = self.client.get(second['previous']).data
+        self.assertEqual(back['results'], first['results'])
+        self.assertIsNone(first['previous'])
+    
+    def test_page_size_is_capped(self):
+        with self.settings(PAGINATION_MAX_PAGE_SIZE=2):
+            response = self.client.get(reverse('activity-list'), {'page_size': 1000})
+        self.assertEqual(len(response.data['results']), 2)
+    
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('activity-list'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class SyncIndexesTest(TestCase):
+    def test_creates_declared_indexes(self):
+        call_command('sync_indexes', stdout=StringIO())
+        for model in (User, Activity, Leaderboard):
+            collection = collection_for(model)
+            missing, mismatched, _ = diff_indexes(collection, declared_indexes(model))
+            self.assertEqual((missing, mismatched), ([], []))
+        key = collection_for(Activity).index_information()['activities_user_date_idx']['key']
+        self.assertEqual([(name, int(direction)) for name, direction in key], [('user_id', 1), ('date', -1), ('_id', -1)])
+    
+    def test_conditions_become_partial_filters(self):
+        index = {index.document['name']: index.document for index in declared_indexes(Job)}['jobs_pending_name_uniq']
+        self.assertEqual(dict(index['key']), {'name': 1})
+        self.assertEqual((index['unique'], index['partialFilterExpression']), (True, {'status': PENDING}))
+        self.assertEqual(diff_indexes(collection_for(Job), declared_indexes(Job)), ([], [], []))
+    
+    def test_dry_run_changes_nothing(self):
+        collection = collection_for(Activity)
+        collection.drop_indexes()
+        out = StringIO()
+        call_command('sync_indexes', '--dry-run', stdout=out)
+        self.assertIn('creating activities_user_date_idx', out.getvalue())
+        self.assertEqual(list(collection.index_information()), ['_id_'])
+
+
+class PopulateDbTest(TestCase):
+    def test_bulk_seed(self):
+        out = StringIO()
+        call_command('populate_db', users=20, teams=3, activities_per_user=4, seed=42, batch_size=7, stdout=out)
+        self.assertEqual(User.objects.count(), 20)
+        self.assertEqual(Activity.objects.count(), 80)
+        self.assertEqual(sum(team.member_count for team in Team.objects.all()), 20)
+        self.assertIn('Timings:', out.getvalue())
+        
+        entries = list(Leaderboard.objects.all())
+        self.assertEqual(len(entries), 20)
+        for entry in entries:
+            self.assertEqual(entry.total_activities, 4)
+            higher = sum(1 for other in entries if other.total_calories > entry.total_calories)
+            self.assertEqual(entry.rank, higher + 1)
+    
+    def test_seed_is_reproducible(self):
+        call_command('populate_db', users=5, activities_per_user=2, seed=7, stdout=StringIO())
+        first = sorted(Activity.objects.values_list('calories', flat=True))
+        call_command('populate_db', users=5, activities_per_user=2, seed=7, stdout=StringIO())
+        self.assertEqual(sorted(Activity.objects.values_list('calories', flat=True)), first)
+
+
+class BulkIngestAPITest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse('activity-bulk')
+        self.activity = {
+            'user_id': USER_ID,
+            'activity_type': 'Running',
+            'duration': 30,
+            'distance': 5.0,
+            'calories': 300,
+            'date': datetime.now().isoformat()
+        }
+    
+    def test_json_array_with_per_item_errors(self):
+        payload = [self.activity, {'user_id': USER_ID}, self.activity]
+        response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['failed'], 1)
+        self.assertEqual(response.data['errors'][0]['index'], 1)
+        self.assertEqual(Activity.objects.count(), 2)
+        entry = Leaderboard.objects.get(user_id=USER_ID)
+        self.assertEqual((entry.total_activities, entry.total_calories), (2, 600))
+    
+    def test_ndjson_stream(self):
+        lines = [json.dumps(self.activity) for _ in range(5)] + ['not json']
+        response = self.client.generic(
+            'POST', self.url, '\n'.join(lines), content_type='application/x-ndjson'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['created'], response.data['failed']), (5, 1))
+        self.assertEqual(Activity.objects.count(), 5)
+    
+    def test_malformed_array(self):
+        response = self.client.generic('POST', self.url, '{"not": "an array"}', content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('payload_error', response.data)
+
+
+class ActivityStatsAPITest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse('activity-stats')
+        self.team = Team.objects.create(name='Team Marvel')
+        self.tony = User.objects.create(
+            name='Tony Stark', email='ironman@marvel.com', password='stark123', team_id=str(self.team._id)
+        )
+        self.bruce = User.objects.create(name='Bruce Wayne', email='batman@dc.com', password='wayne123')
+        for user, activity_type, calories, day in [
+            (self.tony, 'Running', 300, 1),
+            (self.tony, 'Running', 200, 2),
+            (self.tony, 'Yoga', 100, 2),
+            (self.bruce, 'Running', 400, 3),
+        ]:
+            Activity.objects.create(
+                user_id=str(user._id),
+                activity_type=activity_type,
+                duration=30,
+                distance=5.0 if activity_type == 'Running' else None,
+                calories=calories,
+                date=datetime(2024, 1, day, 12, 0)
+            )
+    
+    def totals(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return {row['key']: (row['activities'], row['calories']) for row in response.data['results']}
+    
+    def test_group_by_activity_type(self):
+        self.assertEqual(self.totals(), {'Running': (3, 900), 'Yoga': (1, 100)})
+    
+    def test_group_by_day_with_date_range(self):
+        self.assertEqual(
+            self.totals(group_by='day', date__gte='2024-01-02', date__lt='2024-01-03'),
+            {'2024-01-02': (2, 300)}
+        )
+    
+    def test_group_by_team_and_filter_by_team(self):
+        self.assertEqual(self.totals(group_by='team'), {str(self.team._id): (3, 600), None: (1, 400)})
+        self.assertEqual(
+            self.totals(group_by='user', team_id=str(self.team._id)),
+            {str(self.tony._id): (3, 600)}
+        )
+    
+    def test_invalid_group(self):
+        response = self.client.get(self.url, {'group_by': 'month'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_top_groups_by_calories(self):
+        response = self.client.get(self.url, {'group_by': 'day', 'top': 2})
+        self.assertEqual([row['key'] for row in response.data['results']], ['2024-01-03', '2024-01-01'])
+        self.assertEqual(self.totals(group_by='team', top=1), {str(self.team._id): (3, 600)})
+        response = self.client.get(self.url, {'top': 0})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@skipIf(numpy is None, 'the analytics store needs NumPy')
+@override_settings(ANALYTICS_STORE=True, ANALYTICS_REFRESH_INTERVAL=3600)
+class AnalyticsStoreTest(ActivityStatsAPITest):
+    """
+    The stats tests again, answered from the columnar store
+    """
+    
+    def setUp(self):
+        activity_store.invalidate()
+        super().setUp()
+        caches['default'].clear()
+    
+    def totals(self, **params):
+        with patch('octofit_tracker.stats.aggregate_groups') as aggregate:
+            totals = super().totals(**params)
+        aggregate.assert_not_called()
+        return totals
+    
+    def test_new_activities_are_picked_up_incrementally(self):
+        self.assertEqual(self.totals(), {'Running': (3, 900), 'Yoga': (1, 100)})
+        loaded_at = activity_store.loaded_at
+        Activity.objects.create(user_id=str(self.bruce._id), activity_type='Boxing', duration=30,
+                                calories=250, date=datetime(2024, 1, 4, 12, 0))
+        caches['default'].clear()
+        self.assertEqual(self.totals(), {'Boxing': (1, 250), 'Running': (3, 900), 'Yoga': (1, 100)})
+        self.assertEqual(activity_store.loaded_at, loaded_at)
+    
+    def test_writes_are_applied_in_place(self):
+        self.totals()
+        loaded_at = activity_store.loaded_at
+        Activity.objects.filter(activity_type='Yoga').delete()
+        activity = Activity.objects.get(calories=400)
+        activity.activity_type, activity.calories = 'Boxing', 450
+        activity.save()
+        caches['default'].clear()
+        self.assertEqual(self.totals(), {'Boxing': (1, 450), 'Running': (2, 500)})
+        self.assertEqual(activity_store.loaded_at, loaded_at)
+    
+    def test_stale_store_is_reloaded_in_the_background(self):
+        self.totals()
+        # Written by another process, so only a reload sees it
+        Activity.objects.mongo_update_many({'activity_type': 'Yoga'}, {'$set': {'calories': 150}})
+        activity_store.loaded_at -= 3600
+        with patch('octofit_tracker.analytics.reload_in_background') as reload:
+            caches['default'].clear()
+            self.assertEqual(self.totals(), {'Running': (3, 900), 'Yoga': (1, 100)})
+        reload.assert_called_once_with()
+        
+        yoga = Activity.objects.get(activity_type='Yoga')
+        load = ActivityStore.load
+        
+        def load_then_delete(store):
+            loaded = load(store)
+            if store is not activity_store:
+                # Lands after the new copy read the activity
+                yoga.delete()
+            return loaded
+        
+        with patch.object(ActivityStore, 'load', load_then_delete):
+            reload_in_background().join()
+        caches['default'].clear()
+        self.assertEqual(self.totals(), {'Running': (3, 900)})
+    
+    def test_columns_take_tens_of_bytes_per_activity(self):
+        self.totals()
+        self.assertEqual(len(activity_store), 4)
+        self.assertLessEqual(activity_store.bytes_per_activity(), 39)
+    
+    def test_distance_totals_match_mongo(self):
+        Activity.objects.mongo_update_many({'distance': {'$ne': None}}, {'$set': {'distance': 1234567.89}})
+        activity_store.invalidate()
+        with self.settings(ANALYTICS_STORE=False):
+            expected = self.client.get(self.url).data['results']
+        caches['default'].clear()
+        self.assertEqual(self.client.get(self.url).data['results'], expected)
+    
+    def test_top_ties_go_to_the_lower_key(self):
+        # Users and types are coded in order of arrival, not of key
+        store = ActivityStore()
+        for user_id, activity_type in [(ObjectId('0' * 23 + '9'), 'Yoga'), (ObjectId('0' * 23 + '1'), 'Boxing'),
+                                       (ObjectId('0' * 23 + '5'), 'Running')]:
+            store.append({'_id': ObjectId(), 'user_id': user_id, 'activity_type': activity_type, 'duration': 30,
+                          'calories': 200, 'date': datetime(2024, 1, 1)})
+        self.assertEqual([group['_id'] for group in store.group('user', {}, top=2)],
+                         [ObjectId('0' * 23 + '1'), ObjectId('0' * 23 + '5')])
+        self.assertEqual([group['_id'] for group in store.group('activity_type', {}, top=2)], ['Boxing', 'Running'])
+
+
+class ResponseCacheTest(APITestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.client = APIClient()
+        self.user = User.objects.create(name='Tony Stark', email='ironman@marvel.com', password='stark123')
+        Workout.objects.create(name='Morning Run', description='Run', difficulty='Easy', duration=30, category='Cardio')
+    
+    def test_repeat_get_is_served_from_cache(self):
+        url = reverse('workout-list')
+        first = self.client.get(url)
+        hits = cache_stats()['hits']
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertEqual(cache_stats()['hits'], hits + 1)
+    
+    def test_matching_etag_gets_not_modified(self):
+        url = reverse('workout-list')
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+    
+    def test_write_invalidates_dependent_responses(self):
+        user_url = reverse('activity-stats') + f'?user_id={self.user._id}'
+        etag = self.client.get(user_url)['ETag']
+        workouts = self.client.get(reverse('workout-list'))['ETag']
+        Activity.objects.create(
+            user_id=str(self.user._id),
+            activity_type='Running',
+            duration=30,
+            calories=300,
+            date=datetime.now()
+        )
+        response = self.client.get(user_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['activities'], 1)
+        # Workouts don't depend on activities
+        response = self.client.get(reverse('workout-list'), HTTP_IF_NONE_MATCH=workouts)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+    
+    def test_user_id_spellings_share_a_namespace(self):
+        # An upper-case id names the same user and must be invalidated with it
+        user_id = str(self.user._id).upper()
+        for route in ['activity-list', 'activity-stats']:
+            with self.subTest(route):
+                url = reverse(route) + f'?user_id={user_id}'
+                etag = self.client.get(url)['ETag']
+                Activity.objects.create(
+                    user_id=str(self.user._id),
+                    activity_type='Running',
+                    duration=30,
+                    calories=300,
+                    date=datetime.now()
+                )
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+    
+    def test_errors_are_not_cached(self):
+        url = reverse('activity-list')
+        self.client.get(url, {'cursor': 'garbage'})
+        response = self.client.get(url, {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertNotIn('ETag', response)
+
+
+class AsyncListParityTest(APITestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.client = APIClient()
+        team = Team.objects.create(name='Team Marvel')
+        users = [
+            User.objects.create(name=f'User {i}', email=f'user{i}@example.com', password='pass', team_id=str(team._id))
+            for i in range(3)
+        ]
+        start = datetime(2024, 1, 1)
+        for day in range(5):
+            for user in users:
+                Activity.objects.create(
+                    user_id=str(user._id),
+                    activity_type='Running',
+                    duration=30,
+                    calories=100 * (day + 1),
+                    date=start + timedelta(days=day)
+                )
+    
+    def test_async_lists_match_sync_lists(self):
+        for name, route in [('activities', 'activity-list'), ('leaderboard', 'leaderboard-list'),
+                            ('users', 'user-list'), ('teams', 'team-list')]:
+            with self.subTest(name):
+                expected = self.client.get(reverse(route)).json()
+                response = self.client.get(reverse(f'async-{route}'))
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(response.json()['results'], expected['results'])
+    
+    def test_async_activities_are_filtered(self):
+        user = User.objects.get(email='user1@example.com')
+        for params in [{'user_id': str(user._id)}, {'calories__gte': 300, 'date__gte': '2024-01-01', 'date__lt': '2024-01-05'},
+                       {'team_id': str(user.team_id), 'page_size': 4}]:
+            with self.subTest(params):
+                expected = self.client.get(reverse('activity-list'), params).json()
+                response = self.client.get(reverse('async-activity-list'), params)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(response.json()['results'], expected['results'])
+                self.assertLess(len(expected['results']), Activity.objects.count())
+    
+    def test_async_activity_filters_are_validated(self):
+        for params in [{'user_id': 'nope'}, {'calories__gte': 300}]:
+            with self.subTest(params):
+                response = self.client.get(reverse('async-activity-list'), params)
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_async_pages_follow_the_cursor(self):
+        url = reverse('async-activity-list') + '?page_size=4'
+        ids = []
+        while url:
+            page = self.client.get(url).json()
+            ids.extend(item['id'] for item in page['results'])
+            url = page['next']
+        expected = [str(activity._id) for activity in Activity.objects.order_by('-date', '-_id')]
+        self.assertEqual(ids, expected)
+    
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('async-activity-list'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class RepositoryTest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.team = Team.objects.create(name='Team Marvel')
+        self.users = [
+            User.objects.create(name=f'User {i}', email=f'user{i}@example.com', password='pass', team_id=str(self.team._id))
+            for i in range(3)
+        ]
+        User.objects.create(name='Loner', email='loner@example.com', password='pass')
+        start = datetime(2024, 1, 1)
+        for day in range(4):
+            for user in self.users:
+                Activity.objects.create(
+                    user_id=str(user._id),
+                    activity_type='Running',
+                    duration=30,
+                    calories=100 * (day + 1),
+                    date=start + timedelta(days=day)
+                )
+    
+    def test_records_match_orm_rows(self):
+        user_id = self.users[0]._id
+        expected = list(Activity.objects.filter(user_id=user_id).order_by('-date', '-_id')[:3])
+        records = find_activities(user_id=user_id, limit=3)
+        self.assertEqual([record._id for record in records], [activity._id for activity in expected])
+        self.assertEqual([record.date for record in records], [activity.date for activity in expected])
+        self.assertEqual(
+            ActivitySerializer(records, many=True).data,
+            ActivitySerializer(expected, many=True).data
+        )
+    
+    def test_date_range(self):
+        records = find_activities(date_gte=datetime(2024, 1, 2), date_lt=datetime(2024, 1, 3))
+        self.assertEqual(len(records), 3)
+    
+    def test_leaderboard_top(self):
+        run_due_jobs(force=True)
+        top = leaderboard_top(2)
+        self.assertEqual([entry.rank for entry in top], [1, 1])
+        self.assertEqual(len(leaderboard_top(10)), 3)
+    
+    def test_team_members_endpoint(self):
+        self.assertEqual(len(team_members(self.team._id)), 3)
+        url = reverse('team-members', args=[str(self.team._id)]) + '?page_size=2'
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(ids, sorted(str(user._id) for user in self.users))
+    
+    def test_team_members_of_unknown_team(self):
+        response = self.client.get(reverse('team-members', args=['000000000000000000000000']))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ActivityRollupTest(APITestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.client = APIClient()
+        self.user = User.objects.create(name='Tony Stark', email='ironman@marvel.com', password='stark123')
+        self.activities = [
+            Activity.objects.create(
+                user_id=str(self.user._id),
+                activity_type='Running',
+                duration=30,
+                distance=5.0,
+                calories=calories,
+                date=date
+            )
+            for calories, date in [
+                (300, datetime(2024, 1, 1, 7, 0)),
+                (200, datetime(2024, 1, 1, 18, 0)),
+                (100, datetime(2024, 1, 3, 7, 0)),
+                (400, datetime(2024, 1, 8, 7, 0)),
+            ]
+        ]
+        self.url = reverse('user-timeline', args=[str(self.user._id)])
+    
+    def rollups(self):
+        return {
+            (row.day.date().isoformat(), row.activities, row.calories)
+            for row in ActivityDaily.objects.filter(user_id=str(self.user._id))
+        }
+    
+    def test_activity_writes_maintain_daily_rollups(self):
+        self.assertEqual(self.rollups(), {('2024-01-01', 2, 500), ('2024-01-03', 1, 100), ('2024-01-08', 1, 400)})
+        
+        moved = self.activities[2]
+        moved.date = datetime(2024, 1, 1, 9, 0)
+        moved.save()
+        self.activities[3].delete()
+        self.assertEqual(self.rollups(), {('2024-01-01', 3, 600)})
+    
+    def test_rebuild_matches_incremental_rollups(self):
+        incremental = self.rollups()
+        ActivityDaily.objects.all().delete()
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(self.rollups(), incremental)
+    
+    def test_rebuild_swaps_in_a_complete_collection(self):
+        incremental = self.rollups()
+        collection = collection_for(ActivityDaily)
+        ActivityDaily.objects.mongo_insert_one({'user_id': ObjectId(), 'day': datetime(2024, 1, 1), 'activities': 1,
+                                                'duration': 10, 'calories': 50, 'distance': 0.0})
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(self.rollups(), incremental)
+        self.assertEqual(ActivityDaily.objects.mongo_count_documents({}), len(incremental))
+        self.assertIn('activity_daily_user_day_uniq', collection.index_information())
+        self.assertNotIn(f'{collection.name}_rebuild', collection.database.list_collection_names())
+    
+    def test_rebuild_refreshes_cached_timelines(self):
+        params = {'date__gte': '2024-01-01', 'date__lt': '2024-02-01'}
+        self.assertEqual(len(json.loads(self.client.get(self.url, params).content)['results']), 3)
+        # A raw write bypasses the signals that maintain the rollups
+        Activity.objects.mongo_delete_many({'user_id': self.user._id, 'date': {'$gte': datetime(2024, 1, 8)}})
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(len(json.loads(self.client.get(self.url, params).content)['results']), 2)
+    
+    def test_timeline_by_day_and_week(self):
+        params = {'date__gte': '2024-01-01', 'date__lt': '2024-02-01'}
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(row['key'], row['activities'], row['calories']) for row in response.data['results']],
+            [('2024-01-01', 2, 500), ('2024-01-03', 1, 100), ('2024-01-08', 1, 400)]
+        )
+        
+        response = self.client.get(self.url, {**params, 'bucket': 'week'})
+        self.assertEqual(
+            [(row['key'], row['activities'], row['calories']) for row in response.data['results']],
+            [('2024-W01', 3, 600), ('2024-W02', 1, 400)]
+        )
+    
+    def test_invalid_bucket_and_unknown_user(self):
+        self.assertEqual(self.client.get(self.url, {'bucket': 'month'}).status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('user-timeline', args=['000000000000000000000000']))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class TeamLeaderboardTest(APITestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.client = APIClient()
+        self.marvel = Team.objects.create(name='Team Marvel')
+        self.dc = Team.objects.create(name='Team DC')
+        self.tony = User.objects.create(name='Tony', email='tony@marvel.com', password='p', team_id=str(self.marvel._id))
+        self.steve = User.objects.create(name='Steve', email='steve@marvel.com', password='p', team_id=str(self.marvel._id))
+        self.bruce = User.objects.create(name='Bruce', email='bruce@dc.com', password='p', team_id=str(self.dc._id))
+        for user, calories in [(self.tony, 300), (self.steve, 200), (self.bruce, 400)]:
+            self.log(user, calories)
+        run_due_jobs(force=True)
+    
+    def log(self, user, calories):
+        return Activity.objects.create(
+            user_id=str(user._id),
+            activity_type='Running',
+            duration=30,
+            calories=calories,
+            date=datetime.now()
+        )
+    
+    def board(self):
+        run_due_jobs(force=True)
+        return [(row.team_name, row.total_activities, row.total_calories, row.rank)
+                for row in TeamLeaderboard.objects.order_by('rank')]
+    
+    def test_activity_writes_update_team_totals_and_ranks(self):
+        self.assertEqual(self.board(), [('Team Marvel', 2, 500, 1), ('Team DC', 1, 400, 2)])
+        self.log(self.bruce, 200)
+        self.assertEqual(self.board(), [('Team DC', 2, 600, 1), ('Team Marvel', 2, 500, 2)])
+    
+    def test_changing_team_moves_the_users_totals(self):
+        self.steve.team_id = str(self.dc._id)
+        self.steve.save()
+        self.assertEqual(self.board(), [('Team DC', 2, 600, 1), ('Team Marvel', 1, 300, 2)])
+    
+    def test_rebuild_matches_incremental_board(self):
+        incremental = self.board()
+        TeamLeaderboard.objects.all().delete()
+        call_command('rebuild_team_leaderboard', stdout=StringIO())
+        self.assertEqual(self.board(), incremental)
+    
+    def test_rebuild_updates_rows_in_place(self):
+        incremental = self.board()
+        row_ids = {row['team_id']: row['_id'] for row in TeamLeaderboard.objects.mongo_find({})}
+        TeamLeaderboard.objects.mongo_update_one({'team_id': self.marvel._id}, {'$set': {'total_calories': 9999}})
+        TeamLeaderboard.objects.mongo_insert_one({'team_id': ObjectId(), 'team_name': 'Gone', 'total_activities': 1,
+                                                  'total_calories': 50, 'total_distance': 0.0, 'rank': 3})
+        call_command('rebuild_team_leaderboard', stdout=StringIO())
+        self.assertEqual(self.board(), incremental)
+        self.assertEqual({row['team_id']: row['_id'] for row in TeamLeaderboard.objects.mongo_find({})}, row_ids)
+    
+    def test_endpoint_is_single_read(self):
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('team-leaderboard'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(row['team_name'], row['total_points'], row['rank']) for row in response.data],
+            [('Team Marvel', 500, 1), ('Team DC', 400, 2)]
+        )
+
+
+class RebuildLeaderboardTest(TestCase):
+    def setUp(self):
+        self.team = Team.objects.create(name='Team Marvel')
+        self.users = [
+            User.objects.create(name=f'User {i}', email=f'user{i}@example.com', password='p',
+                                team_id=str(self.team._id))
+            for i in range(4)
+        ]
+        for user, calories in zip(self.users, [300, 500, 100, 200]):
+            Activity.objects.create(user_id=str(user._id), activity_type='Running', duration=30,
+                                    distance=5.0, calories=calories, date=datetime.now())
+        run_due_jobs(force=True)
+    
+    def board(self):
+        return {
+            row.user_id: (row.team_id, row.total_activities, row.total_calories, row.rank)
+            for row in Leaderboard.objects.all()
+        }
+    
+    def test_rebuild_matches_incremental_board(self):
+        incremental = self.board()
+        teams = [(row.total_calories, row.rank) for row in TeamLeaderboard.objects.all()]
+        first, second, third, fourth = (user._id for user in self.users)
+        # Drift the stored board: a wrong total, a missing row and a row
+        # left over from activities that no longer exist
+        Leaderboard.objects.mongo_update_one({'user_id': first}, {'$set': {'total_calories': 9999, 'rank': 1}})
+        Leaderboard.objects.mongo_delete_one({'user_id': second})
+        Activity.objects.filter(user_id=fourth).delete()
+        Leaderboard.objects.mongo_update_one({'user_id': fourth}, {'$set': {'total_calories': 200}})
+        TeamLeaderboard.objects.mongo_delete_many({})
+        
+        out = StringIO()
+        call_command('rebuild_leaderboard', batch_size=2, stdout=out)
+        
+        incremental[fourth] = (self.team._id, 0, 0, 4)
+        incremental[third] = (self.team._id, 1, 100, 3)
+        self.assertEqual(self.board(), incremental)
+        self.assertEqual([(row.total_calories, row.rank) for row in TeamLeaderboard.objects.all()],
+                         [(teams[0][0] - 200, 1)])
+        self.assertIn('3 users, 3 activities: 1 rows inserted, 1 updated, 1 zeroed', out.getvalue())
+        self.assertIn('Throughput:', out.getvalue())
+        for phase in ('user totals', 'ranks', 'team leaderboard', 'fitness levels'):
+            self.assertIn(f'  {phase} done', out.getvalue())
+    
+    def test_unchanged_distances_are_not_rewritten(self):
+        for distance in (0.1, 0.2, 1.234):
+            Activity.objects.create(user_id=str(self.users[0]._id), activity_type='Running', duration=30,
+                                    distance=distance, calories=0, date=datetime.now())
+        stored = Leaderboard.objects.get(user_id=self.users[0]._id).total_distance
+        out = StringIO()
+        call_command('rebuild_leaderboard', stdout=out)
+        self.assertIn('0 rows inserted, 0 updated, 0 zeroed', out.getvalue())
+        self.assertEqual(Leaderboard.objects.get(user_id=self.users[0]._id).total_distance, stored)
+    
+    def test_rebuild_is_registered_as_a_job(self):
+        enqueue('rebuild_leaderboard')
+        Leaderboard.objects.mongo_delete_many({})
+        run_due_jobs(force=True)
+        self.assertEqual(Leaderboard.objects.count(), 4)
+        self.assertEqual(Job.objects.mongo_find_one({'name': 'rebuild_leaderboard'})['status'], DONE)
+
+
+class SparseFieldsetTest(APITestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.client = APIClient()
+        self.team = Team.objects.create(name='Team Marvel')
+        self.user = User.objects.create(name='Tony Stark', email='ironman@marvel.com', password='stark123',
+                                        team_id=str(self.team._id))
+        for _ in range(3):
+            Activity.objects.create(
+                user_id=str(self.user._id),
+                activity_type='Running',
+                duration=30,
+                calories=300,
+                date=datetime.now()
+            )
+        Workout.objects.create(name='Morning Run', description='Run', difficulty='Easy', duration=30,
+                               calories_estimate=200, category='Cardio')
+    
+    def test_fields_limit_the_output(self):
+        response = self.client.get(reverse('activity-list'), {'fields': 'id,calories'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual({tuple(item) for item in response.data['results']}, {('id', 'calories')})
+        
+        response = self.client.get(reverse('workout-list'), {'fields': 'name,difficulty'})
+        self.assertEqual(list(response.data['results'][0]), ['name', 'difficulty'])
+    
+    def test_unrequested_lookups_do_not_run(self):
+        with patch('octofit_tracker.serializers.fetch_names', wraps=fetch_names) as lookup:
+            self.client.get(reverse('activity-list'), {'fields': 'id,calories'})
+            lookup.assert_not_called()
+            self.client.get(reverse('activity-list'), {'fields': 'id,user_name'})
+            lookup.assert_called_once()
+    
+    def test_expand_adds_related_objects(self):
+        response = self.client.get(reverse('activity-list'), {'fields': 'id', 'expand': 'user'})
+        user = response.data['results'][0]['user']
+        self.assertEqual(user['id'], str(self.user._id))
+        self.assertEqual(user['name'], 'Tony Stark')
+        
+        response = self.client.get(reverse('user-detail', args=[str(self.user._id)]), {'expand': 'team'})
+        self.assertEqual(response.data['team']['name'], 'Team Marvel')
+        self.assertIn('email', response.data)
+    
+    def test_writes_ignore_fields(self):
+        url = reverse('workout-list') + '?fields=id'
+        response = self.client.post(url, {
+            'name': 'Yoga', 'description': 'Stretch', 'difficulty': 'Easy',
+            'duration': 20, 'calories_estimate': 80, 'category': 'Flexibility',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn('name', response.data)
+
+
+class FastJSONRendererTest(APITestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.client = APIClient()
+        self.user = User.objects.create(name='Tony Stark', email='ironman@marvel.com', password='stark123')
+        for calories in (300, 450):
+            Activity.objects.create(
+                user_id=str(self.user._id),
+                activity_type='Running',
+                duration=30,
+                calories=calories,
+                distance=5.5,
+                date=datetime.now()
+            )
+    
+    def test_output_matches_json_renderer(self):
+        url = reverse('activity-list')
+        plain = self.client.get(url)
+        fast = self.client.get(url, HTTP_ACCEPT=FAST_JSON_MEDIA_TYPE)
+        self.assertEqual(fast.status_code, status.HTTP_200_OK)
+        self.assertEqual(fast['Content-Type'], FAST_JSON_MEDIA_TYPE)
+        self.assertEqual(json.loads(fast.content), json.loads(plain.content))
+        
+        fast = self.client.get(url, {'format': 'fastjson'})
+        self.assertEqual(fast['Content-Type'], FAST_JSON_MEDIA_TYPE)
+        self.assertEqual(json.loads(fast.content), json.loads(plain.content))
+    
+    def test_encodes_drf_types(self):
+        data = {
+            'date': datetime(2024, 1, 1, 5, 6, 7, tzinfo=dt_timezone.utc),
+            'ratio': Decimal('1.5'),
+            'elapsed': timedelta(minutes=1),
+        }
+        self.assertEqual(json.loads(FastJSONRenderer().render(data)), json.loads(JSONRenderer().render(data)))
+        self.assertEqual(FastJSONRenderer().render({'id': ObjectId('64b7f0c2a1b2c3d4e5f60718')}),
+                         b'{"id":"64b7f0c2a1b2c3d4e5f60718"}')
+    
+    def test_parser_accepts_vendor_media_type(self):
+        response = self.client.post(
+            reverse('activity-list'),
+            json.dumps({
+                'user_id': str(self.user._id),
+                'activity_type': 'Cycling',
+                'duration': 60,
+                'calories': 500,
+                'date': '2024-01-01T10:00:00Z',
+            }),
+            content_type=FAST_JSON_MEDIA_TYPE
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        
+        response = self.client.post(reverse('activity-list'), '{bad', content_type=FAST_JSON_MEDIA_TYPE)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ActivityExportTest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.team = Team.objects.create(name='Team Marvel')
+        self.tony = User.objects.create(name='Tony Stark', email='ironman@marvel.com', password='stark123',
+                                        team_id=str(self.team._id))
+        self.clark = User.objects.create(name='Clark Kent', email='superman@dc.com', password='kent123')
+        for day, user in enumerate([self.tony, self.tony, self.tony, self.clark], start=1):
+            Activity.objects.create(
+                user_id=str(user._id),
+                activity_type='Running',
+                duration=30,
+                calories=100 * day,
+                date=datetime(2024, 1, day, 8, 0)
+            )
+    
+    def export(self, **params):
+        response = self.client.get(reverse('activity-export'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, b''.join(response.streaming_content).decode()
+    
+    def test_ndjson_streams_every_activity_with_user_names(self):
+        with patch('octofit_tracker.views.ActivityViewSet.export_batch_size', 3):
+            response, content = self.export()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([row['calories'] for row in rows], [400, 300, 200, 100])
+        self.assertEqual([row['user_name'] for row in rows], ['Clark Kent'] + ['Tony Stark'] * 3)
+        self.assertEqual(rows[0]['date'], '2024-01-04T08:00:00Z')
+    
+    def test_csv_has_a_header_row(self):
+        response, content = self.export(format='csv')
+        self.assertTrue(response['Content-Type'].startswith('text/csv'))
+        lines = content.splitlines()
+        self.assertEqual(lines[0], 'id,user_id,user_name,activity_type,duration,distance,calories,date,notes')
+        self.assertEqual(len(lines), 5)
+    
+    def test_filters(self):
+        _, content = self.export(team_id=str(self.team._id), date__gte='2024-01-02')
+        self.assertEqual([json.loads(line)['calories'] for line in content.splitlines()], [300, 200])
+        
+        _, content = self.export(user_id=str(self.clark._id), format='csv')
+        self.assertEqual(len(content.splitlines()), 2)
+        
+        response = self.client.get(reverse('activity-export'), {'date__gte': 'yesterday'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ActivityFilterTest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse('activity-list')
+        self.team = Team.objects.create(name='Team Marvel')
+        self.tony = User.objects.create(name='Tony Stark', email='ironman@marvel.com', password='stark123',
+                                        team_id=str(self.team._id))
+        self.clark = User.objects.create(name='Clark Kent', email='superman@dc.com', password='kent123')
+        for user, activity_type, calories, distance, day in [
+            (self.tony, 'Running', 300, 5.0, 1),
+            (self.tony, 'Yoga', 100, None, 3),
+            (self.tony, 'Running', 500, 10.0, 9),
+            (self.clark, 'Running', 400, 8.0, 2),
+        ]:
+            Activity.objects.create(
+                user_id=str(user._id),
+                activity_type=activity_type,
+                duration=30,
+                distance=distance,
+                calories=calories,
+                date=datetime(2024, 1, day, 8, 0, tzinfo=dt_timezone.utc)
+            )
+    
+    def calories(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [row['calories'] for row in response.data['results']]
+    
+    def test_user_and_date_range(self):
+        self.assertEqual(
+            self.calories(user_id=str(self.tony._id), date__gte='2024-01-01', date__lt='2024-01-08'),
+            [100, 300]
+        )
+    
+    def test_team_and_activity_type(self):
+        self.assertEqual(self.calories(team_id=str(self.team._id), activity_type='Running'), [500, 300])
+    
+    def test_calorie_and_distance_ranges(self):
+        self.assertEqual(
+            self.calories(user_id=str(self.tony._id), calories__gte=200, distance__lte=7.5),
+            [300]
+        )
+        self.assertEqual(
+            self.calories(activity_type='Running', date__gte='2024-01-01', date__lt='2024-02-01',
+                          calories__lte=400),
+            [400, 300]
+        )
+    
+    def test_unindexed_filter_without_bound_is_rejected(self):
+        response = self.client.get(self.url, {'activity_type': 'Running'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        
+        response = self.client.get(self.url, {'calories__gte': 100, 'date__gte': '2023-01-01',
+                                              'date__lt': '2024-02-01'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_invalid_number(self):
+        response = self.client.get(self.url, {'user_id': str(self.tony._id), 'calories__gte': 'lots'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('calories__gte', response.data)
+
+
+class ObjectIdReferenceTest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.team = Team.objects.create(name='Team Marvel')
+        self.user = User.objects.create(name='Tony Stark', email='ironman@marvel.com', password='stark123',
+                                        team_id=str(self.team._id))
+    
+    def test_references_are_stored_as_object_ids(self):
+        activity = Activity.objects.create(user_id=str(self.user._id), activity_type='Running', duration=30,
+                                           calories=300, date=datetime.now())
+        self.assertEqual(activity.user_id, self.user._id)
+        self.assertEqual(Activity.objects.mongo_find_one({'_id': activity._id})['user_id'], self.user._id)
+        self.assertEqual(User.objects.mongo_find_one({'_id': self.user._id})['team_id'], self.team._id)
+        self.assertEqual(Leaderboard.objects.mongo_find_one({'user_id': self.user._id})['team_id'], self.team._id)
+    
+    def test_api_reads_and_writes_hex_strings(self):
+        response = self.client.post(reverse('activity-list'), {
+            'user_id': str(self.user._id), 'activity_type': 'Running', 'duration': 30, 'calories': 300,
+            'date': datetime.now().isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['user_id'], str(self.user._id))
+        
+        response = self.client.get(reverse('activity-detail', args=[response.data['id']]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['user_name'], 'Tony Stark')
+        
+        response = self.client.post(reverse('activity-list'), {
+            'user_id': 'user123', 'activity_type': 'Running', 'duration': 30, 'calories': 300,
+            'date': datetime.now().isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('user_id', response.data)
+        
+        response = self.client.get(reverse('activity-list'), {'user_id': 'user123'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('activity-detail', args=['user123']))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_migrate_object_ids(self):
+        user_id, team_id = str(self.user._id), str(self.team._id)
+        loner = User.objects.mongo_insert_one({'name': 'Loner', 'email': 'loner@example.com', 'team_id': ''})
+        Activity.objects.mongo_insert_many([
+            {'user_id': user_id, 'activity_type': 'Running', 'duration': 30, 'calories': 300, 'date': datetime.now()},
+            {'user_id': 'legacy', 'activity_type': 'Yoga', 'duration': 30, 'calories': 100, 'date': datetime.now()},
+        ])
+        Leaderboard.objects.mongo_insert_one({'user_id': user_id, 'team_id': team_id, 'total_calories': 300})
+        
+        out = StringIO()
+        call_command('migrate_object_ids', batch_size=1, stdout=out)
+        self.assertIn('activities: 1 converted, 1 left with invalid ids', out.getvalue())
+        self.assertEqual(Activity.objects.mongo_count_documents({'user_id': self.user._id}), 1)
+        self.assertEqual(Activity.objects.mongo_count_documents({'user_id': 'legacy'}), 1)
+        self.assertIsNone(User.objects.mongo_find_one({'_id': loner.inserted_id})['team_id'])
+        entry = Leaderboard.objects.mongo_find_one({'user_id': self.user._id})
+        self.assertEqual(entry['team_id'], self.team._id)
+        
+        out = StringIO()
+        call_command('migrate_object_ids', stdout=out)
+        self.assertIn('activities: 0 converted, 1 left with invalid ids', out.getvalue())
+
+
+class MetricsTest(APITestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.client = APIClient()
+        User.objects.create(name='Tony Stark', email='ironman@marvel.com', password='stark123')
+    
+    def series(self, name, **labels):
+        """
+        The value of one series on /metrics
+        """
+        response = self.client.get(reverse('metrics'))
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        selector = name + '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+        for line in response.content.decode().splitlines():
+            if line.startswith(selector + ' '):
+                return float(line.rsplit(' ', 1)[1])
+        return 0
+    
+    def test_requests_are_measured_per_view(self):
+        before = self.series('octofit_http_requests_total', view='user-list', method='GET', status=200)
+        queries_before = self.series('octofit_http_request_db_queries_sum', view='user-list', method='GET')
+        self.client.get(reverse('user-list'))
+        self.client.get(reverse('user-list'))
+        self.assertEqual(self.series('octofit_http_requests_total', view='user-list', method='GET', status=200),
+                         before + 2)
+        self.assertGreaterEqual(self.series('octofit_http_request_db_queries_sum', view='user-list', method='GET'),
+                                queries_before + 2)
+        self.assertGreater(self.series('octofit_http_response_size_bytes_sum', view='user-list', method='GET'), 0)
+    
+    def test_slow_queries_are_logged(self):
+        with self.settings(SLOW_QUERY_THRESHOLD_MS=0), self.assertLogs('octofit_tracker.slow_queries') as logs:
+            self.client.get(reverse('user-list'))
+        self.assertIn('Slow Mongo find', logs.output[0])
+
+
+class MetricsMiddlewareAsyncTest(SimpleTestCase):
+    async def test_async_views_run_concurrently(self):
+        # Each request waits until both are inside the view: if the
+        # middleware chain were adapted to sync they'd run one at a time
+        inside = 0
+        both_inside = asyncio.Event()
+        
+        async def list_(view, request):
+            nonlocal inside
+            inside += 1
+            if inside == 2:
+                both_inside.set()
+            await asyncio.wait_for(both_inside.wait(), timeout=5)
+            return {'results': []}
+        
+        before = DB_QUERIES.totals(('async-team-list', 'GET'))[1]
+        with patch.object(AsyncListView, 'list', list_):
+            responses = await asyncio.gather(
+                *(self.async_client.get(reverse('async-team-list')) for _ in range(2))
+            )
+        self.assertEqual([response.status_code for response in responses], [200, 200])
+        self.assertEqual(DB_QUERIES.totals(('async-team-list', 'GET'))[1], before + 2)
+
+
+class HistogramTest(SimpleTestCase):
+    def test_text_format(self):
+        histogram = Histogram('latency_seconds', 'Latency', (0.1, 1), labelnames=('view',))
+        histogram.observe(('home',), 0.05)
+        histogram.observe(('home',), 0.5)
+        histogram.observe(('home',), 5)
+        self.assertEqual(list(histogram.collect()), [
+            '# HELP latency_seconds Latency',
+            '# TYPE latency_seconds histogram',
+            'latency_seconds_bucket{view="home",le="0.1"} 1',
+            'latency_seconds_bucket{view="home",le="1"} 2',
+            'latency_seconds_bucket{view="home",le="+Inf"} 3',
+            'latency_seconds_sum{view="home"} 5.55',
+            'latency_seconds_count{view="home"} 3',
+        ])
@@ -16,8 +16,11 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from .async_views import AsyncListView
+from .metrics import metrics_view
 from .views import (
     api_root,
+    response_cache_stats,
     UserViewSet,
     TeamViewSet,
     ActivityViewSet,
@@ -44,5 +47,11 @@ else:
 urlpatterns = [
     path('', api_root, name='api-root'),
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
+    path('api/cache/stats/', response_cache_stats, name='cache-stats'),
+    path('api/async/users/', AsyncListView.as_view(viewset=UserViewSet), name='async-user-list'),
+    path('api/async/teams/', AsyncListView.as_view(viewset=TeamViewSet), name='async-team-list'),
+    path('api/async/activities/', AsyncListView.as_view(viewset=ActivityViewSet), name='async-activity-list'),
+    path('api/async/leaderboard/', AsyncListView.as_view(viewset=LeaderboardViewSet), name='async-leaderboard-list'),
     path('api/', include(router.urls)),
 ]
@@ -1,5 +1,10 @@
+from datetime import timedelta
+from functools import partial
+from django.http import Http404
+from django.utils import timezone
 from rest_framework import viewsets, status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import action, api_view
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
 from .models import User, Team, Activity, Leaderboard, Workout
@@ -8,11 +13,78 @@ from .serializers import (
     TeamSerializer,
     ActivitySerializer,
     LeaderboardSerializer,
+    TeamLeaderboardSerializer,
     WorkoutSerializer
 )
+from .cache import CachedResponseMixin, activity_namespaces, cache_api_view, cache_stats, cached_response
+from .export import EXPORT_BATCH_SIZE, export_response
+from .fields import to_object_id
+from .filters import activity_match, check_indexed, parse_datetime_param, parse_number_param
+from .ingest import ingest_activities, iter_json_array, iter_ndjson
+from .ranking import get_rank_index
+from .renderers import CSVRenderer, NDJSONRenderer
+from .repository import (
+    find_activities,
+    find_leaderboard,
+    get_team,
+    get_user,
+    leaderboard_entries,
+    team_leaderboard,
+    team_members,
+)
+from .rollups import BUCKETS, user_timeline
+from .stats import GROUP_KEYS, activity_stats
+
+
+class ObjectIdLookupMixin:
+    """
+    Detail routes take the hex string of the document's _id; djongo's
+    primary key field doesn't convert strings in lookups, so convert it here
+    """
+    
+    def get_object(self):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        pk = to_object_id(self.kwargs[lookup_url_kwarg])
+        if pk is None:
+            raise Http404
+        self.kwargs[lookup_url_kwarg] = pk
+        return super().get_object()
+
+
+class RepositoryListMixin:
+    """
+    Serve the list action from a direct pymongo read (see repository.py)
+    instead of the ORM queryset: find_rows(query, sort, limit) returns
+    records for a Mongo filter, with the keyset pagination condition
+    already ANDed into list_query()
+    """
+    cursor_nulls_last = ()
+    
+    def list_query(self, request):
+        return {}
+    
+    def find_rows(self, query, sort, limit):
+        raise NotImplementedError
+    
+    def list(self, request, *args, **kwargs):
+        paginator = self.paginator
+        ordering, position = paginator.start(request, self.queryset.model, self.cursor_ordering, self.cursor_nulls_last)
+        query = self.list_query(request)
+        if position is not None:
+            after = paginator.mongo_after(ordering, position)
+            query = {'$and': [query, after]} if query else after
+        rows = []
+        for read_query, sort in paginator.mongo_reads(query, ordering):
+            rows += self.find_rows(read_query, sort, paginator.page_size + 1 - len(rows))
+            if len(rows) > paginator.page_size:
+                break
+        page = paginator.finish(rows, position)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
 
 @api_view(['GET'])
+@cache_api_view('root')
 def api_root(request, format=None):
     """
     API root endpoint that provides links to all available endpoints
@@ -26,41 +98,219 @@ def api_root(request, format=None):
     })
 
 
-class UserViewSet(viewsets.ModelViewSet):
+@api_view(['GET'])
+def response_cache_stats(request):
+    """
+    Hit/miss counters of this process's response cache
+    """
+    return Response(cache_stats())
+
+
+class UserViewSet(ObjectIdLookupMixin, viewsets.ModelViewSet):
     """
     API endpoint for viewing and editing users
     """
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    
+    @action(detail=True, methods=['get'])
+    def timeline(self, request, pk=None):
+        """
+        The user's activity totals per day or ISO week, read from the daily
+        rollups; defaults to the last year
+        """
+        user = get_user(pk)
+        if user is None:
+            raise NotFound()
+        bucket = request.query_params.get('bucket', 'day')
+        if bucket not in BUCKETS:
+            raise ValidationError({'bucket': f'Must be one of: {", ".join(BUCKETS)}.'})
+        return cached_response(
+            request, activity_namespaces(user._id), partial(self.compute_timeline, request, user._id, bucket)
+        )
+    
+    def compute_timeline(self, request, user_id, bucket):
+        until = parse_datetime_param(request.query_params, 'date__lt')
+        since = parse_datetime_param(request.query_params, 'date__gte')
+        if since is None:
+            since = (until or timezone.now()) - timedelta(days=365)
+        results = user_timeline(user_id, bucket, since, until)
+        return Response({'user_id': str(user_id), 'bucket': bucket, 'results': results})
 
 
-class TeamViewSet(viewsets.ModelViewSet):
+class TeamViewSet(ObjectIdLookupMixin, viewsets.ModelViewSet):
     """
     API endpoint for viewing and editing teams
     """
     queryset = Team.objects.all()
     serializer_class = TeamSerializer
+    
+    @action(detail=False, methods=['get'], url_path='leaderboard')
+    def leaderboard(self, request):
+        """
+        Teams ranked by total calories, read from the team leaderboard in one query
+        """
+        return cached_response(request, ['leaderboard', 'teams'], partial(self.list_team_leaderboard, request))
+    
+    def list_team_leaderboard(self, request):
+        serializer = TeamLeaderboardSerializer(team_leaderboard(), many=True, context={'request': request})
+        return Response(serializer.data)
+    
+    @action(detail=True, methods=['get'])
+    def members(self, request, pk=None):
+        """
+        The team's users, keyset paginated by id
+        """
+        team = get_team(pk)
+        if team is None:
+            raise NotFound()
+        paginator = self.paginator
+        ordering, position = paginator.start(request, User)
+        members = team_members(
+            team._id,
+            query=paginator.mongo_after(ordering, position) if position is not None else None,
+            sort=paginator.mongo_sort(ordering),
+            limit=paginator.page_size + 1
+        )
+        page = paginator.finish(members, position)
+        serializer = UserSerializer(page, many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
 
 
-class ActivityViewSet(viewsets.ModelViewSet):
+class ActivityViewSet(ObjectIdLookupMixin, CachedResponseMixin, RepositoryListMixin, viewsets.ModelViewSet):
     """
     API endpoint for viewing and editing activities
     """
     queryset = Activity.objects.all().order_by('-date')
     serializer_class = ActivitySerializer
+    cursor_ordering = ('-date', '-_id')
+    bulk_chunk_size = 1000
+    bulk_max_errors = 1000
+    export_batch_size = EXPORT_BATCH_SIZE
+    cache_namespaces = ('activities', 'users')
+    
+    def list_query(self, request):
+        """
+        The activity filters, refusing ones that would scan the collection
+        """
+        match = activity_match(request.query_params)
+        check_indexed(match)
+        return match
+    
+    def find_rows(self, query, sort, limit):
+        return find_activities(query=query, sort=sort, limit=limit)
+    
+    def get_cache_namespaces(self, request):
+        # A single user's list only changes with that user's activities
+        user_id = to_object_id(request.query_params.get('user_id'))
+        if user_id is not None and not request.query_params.get('team_id'):
+            return activity_namespaces(user_id) + ['users']
+        return self.cache_namespaces
+    
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request):
+        """
+        Ingest a JSON array or an NDJSON stream of activities in chunks
+        """
+        stream = request.stream
+        if stream is None:
+            raise ValidationError({'non_field_errors': ['Request body is empty.']})
+        if request.content_type.startswith('application/x-ndjson'):
+            items = iter_ndjson(stream)
+        else:
+            items = iter_json_array(stream)
+        
+        result = ingest_activities(
+            items,
+            chunk_size=self.bulk_chunk_size,
+            max_errors=self.bulk_max_errors,
+            context=self.get_serializer_context()
+        )
+        if result.payload_error:
+            return Response(result.as_dict(), status=status.HTTP_400_BAD_REQUEST)
+        return Response(result.as_dict(), status=status.HTTP_200_OK)
+    
+    @action(detail=False, methods=['get'], url_path='stats')
+    def stats(self, request):
+        """
+        Activity totals grouped by activity_type, day, week, user or team;
+        ?top=N keeps the N groups with the most calories
+        """
+        group_by = request.query_params.get('group_by', 'activity_type')
+        if group_by not in GROUP_KEYS:
+            raise ValidationError({'group_by': f'Must be one of: {", ".join(GROUP_KEYS)}.'})
+        top = parse_number_param(request.query_params, 'top', int)
+        if top is not None and top < 1:
+            raise ValidationError({'top': 'Must be at least 1.'})
+        return cached_response(
+            request,
+            activity_namespaces(request.query_params.get('user_id')) + ['users', 'teams'],
+            partial(self.compute_stats, request, group_by, top)
+        )
+    
+    def compute_stats(self, request, group_by, top):
+        results = activity_stats(group_by, activity_match(request.query_params), top)
+        return Response({'group_by': group_by, 'results': results})
+    
+    @action(detail=False, methods=['get'], url_path='export', renderer_classes=[NDJSONRenderer, CSVRenderer])
+    def export(self, request, format=None):
+        """
+        Stream the activities matching user_id, team_id, date__gte and
+        date__lt as NDJSON (the default) or CSV (?format=csv)
+        """
+        match = activity_match(request.query_params)
+        return export_response(match, request.accepted_renderer.format, self.export_batch_size)
 
 
-class LeaderboardViewSet(viewsets.ModelViewSet):
+class LeaderboardViewSet(ObjectIdLookupMixin, CachedResponseMixin, RepositoryListMixin, viewsets.ModelViewSet):
     """
     API endpoint for viewing and editing leaderboard
     """
     queryset = Leaderboard.objects.all().order_by('rank')
     serializer_class = LeaderboardSerializer
+    cursor_ordering = ('rank', '_id')
+    # Rows not ranked yet are listed after the ranked ones
+    cursor_nulls_last = ('rank',)
+    cache_namespaces = ('leaderboard', 'users', 'teams')
+    max_around_radius = 50
+    
+    def find_rows(self, query, sort, limit):
+        return find_leaderboard(query, sort, limit)
+    
+    def list(self, request, *args, **kwargs):
+        around = request.query_params.get('around')
+        if around is None:
+            return super().list(request, *args, **kwargs)
+        return self.list_around(request, around)
+    
+    def list_around(self, request, user_id):
+        """
+        The user and their neighbours on the board, served from the rank index
+        """
+        try:
+            radius = min(int(request.query_params.get('radius', 5)), self.max_around_radius)
+        except ValueError:
+            raise ValidationError({'radius': 'A valid integer is required.'})
+        
+        user_id = to_object_id(user_id)
+        neighbours = None if user_id is None else get_rank_index().around(user_id, max(radius, 0))
+        if neighbours is None:
+            raise NotFound('User is not on the leaderboard.')
+        
+        entries = leaderboard_entries(user for user, _, _ in neighbours)
+        ordered = []
+        for user, _, rank in neighbours:
+            if user in entries:
+                entries[user].rank = rank
+                ordered.append(entries[user])
+        serializer = self.get_serializer(ordered, many=True)
+        return Response(serializer.data)
 
 
-class WorkoutViewSet(viewsets.ModelViewSet):
+class WorkoutViewSet(ObjectIdLookupMixin, CachedResponseMixin, viewsets.ModelViewSet):
     """
     API endpoint for viewing and editing workouts
     """
     queryset = Workout.objects.all()
     serializer_class = WorkoutSerializer
+    cache_namespaces = ('workouts',)
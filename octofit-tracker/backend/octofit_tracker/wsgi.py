@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
 
 application = get_wsgi_application()
+
+# Run background jobs in this process (TASK_WORKERS threads)
+from octofit_tracker.tasks import start_workers  # noqa: E402
+
+start_workers()